@@ -3,10 +3,17 @@
 from __future__ import division
 from __future__ import print_function
 
+from collections import OrderedDict
+import os
+import uuid
+import warnings
+
 import pandas as pd
 import numpy as np
 from six.moves import range
 
+from .utils import GzipFile, format_chromo
+
 
 def read_bed(filename, sort=False, usecols=[0, 1, 2], *args, **kwargs):
     """Read chromo,start,end from BED file without formatting chromo."""
@@ -39,18 +46,12 @@ def in_which(x, ys, ye):
     :class:`numpy.ndarray`
         n:class:`numpy.ndarray` with indices of overlapping intervals or -1.
     """
-    n = len(ys)
-    m = len(x)
-    rv = np.empty(m, dtype=np.int)
-    rv.fill(-1)
-    i = 0
-    j = 0
-    while i < n and j < m:
-        while j < m and x[j] <= ye[i]:
-            if x[j] >= ys[i]:
-                rv[j] = i
-            j += 1
-        i += 1
+    x = np.asarray(x)
+    ys = np.asarray(ys)
+    ye = np.asarray(ye)
+    rv = np.searchsorted(ys, x, side='right') - 1
+    if len(ys):
+        rv[(rv >= 0) & (x > ye[np.maximum(rv, 0)])] = -1
     return rv
 
 
@@ -62,6 +63,8 @@ def is_in(pos, start, end):
 def distance(pos, start, end):
     """Return shortest distance between a position and a list of intervals.
 
+    Intervals must be non-overlapping and sorted in ascending order.
+
     Parameters
     ----------
     pos: list
@@ -76,20 +79,20 @@ def distance(pos, start, end):
         :class:`numpy.ndarray` of same length as `pos` with shortest distance
         between each `pos[i]` and any interval.
     """
-    m = len(start)
-    n = len(pos)
-    i = 0
-    j = 0
-    end_prev = -10**7
-    dist = np.zeros(n)
-    while i < m and j < n:
-        while j < n and pos[j] <= end[i]:
-            if pos[j] < start[i]:
-                dist[j] = min(pos[j] - end_prev, start[i] - pos[j])
-            j += 1
-        end_prev = end[i]
-        i += 1
-    dist[j:] = pos[j:] - end_prev
+    pos = np.asarray(pos, dtype=np.int64)
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+    # Index of first interval that ends at or after `pos`.
+    right = np.searchsorted(end, pos, side='left')
+    end_prev = np.empty(len(pos), dtype=np.int64)
+    end_prev.fill(-10**7)
+    tmp = right > 0
+    end_prev[tmp] = end[right[tmp] - 1]
+    dist = pos - end_prev
+    tmp = right < len(start)
+    start_next = start[right[tmp]]
+    dist[tmp] = np.minimum(dist[tmp], np.maximum(start_next - pos[tmp], 0))
+    dist = dist.astype(np.float64)
     assert np.all(dist >= 0)
     return dist
 
@@ -221,3 +224,144 @@ def extend_len_frame(d, min_len):
     e['start'] = start
     e['end'] = end
     return e
+
+
+def _join_overlapping_sorted(start, end):
+    """Vectorized version of :func:`join_overlapping`.
+
+    `start` must be sorted in ascending order.
+    """
+    if len(start) == 0:
+        return (start, end)
+    end_max = np.maximum.accumulate(end)
+    new = np.empty(len(start), dtype=bool)
+    new[0] = True
+    new[1:] = start[1:] > end_max[:-1]
+    idx = np.flatnonzero(new)
+    last = np.append(idx[1:], len(start)) - 1
+    return (start[idx], end_max[last])
+
+
+def get_index_file(filename):
+    """Return name of the annotation index file of BED file `filename`."""
+    return '%s.idx.npz' % filename
+
+
+def index_bed(filename, chromos=None, nb_sample=None):
+    """Build annotation index from BED file.
+
+    Reads BED file, formats chromosome names, and joins overlapping intervals.
+
+    Parameters
+    ----------
+    filename: str
+        Path of BED file. Can be gzip compressed.
+    chromos: list
+        List of formatted chromosomes to be indexed.
+    nb_sample: int
+        Maximum number of intervals that are read.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict` with chromosomes as keys and tuples (`start`, `end`) of
+        sorted, non-overlapping intervals as values.
+    """
+    bed_file = GzipFile(filename, 'r')
+    d = pd.read_table(bed_file, header=None, usecols=[0, 1, 2],
+                      dtype={0: 'str', 1: 'int32', 2: 'int32'},
+                      nrows=nb_sample)
+    bed_file.close()
+    d.columns = ['chromo', 'start', 'end']
+    d['chromo'] = format_chromo(d['chromo'])
+    if chromos is not None:
+        d = d.loc[d.chromo.isin(chromos)]
+    d = d.sort_values(['chromo', 'start', 'end'])
+    index = OrderedDict()
+    for chromo, dc in d.groupby('chromo', sort=True):
+        index[chromo] = _join_overlapping_sorted(dc['start'].values,
+                                                 dc['end'].values)
+    return index
+
+
+def write_index(index, filename):
+    """Write annotation index from :func:`index_bed` to npz file.
+
+    The index is written to a temporary file that is renamed to `filename`,
+    such that processes that read `filename` at the same time never see a
+    partially written index.
+    """
+    data = dict()
+    for chromo, (start, end) in index.items():
+        data['start_%s' % chromo] = start
+        data['end_%s' % chromo] = end
+    tmp_file = '%s.%s.tmp' % (filename, uuid.uuid4().hex)
+    try:
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, **data)
+        os.rename(tmp_file, filename)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def read_index(filename):
+    """Read annotation index written by :func:`write_index`."""
+    index = OrderedDict()
+    data = np.load(filename)
+    for key in sorted(data.files):
+        if key.startswith('start_'):
+            chromo = key[len('start_'):]
+            index[chromo] = (data[key], data['end_%s' % chromo])
+    data.close()
+    return index
+
+
+def read_anno_index(filename, chromos=None, cache=False):
+    """Read annotation index of BED file.
+
+    Builds the index with :func:`index_bed`. If `cache` is `True`, the index
+    is stored next to the BED file and reused as long as it is newer than the
+    BED file. The index is not stored if the directory of the BED file is not
+    writable.
+
+    Parameters
+    ----------
+    filename: str
+        Path of BED file.
+    chromos: list
+        List of formatted chromosomes to be returned.
+    cache: bool
+        If `True`, read index from or write index to cache file.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict` with chromosomes as keys and tuples (`start`, `end`) of
+        sorted, non-overlapping intervals as values.
+    """
+    index = None
+    index_file = get_index_file(filename)
+    if cache and os.path.isfile(index_file) and \
+            os.path.getmtime(index_file) >= os.path.getmtime(filename):
+        index = read_index(index_file)
+    if index is None:
+        index = index_bed(filename)
+        if cache:
+            try:
+                write_index(index, index_file)
+            except (IOError, OSError) as err:
+                warnings.warn('Annotation index of %s not cached: %s' %
+                              (filename, err))
+    if chromos is not None:
+        index = OrderedDict([(chromo, index[chromo]) for chromo in index
+                             if chromo in chromos])
+    return index
+
+
+def get_chromo_intervals(index, chromo):
+    """Return intervals (`start`, `end`) of `chromo` in annotation index."""
+    if chromo in index:
+        return index[chromo]
+    empty = np.array([], dtype=np.int32)
+    return (empty, empty)
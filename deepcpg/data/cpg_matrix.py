@@ -0,0 +1,201 @@
+"""Sparse matrix of methylation states of multiple cells.
+
+Single-cell methylation profiles typically cover only a small fraction of CpG
+sites, such that a dense [sites, cells] matrix mostly consists of `CPG_NAN`.
+:class:`CpgMatrix` only stores observed states in compressed sparse row (CSR)
+format and is densified chunk-wise if needed.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import six
+
+from .utils import CPG_NAN
+
+
+class CpgMatrix(object):
+    """Sparse [sites, cells] matrix of methylation states in CSR format.
+
+    Observed states of site `i` are stored in `data[indptr[i]:indptr[i+1]]`
+    and the corresponding cell indices in `indices[indptr[i]:indptr[i+1]]`.
+    In contrast to :mod:`scipy.sparse` matrices, stored zeros are always
+    treated as observed states.
+
+    Parameters
+    ----------
+    indptr: :class:`numpy.ndarray`
+        Row pointer of length [sites + 1].
+    indices: :class:`numpy.ndarray`
+        Cell indices of observed states.
+    data: :class:`numpy.ndarray`
+        Observed methylation states.
+    nb_cell: int
+        Number of cells.
+    """
+
+    def __init__(self, indptr, indices, data, nb_cell):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.data = np.asarray(data)
+        self.nb_cell = nb_cell
+
+    @classmethod
+    def from_profiles(cls, profiles, pos):
+        """Build matrix from CpG profiles of cells at positions `pos`.
+
+        Parameters
+        ----------
+        profiles: list
+            List of tuples (`pos`, `value`) with sorted positions and states of
+            each cell.
+        pos: :class:`numpy.ndarray`
+            Sorted positions of matrix rows. Positions in `profiles` that are
+            not in `pos` are ignored.
+
+        Returns
+        -------
+        :class:`CpgMatrix`
+            Matrix with one row per position and one column per cell.
+        """
+        rows = []
+        cols = []
+        values = []
+        for cell, (cell_pos, cell_value) in enumerate(profiles):
+            idx = np.searchsorted(pos, cell_pos)
+            idx = np.minimum(idx, max(len(pos) - 1, 0))
+            keep = pos[idx] == cell_pos if len(pos) else \
+                np.zeros(len(cell_pos), dtype=bool)
+            rows.append(idx[keep])
+            cols.append(np.repeat(np.int32(cell), keep.sum()))
+            values.append(cell_value[keep])
+        if len(rows):
+            rows = np.concatenate(rows)
+            cols = np.concatenate(cols)
+            values = np.concatenate(values)
+        else:
+            rows = np.array([], dtype=np.int64)
+            cols = np.array([], dtype=np.int32)
+            values = np.array([], dtype=np.int8)
+        order = np.argsort(rows, kind='mergesort')
+        indptr = np.zeros(len(pos) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(pos)), out=indptr[1:])
+        return cls(indptr, cols[order], values[order], len(profiles))
+
+    @property
+    def nb_site(self):
+        return len(self.indptr) - 1
+
+    @property
+    def shape(self):
+        return (self.nb_site, self.nb_cell)
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def __len__(self):
+        return self.nb_site
+
+    def __getitem__(self, idx):
+        """Select rows by slice, boolean mask, or integer index array."""
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self.nb_site)
+            if step == 1:
+                stop = max(start, stop)
+                indptr = self.indptr[start:stop + 1]
+                data_idx = slice(indptr[0], indptr[-1])
+                return CpgMatrix(indptr - indptr[0], self.indices[data_idx],
+                                 self.data[data_idx], self.nb_cell)
+            idx = np.arange(start, stop, step)
+        idx = np.asarray(idx)
+        if idx.dtype == bool:
+            if len(idx) != self.nb_site:
+                raise ValueError('Boolean index must be of length %d!' %
+                                 self.nb_site)
+            idx = np.flatnonzero(idx)
+        starts = self.indptr[idx]
+        counts = self.indptr[idx + 1] - starts
+        indptr = np.zeros(len(idx) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        # Index of each selected element in `data`
+        data_idx = np.arange(indptr[-1]) - np.repeat(indptr[:-1], counts) + \
+            np.repeat(starts, counts)
+        return CpgMatrix(indptr, self.indices[data_idx], self.data[data_idx],
+                         self.nb_cell)
+
+    def row_ids(self):
+        """Return row index of each stored state."""
+        return np.repeat(np.arange(self.nb_site), np.diff(self.indptr))
+
+    def coverage(self):
+        """Return number of observed cells per site."""
+        return np.diff(self.indptr)
+
+    def todense(self, nan=CPG_NAN, dtype=None):
+        """Return dense [sites, cells] matrix with `nan` for missing states."""
+        if dtype is None:
+            dtype = self.dtype
+        mat = np.empty(self.shape, dtype=dtype)
+        mat.fill(nan)
+        mat[self.row_ids(), self.indices] = self.data
+        return mat
+
+    def moments(self, minmax=False):
+        """Compute count, sum, and sum of squares of observed states per site.
+
+        Returns
+        -------
+        tuple
+            Tuple (`count`, `total`, `total2`, `vmin`, `vmax`) as
+            :func:`deepcpg.data.stats.moments`.
+        """
+        row_ids = self.row_ids()
+        data = self.data.astype(np.float32)
+        count = self.coverage().astype(np.float32)
+        total = np.bincount(row_ids, weights=data,
+                            minlength=self.nb_site).astype(np.float32)
+        total2 = np.bincount(row_ids, weights=data**2,
+                             minlength=self.nb_site).astype(np.float32)
+        vmin = None
+        vmax = None
+        if minmax:
+            vmin = np.empty(self.nb_site, dtype=np.float32)
+            vmin.fill(np.inf)
+            vmax = np.empty(self.nb_site, dtype=np.float32)
+            vmax.fill(-np.inf)
+            observed = count > 0
+            if np.any(observed):
+                starts = self.indptr[:-1][observed]
+                vmin[observed] = np.minimum.reduceat(data, starts)
+                vmax[observed] = np.maximum.reduceat(data, starts)
+        return (count, total, total2, vmin, vmax)
+
+    def __repr__(self):
+        return '<CpgMatrix %d x %d with %d observed states>' % (
+            self.nb_site, self.nb_cell, len(self.data))
+
+
+def from_profiles(profiles, chromo, pos):
+    """Build :class:`CpgMatrix` of chromosome `chromo` from CpG profiles.
+
+    Parameters
+    ----------
+    profiles: dict
+        `dict` with cell names as keys and CpG profiles returned by
+        :func:`deepcpg.data.utils.parse_cpg_profile` as values.
+    chromo: str
+        Chromosome.
+    pos: :class:`numpy.ndarray`
+        Sorted positions of matrix rows.
+
+    Returns
+    -------
+    :class:`CpgMatrix`
+        Matrix with one column per cell in the order of `profiles`.
+    """
+    empty = (np.array([], dtype=np.int32), np.array([], dtype=np.int8))
+    chromo_profiles = [profile.get(chromo, empty)
+                       for profile in six.itervalues(profiles)]
+    return CpgMatrix.from_profiles(chromo_profiles, pos)
@@ -105,3 +105,154 @@ def int_to_onehot(seqs, dim=4):
 def onehot_to_int(seqs, axis=-1):
     """Translates one-hot sequences to integer sequences."""
     return seqs.argmax(axis=axis)
+
+
+def seq_to_int(seq):
+    """Translate chars of sequence `seq` to ints at once.
+
+    Vectorized version of :func:`char_to_int`, which encodes lower case chars
+    like upper case chars and unknown chars as 'N'.
+
+    Parameters
+    ----------
+    seq: str
+        DNA sequence.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        :class:`numpy.ndarray` with integer-encoded `seq`.
+    """
+    table = np.empty(256, dtype=np.int8)
+    table.fill(CHAR_TO_INT['N'])
+    for char, value in CHAR_TO_INT.items():
+        table[ord(char)] = value
+        table[ord(char.lower())] = value
+    return table[np.frombuffer(seq.encode(), dtype=np.uint8)]
+
+
+def find_cpgs(seq, seq_index=1):
+    """Return positions of CpG sites in sequence `seq`.
+
+    Parameters
+    ----------
+    seq: str or :class:`numpy.ndarray`
+        DNA sequence or integer-encoded sequence returned by
+        :func:`seq_to_int`.
+    seq_index: int
+        Offset at which positions start.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        :class:`numpy.ndarray` with positions of the 'C' of all 'CG'
+        dinucleotides.
+    """
+    if not isinstance(seq, np.ndarray):
+        seq = seq_to_int(seq)
+    idx = (seq[:-1] == CHAR_TO_INT['C']) & (seq[1:] == CHAR_TO_INT['G'])
+    return (np.flatnonzero(idx) + seq_index).astype(np.int32)
+
+
+def extract_windows(seq, pos, wlen, seq_index=1):
+    """Extract sequence windows centered on positions `pos`.
+
+    Windows that exceed the sequence borders are padded by 'N', which are
+    replaced by random nucleotides like all other 'N' in windows.
+
+    Parameters
+    ----------
+    seq: str or :class:`numpy.ndarray`
+        DNA sequence or integer-encoded sequence returned by
+        :func:`seq_to_int`.
+    pos: :class:`numpy.ndarray`
+        Positions at which windows are extracted.
+    wlen: int
+        Window length, which must be odd.
+    seq_index: int
+        Offset at which positions start.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        [len(pos), wlen] :class:`numpy.ndarray` with integer-encoded windows.
+    """
+    if wlen % 2 == 0:
+        raise ValueError('Window length must be odd!')
+    if not isinstance(seq, np.ndarray):
+        seq = seq_to_int(seq)
+    pos = np.asarray(pos, dtype=np.int64) - seq_index
+    invalid = (pos < 0) | (pos >= len(seq))
+    if np.any(invalid):
+        raise ValueError('Position %d not on chromosome!' %
+                         (pos[invalid][0] + seq_index))
+    idx = np.expand_dims(pos, 1) + np.arange(wlen) - wlen // 2
+    outside = (idx < 0) | (idx >= len(seq))
+    wins = seq[np.clip(idx, 0, len(seq) - 1)].astype(np.int8)
+    wins[outside] = CHAR_TO_INT['N']
+    # Randomly choose missing nucleotides
+    idx = wins == CHAR_TO_INT['N']
+    wins[idx] = np.random.randint(0, 4, idx.sum())
+    return wins
+
+
+def get_substitutions(seqs, start=0, end=None):
+    """Return all single-nucleotide substitutions of one-hot sequences.
+
+    Parameters
+    ----------
+    seqs: :class:`numpy.ndarray`
+        [nb_seq, seq_len, 4] :class:`numpy.ndarray` of one-hot encoded
+        sequences.
+    start: int
+        First position that is substituted.
+    end: int
+        Position after the last position that is substituted.
+
+    Returns
+    -------
+    tuple
+        Tuple (`seq_idx`, `pos`, `base`) of :class:`numpy.ndarray` with the
+        sequence index, position, and alternative base of all substitutions.
+        Unknown bases, which are encoded as [0, 0, 0, 0], are not substituted.
+    """
+    if end is None:
+        end = seqs.shape[1]
+    ref = seqs[:, start:end].argmax(axis=2)
+    known = seqs[:, start:end].max(axis=2) > 0
+    seq_idx, pos = np.nonzero(known)
+    ref = ref[seq_idx, pos]
+    nb_base = seqs.shape[2]
+    # Alternative bases of each position
+    base = (np.expand_dims(ref, 1) + np.arange(1, nb_base)) % nb_base
+    seq_idx = np.repeat(seq_idx, nb_base - 1)
+    pos = np.repeat(pos + start, nb_base - 1)
+    return (seq_idx, pos, base.ravel())
+
+
+def substitute(seqs, seq_idx, pos, base):
+    """Return copies of one-hot sequences with substituted bases.
+
+    Parameters
+    ----------
+    seqs: :class:`numpy.ndarray`
+        [nb_seq, seq_len, 4] :class:`numpy.ndarray` of one-hot encoded
+        sequences.
+    seq_idx: :class:`numpy.ndarray`
+        Index of sequences in `seqs` that are substituted.
+    pos: :class:`numpy.ndarray`
+        Position of substitutions.
+    base: :class:`numpy.ndarray`
+        Alternative bases.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        [len(seq_idx), seq_len, 4] :class:`numpy.ndarray` with one
+        substitution per sequence.
+    """
+    mut_seqs = seqs[seq_idx]
+    idx = np.arange(len(seq_idx))
+    mut_seqs[idx, pos] = 0
+    mut_seqs[idx, pos, base] = 1
+    return mut_seqs
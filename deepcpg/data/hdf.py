@@ -12,6 +12,54 @@ from six.moves import range
 
 from ..utils import filter_regex, to_list
 
+# Attribute of two-dimensional datasets with the names of columns. Columns are
+# listed and read as virtual datasets '<dataset>/<column>'.
+COLUMNS_ATTR = 'columns'
+
+
+def get_columns(item):
+    """Return column names of dataset `item` or `None` if not defined."""
+    if not isinstance(item, h5.Dataset) or item.ndim != 2 or \
+            COLUMNS_ATTR not in item.attrs:
+        return None
+    columns = []
+    for column in item.attrs[COLUMNS_ATTR]:
+        if isinstance(column, bytes):
+            column = column.decode()
+        columns.append(column)
+    return columns
+
+
+def resolve(group, name):
+    """Resolve name of dataset or virtual column in `group`.
+
+    Returns
+    -------
+    tuple
+        Tuple (`dataset`, `column`) with name of dataset and index of column
+        `name` in `dataset`. `column` is `None` if `name` is a dataset, and
+        `dataset` is `None` if `name` does not exist.
+    """
+    if name in group:
+        return (name, None)
+    if '/' in name.strip('/'):
+        parent, column = name.rstrip('/').rsplit('/', 1)
+        if parent in group:
+            columns = get_columns(group[parent])
+            if columns is not None and column in columns:
+                return (parent, columns.index(column))
+    return (None, None)
+
+
+def read_item(group, name, idx=slice(None)):
+    """Read rows `idx` of dataset or virtual column `name` in `group`."""
+    dataset, column = resolve(group, name)
+    if dataset is None:
+        raise ValueError('%s does not exist!' % name)
+    if column is None:
+        return group[dataset][idx]
+    return group[dataset][idx][:, column]
+
 
 def _ls(item, recursive=False, groups=False, level=0):
     keys = []
@@ -22,7 +70,12 @@ def _ls(item, recursive=False, groups=False, level=0):
             for key in list(item.keys()):
                 keys.extend(_ls(item[key], recursive, groups, level + 1))
     elif not groups:
-        keys.append(item.name)
+        columns = get_columns(item)
+        if columns is None:
+            keys.append(item.name)
+        else:
+            for column in columns:
+                keys.append('%s/%s' % (item.name, column))
     return keys
 
 
@@ -82,6 +135,50 @@ def write_data(data, filename):
         group.close()
 
 
+class ChunkWriter(object):
+    """Append data chunk-wise to resizable datasets of HDF5 file.
+
+    Parameters
+    ----------
+    filename: str
+        Path of HDF5 file.
+    dtypes: dict
+        Data types of datasets by name, which otherwise are inferred from the
+        first chunk. Required for strings that can be longer in later chunks.
+    compression: str
+        Compression filter of datasets.
+    """
+
+    def __init__(self, filename, dtypes=None, compression='gzip'):
+        self.out_file = h5.File(filename, 'w')
+        self.dtypes = dict() if dtypes is None else dtypes
+        self.compression = compression
+        self.idx = 0
+
+    def write_dict(self, data):
+        """Append values of `dict` `data` with datasets names as keys."""
+        size = None
+        for name, value in six.iteritems(data):
+            if size is None:
+                size = len(value)
+            assert len(value) == size
+            if name not in self.out_file:
+                self.out_file.create_dataset(
+                    name, shape=(0,) + value.shape[1:],
+                    maxshape=(None,) + value.shape[1:],
+                    dtype=self.dtypes.get(name, value.dtype),
+                    chunks=True,
+                    compression=self.compression)
+            dataset = self.out_file[name]
+            dataset.resize(self.idx + size, axis=0)
+            dataset[self.idx:] = value
+        if size is not None:
+            self.idx += size
+
+    def close(self):
+        self.out_file.close()
+
+
 def hnames_to_names(hnames):
     """Flattens `dict` `hnames` of hierarchical names.
 
@@ -112,12 +209,17 @@ def reader(data_files, names, batch_size=128, nb_sample=None, shuffle=False,
     # Copy, since list will be changed if shuffle=True
     data_files = list(to_list(data_files))
 
-    # Check if names exist
+    # Check if names exist and resolve virtual columns
     h5_file = h5.File(data_files[0], 'r')
+    items = dict()
     for name in names:
-        if name not in h5_file:
+        items[name] = resolve(h5_file, name)
+        if items[name][0] is None:
             raise ValueError('%s does not exist!' % name)
     h5_file.close()
+    # Datasets that are read, such that columns of the same dataset are read
+    # by a single I/O operation
+    datasets = sorted(set([item[0] for item in six.itervalues(items)]))
 
     if nb_sample:
         # Select the first k files s.t. the total sample size is at least
@@ -126,7 +228,7 @@ def reader(data_files, names, batch_size=128, nb_sample=None, shuffle=False,
         nb_seen = 0
         for data_file in data_files:
             h5_file = h5.File(data_file, 'r')
-            nb_seen += len(h5_file[names[0]])
+            nb_seen += len(h5_file[datasets[0]])
             h5_file.close()
             _data_files.append(data_file)
             if nb_seen >= nb_sample:
@@ -143,8 +245,8 @@ def reader(data_files, names, batch_size=128, nb_sample=None, shuffle=False,
 
         h5_file = h5.File(data_files[file_idx], 'r')
         data_file = dict()
-        for name in names:
-            data_file[name] = h5_file[name]
+        for dataset in datasets:
+            data_file[dataset] = h5_file[dataset]
         nb_sample_file = len(list(data_file.values())[0])
 
         if shuffle:
@@ -164,9 +266,17 @@ def reader(data_files, names, batch_size=128, nb_sample=None, shuffle=False,
             if _batch_size == 0:
                 break
 
+            data_datasets = dict()
+            for dataset in datasets:
+                data_datasets[dataset] = \
+                    data_file[dataset][batch_start:batch_end]
             data_batch = dict()
             for name in names:
-                data_batch[name] = data_file[name][batch_start:batch_end]
+                dataset, column = items[name]
+                if column is None:
+                    data_batch[name] = data_datasets[dataset]
+                else:
+                    data_batch[name] = data_datasets[dataset][:, column]
             yield data_batch
 
             nb_seen += _batch_size
@@ -3,14 +3,26 @@
 CpG matrix x assumed to have shape
     * [sites, cells] for per CpG statistics
     * [sites, cells, context] for window-based statistics
+
+Functions like :func:`mean` or :func:`var` operate on masked arrays.
+:func:`cpg_stats` and :func:`window_stats` compute multiple statistics at once
+from shared count, sum, and squared sum reductions over plain arrays, which is
+considerably faster.
 """
 
 from __future__ import division
 from __future__ import print_function
 
+from collections import OrderedDict
+
 import numpy as np
 
 from ..utils import EPS, get_from_module
+from .utils import CPG_NAN
+
+# Statistics supported by :func:`summarize`.
+STATS = ['mean', 'mode', 'var', 'cat_var', 'cat2_var', 'entropy', 'diff',
+         'cov']
 
 
 def mean(x):
@@ -69,6 +81,210 @@ def diff(x):
     return x.min(axis=1) != x.max(axis=1).astype(np.int8)
 
 
+def get_dtype(name):
+    """Return data type of statistic `name` computed by :func:`summarize`."""
+    if name in ['mode', 'cat_var', 'cat2_var', 'diff']:
+        return np.int8
+    elif name == 'cov':
+        return np.int32
+    else:
+        return np.float32
+
+
+def moments(x, valid, minmax=False):
+    """Compute count, sum, and sum of squares of valid values across cells.
+
+    Parameters
+    ----------
+    x: :class:`numpy.ndarray`
+        [sites, cells] :class:`numpy.ndarray` with values.
+    valid: :class:`numpy.ndarray`
+        [sites, cells] boolean :class:`numpy.ndarray` indicating which values
+        in `x` are observed.
+    minmax: bool
+        If `True`, also compute the minimum and maximum of valid values.
+
+    Returns
+    -------
+    tuple
+        Tuple (`count`, `total`, `total2`, `vmin`, `vmax`) of vectors of length
+        [sites]. `vmin` and `vmax` are `None` if `minmax` is `False`.
+    """
+    nb_site = x.shape[0]
+    buf = np.empty(x.shape, dtype=np.float32)
+    count = np.empty(nb_site, dtype=np.float32)
+    total = np.empty(nb_site, dtype=np.float32)
+    total2 = np.empty(nb_site, dtype=np.float32)
+
+    np.sum(valid, axis=1, dtype=np.float32, out=count)
+    np.multiply(x, valid, out=buf, casting='unsafe')
+    np.sum(buf, axis=1, out=total)
+    np.multiply(buf, buf, out=buf)
+    np.sum(buf, axis=1, out=total2)
+
+    vmin = None
+    vmax = None
+    if minmax:
+        buf[...] = x
+        buf[~valid] = np.inf
+        vmin = buf.min(axis=1)
+        buf[~valid] = -np.inf
+        vmax = buf.max(axis=1)
+    return (count, total, total2, vmin, vmax)
+
+
+def summarize(names, count, total, total2, vmin=None, vmax=None, min_cov=1,
+              nb_bin=3):
+    """Compute statistics from moments.
+
+    Parameters
+    ----------
+    names: list
+        Names of statistics to be computed. See `STATS`.
+    count: :class:`numpy.ndarray`
+        Number of observed cells per site.
+    total: :class:`numpy.ndarray`
+        Sum of observed values per site.
+    total2: :class:`numpy.ndarray`
+        Sum of squared observed values per site.
+    vmin: :class:`numpy.ndarray`
+        Minimum of observed values per site. Required for 'diff'.
+    vmax: :class:`numpy.ndarray`
+        Maximum of observed values per site. Required for 'diff'.
+    min_cov: int
+        Minimum number of observed cells. Statistics of sites with a lower
+        coverage are set to `CPG_NAN`.
+    nb_bin: int
+        Number of bins of 'cat_var'.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict` with `names` as keys and statistics as values.
+    """
+    nan = count < max(min_cov, 1)
+    _count = np.maximum(count, 1)
+    _mean = total / _count
+    _var = None
+    if set(names) & set(['var', 'cat_var', 'cat2_var']):
+        _var = np.clip(total2 / _count - _mean**2, 0, 0.25)
+
+    stats = OrderedDict()
+    for name in names:
+        if name == 'mean':
+            stat = _mean
+        elif name == 'mode':
+            stat = np.round(_mean)
+        elif name == 'var':
+            stat = _var
+        elif name in ['cat_var', 'cat2_var']:
+            bins = np.linspace(-EPS, 0.25, nb_bin + 1)
+            stat = np.digitize(_var, bins, right=True) - 1
+            if name == 'cat2_var':
+                stat = np.minimum(stat, 1)
+        elif name == 'entropy':
+            p1 = np.minimum(1 - EPS, np.maximum(EPS, _mean))
+            p0 = 1 - p1
+            stat = -(p1 * np.log(p1) + p0 * np.log(p0))
+        elif name == 'diff':
+            if vmin is None or vmax is None:
+                raise ValueError('Minimum and maximum required for "diff"!')
+            stat = vmin != vmax
+        elif name == 'cov':
+            stat = count
+        else:
+            raise ValueError('Invalid statistic "%s"!' % name)
+        stat = np.asarray(stat).astype(get_dtype(name))
+        stat[nan] = CPG_NAN
+        stats[name] = stat
+    return stats
+
+
+def cpg_stats(x, names, min_cov=1, nan=CPG_NAN):
+    """Compute per CpG statistics between cells.
+
+    Parameters
+    ----------
+    x: :class:`numpy.ndarray`
+        [sites, cells] :class:`numpy.ndarray` with methylation states, where
+        `nan` indicates unobserved states.
+    names: list
+        Names of statistics to be computed. See `STATS`.
+    min_cov: int
+        Minimum number of observed cells.
+    nan: scalar
+        Value of unobserved states.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict` with `names` as keys and statistics as values.
+    """
+    valid = x != nan
+    return summarize(names, *moments(x, valid, minmax='diff' in names),
+                     min_cov=min_cov)
+
+
+def window_stats(states, dists, wlens, names, nan=CPG_NAN):
+    """Compute window-based statistics between cells.
+
+    Averages for each cell the methylation states of observed CpG sites
+    within a window centered on the target site, and computes statistics of
+    these averages between cells. Neighboring sites are assigned to the
+    smallest window that contains them, such that counts and sums of nested
+    windows are obtained by cumulative sums in a single pass.
+
+    Parameters
+    ----------
+    states: :class:`numpy.ndarray`
+        [sites, cells, context] :class:`numpy.ndarray` with methylation states
+        of neighboring CpG sites, where `nan` indicates unobserved states.
+    dists: :class:`numpy.ndarray`
+        [sites, cells, context] :class:`numpy.ndarray` with the distance of
+        neighboring CpG sites to the target site.
+    wlens: list
+        Window lengths.
+    names: list
+        Names of statistics to be computed. See `STATS`.
+    nan: scalar
+        Value of unobserved states.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict` with `wlens` as keys and `OrderedDict` with statistics
+        as values.
+    """
+    nb_site, nb_cell = states.shape[:2]
+    wlens_sorted = sorted(set(wlens))
+    nb_win = len(wlens_sorted)
+    halves = np.array([wlen // 2 for wlen in wlens_sorted])
+
+    # Index of smallest window containing each neighbor; `nb_win` for
+    # unobserved neighbors or neighbors outside all windows.
+    bucket = np.searchsorted(halves, dists, side='left')
+    bucket[states == nan] = nb_win
+    offset = np.arange(nb_site * nb_cell).reshape(nb_site, nb_cell, 1)
+    bucket += offset * (nb_win + 1)
+    bucket = bucket.ravel()
+    size = nb_site * nb_cell * (nb_win + 1)
+    shape = (nb_site, nb_cell, nb_win + 1)
+
+    count = np.bincount(bucket, minlength=size).reshape(shape)
+    total = np.bincount(bucket, weights=states.ravel(), minlength=size)
+    total = total.reshape(shape)
+    count = np.cumsum(count[:, :, :nb_win], axis=2, dtype=np.float32)
+    total = np.cumsum(total[:, :, :nb_win], axis=2).astype(np.float32)
+
+    win_stats = OrderedDict()
+    for i, wlen in enumerate(wlens_sorted):
+        cell_valid = count[:, :, i] > 0
+        cell_means = total[:, :, i] / np.maximum(count[:, :, i], 1)
+        win_stats[wlen] = summarize(
+            names, *moments(cell_means, cell_valid, minmax='diff' in names))
+    return OrderedDict([(wlen, win_stats[wlen]) for wlen in wlens])
+
+
 def get(name):
     """Return object from module by its name."""
     return get_from_module(name, globals())
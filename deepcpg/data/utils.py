@@ -3,9 +3,17 @@
 from __future__ import division
 from __future__ import print_function
 
+from collections import OrderedDict
 import gzip
+import hashlib
+import io
+from multiprocessing.pool import ThreadPool
+import os
+import struct
+import subprocess
 import threading
 import re
+import zlib
 
 import h5py as h5
 import numpy as np
@@ -15,6 +23,11 @@ from six.moves import range
 
 from . import hdf
 
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
 # Constant for missing labels.
 CPG_NAN = -1
 # Constant for separating output names, e.g. 'cpg/cell'.
@@ -186,7 +199,7 @@ def format_chromo(chromo):
     Makes name upper case, e.g. 'mt' -> 'MT' and removes 'chr',
     e.g. 'chr1' -> '1'.
     """
-    return chromo.str.upper().str.replace('^CHR', '')
+    return chromo.str.upper().str.replace('^CHR', '', regex=True)
 
 
 def sample_from_chromo(frame, nb_sample):
@@ -275,6 +288,343 @@ def read_cpg_profile(filename, chromos=None, nb_sample=None, round=False,
     return d
 
 
+def open_cpg_profile(filename, nb_thread=1):
+    """Open CpG profile `filename` for reading as binary stream.
+
+    Decompresses gzip-compressed files with `pigz` using `nb_thread` threads
+    if `nb_thread` is greater than one and `pigz` is installed, and otherwise
+    with the gzip package.
+
+    Returns
+    -------
+    tuple
+        Tuple (`stream`, `proc`) with buffered binary stream and `pigz`
+        process, which is `None` if `pigz` is not used.
+    """
+    proc = None
+    if filename.endswith('.gz'):
+        pigz = which('pigz') if nb_thread > 1 else None
+        if pigz:
+            proc = subprocess.Popen([pigz, '-dc', '-p', str(nb_thread),
+                                     filename], stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            stream = proc.stdout
+        else:
+            stream = io.BufferedReader(gzip.open(filename, 'rb'))
+    else:
+        stream = open(filename, 'rb')
+    return (stream, proc)
+
+
+def select_cpg_profile(profile, chromos=None, nb_sample_chromo=None,
+                       nb_sample=None):
+    """Select records of CpG profile returned by :func:`parse_cpg_profile`.
+
+    Parameters
+    ----------
+    profile: :class:`collections.OrderedDict`
+        `OrderedDict` with chromosomes as keys and tuples (`pos`, `value`) as
+        values.
+    chromos: list
+        List of formatted chromosomes to be selected, e.g. ['1', 'X'].
+    nb_sample_chromo: int
+        Maximum number of randomly sampled records per chromosome.
+    nb_sample: int
+        Maximum number of records in total.
+
+    Returns
+    -------
+    :class:`collections.OrderedDict`
+        Selected CpG profile.
+    """
+    if chromos is not None:
+        if not isinstance(chromos, list):
+            chromos = [str(chromos)]
+        profile = OrderedDict([(chromo, value)
+                               for chromo, value in six.iteritems(profile)
+                               if chromo in chromos])
+        if not len(profile):
+            raise ValueError('No data available for selected chromosomes!')
+    if nb_sample_chromo is not None:
+        _profile = OrderedDict()
+        for chromo, (pos, value) in six.iteritems(profile):
+            if len(pos) > nb_sample_chromo:
+                idx = np.random.choice(len(pos), nb_sample_chromo,
+                                       replace=False)
+                idx.sort()
+                pos = pos[idx]
+                value = value[idx]
+            _profile[chromo] = (pos, value)
+        profile = _profile
+    if nb_sample is not None:
+        _profile = OrderedDict()
+        for chromo, (pos, value) in six.iteritems(profile):
+            if nb_sample <= 0:
+                break
+            _profile[chromo] = (pos[:nb_sample], value[:nb_sample])
+            nb_sample -= len(pos)
+        profile = _profile
+    return profile
+
+
+def get_cpg_profile_cache_file(filename, cache_dir):
+    """Return name of the cache file of CpG profile `filename` in `cache_dir`.
+
+    Names contain a hash of the absolute path of `filename` to distinguish
+    profiles with the same name in different directories.
+    """
+    path_hash = hashlib.md5(os.path.abspath(filename).encode()).hexdigest()
+    name = '%s.%s.npz' % (os.path.basename(filename), path_hash[:8])
+    return os.path.join(cache_dir, name)
+
+
+def write_cpg_profile_cache(profile, cache_file, filename):
+    """Write CpG profile of `filename` to npz cache file `cache_file`.
+
+    Stores the size and modification time of `filename` for invalidating the
+    cache if `filename` changes.
+    """
+    data = dict()
+    for chromo, (pos, value) in six.iteritems(profile):
+        data['pos_%s' % chromo] = pos
+        data['value_%s' % chromo] = value
+    stat = os.stat(filename)
+    data['src_size'] = np.int64(stat.st_size)
+    data['src_mtime'] = np.float64(stat.st_mtime)
+    tmp_file = '%s.tmp' % cache_file
+    with open(tmp_file, 'wb') as f:
+        np.savez(f, **data)
+    os.rename(tmp_file, cache_file)
+
+
+def read_cpg_profile_cache(cache_file, filename):
+    """Read CpG profile written by :func:`write_cpg_profile_cache`.
+
+    Returns
+    -------
+    :class:`collections.OrderedDict`
+        CpG profile or `None` if `cache_file` does not exist or the size or
+        modification time of `filename` changed.
+    """
+    if not os.path.isfile(cache_file):
+        return None
+    stat = os.stat(filename)
+    data = np.load(cache_file)
+    try:
+        if data['src_size'] != stat.st_size or \
+                data['src_mtime'] != stat.st_mtime:
+            return None
+        profile = OrderedDict()
+        for key in sorted(data.files):
+            if key.startswith('pos_'):
+                chromo = key[len('pos_'):]
+                profile[chromo] = (data[key], data['value_%s' % chromo])
+    finally:
+        data.close()
+    return profile
+
+
+def round_cpg_profile(profile):
+    """Round continuous methylation states of CpG profile to zero or one."""
+    _profile = OrderedDict()
+    for chromo, (pos, value) in six.iteritems(profile):
+        if value.dtype != np.int8:
+            value = np.round(value).astype(np.int8)
+        _profile[chromo] = (pos, value)
+    return _profile
+
+
+def _get_cpg_profile_columns(stream):
+    """Return columns and header rows of CpG profile opened as `stream`."""
+    line = stream.peek(1024).split(b'\n', 1)[0].decode()
+    if re.match(r'track\s+type=bedGraph', line):
+        return ([0, 1, 3], 1)
+    return ([0, 1, 2], 0)
+
+
+def read_cpg_profile_chromos(filename, nb_thread=1):
+    """Return sorted chromosomes of CpG profile `filename`.
+
+    Only reads the chromosome column, such that memory does not grow with the
+    number of columns of `filename`.
+
+    Parameters
+    ----------
+    filename: str
+        Path of file, which can be gzip-compressed.
+    nb_thread: int
+        Number of threads for decompressing gzip-compressed files.
+
+    Returns
+    -------
+    list
+        Sorted formatted chromosomes, e.g. ['1', 'X'].
+    """
+    stream, proc = open_cpg_profile(filename, nb_thread)
+    try:
+        usecols, skiprows = _get_cpg_profile_columns(stream)
+        d = pd.read_csv(stream, sep='\t', header=None, comment='#',
+                        usecols=usecols[:1], skiprows=skiprows,
+                        dtype={usecols[0]: 'category'})
+    finally:
+        stream.close()
+        if proc is not None:
+            proc.stderr.close()
+            proc.wait()
+    if proc is not None and proc.returncode:
+        raise IOError('Decompressing %s failed!' % filename)
+    names = d[usecols[0]].cat.categories.astype(str)
+    return sorted(set(format_chromo(pd.Series(names)).values))
+
+
+def parse_cpg_profile(filename, chromos=None, nb_sample=None, round=False,
+                      nb_sample_chromo=None, nb_thread=1, cache_dir=None):
+    """Parse CpG profile from TSV or bedGraph file into arrays.
+
+    Faster alternative to :func:`read_cpg_profile`. Reads chromosome names as
+    categories, such that only distinct names are formatted, and skips sorting
+    positions if they are already sorted.
+
+    Parameters
+    ----------
+    filename: str
+        Path of file, which can be gzip-compressed.
+    chromos: list
+        List of formatted chromosomes to be read, e.g. ['1', 'X'].
+    nb_sample: int
+        Maximum number of sample in total.
+    round: bool
+        If `True`, round methylation states to zero or one.
+    nb_sample_chromo: int
+        Maximum number of sample per chromosome.
+    nb_thread: int
+        Number of threads for decompressing gzip-compressed files.
+    cache_dir: str
+        If defined, read the complete profile from or write it to a cache file
+        in `cache_dir` before selecting records. Cache files are renewed if
+        the size or modification time of `filename` changes.
+
+    Returns
+    -------
+    :class:`collections.OrderedDict`
+        `OrderedDict` with sorted chromosomes as keys and tuples (`pos`,
+        `value`) as values. `pos` are sorted int32 positions and `value`
+        methylation states, which are int8 if binary and float32 otherwise.
+    """
+    if cache_dir is not None:
+        cache_file = get_cpg_profile_cache_file(filename, cache_dir)
+        profile = read_cpg_profile_cache(cache_file, filename)
+        if profile is None:
+            profile = parse_cpg_profile(filename, nb_thread=nb_thread)
+            write_cpg_profile_cache(profile, cache_file, filename)
+        if round:
+            profile = round_cpg_profile(profile)
+        return select_cpg_profile(profile, chromos=chromos,
+                                  nb_sample_chromo=nb_sample_chromo,
+                                  nb_sample=nb_sample)
+
+    stream, proc = open_cpg_profile(filename, nb_thread)
+    try:
+        usecols, skiprows = _get_cpg_profile_columns(stream)
+        nrows = None
+        if chromos is None and nb_sample_chromo is None:
+            nrows = nb_sample
+        d = pd.read_csv(stream, sep='\t', header=None, comment='#',
+                        nrows=nrows, usecols=usecols, skiprows=skiprows,
+                        dtype={usecols[0]: 'category', usecols[1]: np.int32,
+                               usecols[2]: np.float32})
+    finally:
+        stream.close()
+        if proc is not None:
+            stderr = proc.stderr.read()
+            proc.stderr.close()
+            proc.wait()
+    # `pigz` fails if it is stopped early after reading `nrows` records
+    if proc is not None and proc.returncode and nrows is None:
+        raise IOError('Decompressing %s failed: %s' %
+                      (filename, stderr.decode().strip()))
+
+    value = d[usecols[2]].values
+    if np.any((value < 0) | (value > 1)):
+        raise ValueError('Methylation values must be between 0 and 1!')
+    if round:
+        value = np.round(value)
+    if is_binary(value):
+        value = value.astype(np.int8)
+    pos = d[usecols[1]].values
+
+    # Map chromosome categories to sorted formatted names
+    cat = d[usecols[0]].cat
+    names = format_chromo(pd.Series(cat.categories.astype(str))).values
+    uniq_names, name_codes = np.unique(names, return_inverse=True)
+    codes = name_codes[cat.codes.values]
+
+    # Group records by chromosome without sorting if already grouped
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(codes)) + 1,
+                             [len(codes)]])
+    if len(codes) and \
+            len(np.unique(codes[bounds[:-1]])) != len(bounds) - 1:
+        idx = np.argsort(codes, kind='mergesort')
+        codes = codes[idx]
+        pos = pos[idx]
+        value = value[idx]
+        bounds = np.concatenate([[0], np.flatnonzero(np.diff(codes)) + 1,
+                                 [len(codes)]])
+    groups = dict()
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if end <= start:
+            continue
+        chromo_pos = pos[start:end]
+        chromo_value = value[start:end]
+        if np.any(chromo_pos[1:] < chromo_pos[:-1]):
+            idx = np.argsort(chromo_pos, kind='mergesort')
+            chromo_pos = chromo_pos[idx]
+            chromo_value = chromo_value[idx]
+        groups[uniq_names[codes[start]]] = (chromo_pos, chromo_value)
+    profile = OrderedDict([(chromo, groups[chromo])
+                           for chromo in sorted(groups.keys())])
+    return select_cpg_profile(profile, chromos=chromos,
+                              nb_sample_chromo=nb_sample_chromo,
+                              nb_sample=nb_sample)
+
+
+def extract_cpg_inputs(cpg_profiles, replicate_names, cpg_ext, chromo, pos):
+    """Extract CpG inputs of sites as stored by `dcpg_data.py`.
+
+    Parameters
+    ----------
+    cpg_profiles: dict
+        CpG profiles returned by :func:`parse_cpg_profile` by replicate name.
+    replicate_names: list
+        Names of replicates whose inputs are extracted.
+    cpg_ext: :class:`KnnCpgFeatureExtractor`
+        Feature extractor of neighboring CpG sites.
+    chromo: str
+        Chromosome of sites.
+    pos: :class:`numpy.ndarray`
+        Sorted positions of sites.
+
+    Returns
+    -------
+    dict
+        `dict` with state and distance of neighboring CpG sites named
+        'inputs/cpg/`replicate_name`/state' and
+        'inputs/cpg/`replicate_name`/dist'.
+    """
+    data = dict()
+    for name in replicate_names:
+        cpg_pos, cpg_value = cpg_profiles[name].get(
+            chromo, (np.array([], dtype=np.int32),
+                     np.array([], dtype=np.int8)))
+        state, dist = cpg_ext.extract(pos, cpg_pos, cpg_value)
+        nan = np.isnan(state)
+        state[nan] = CPG_NAN
+        dist[nan] = CPG_NAN
+        data['inputs/cpg/%s/state' % name] = state.astype(cpg_value.dtype)
+        data['inputs/cpg/%s/dist' % name] = dist.astype(np.float32)
+    return data
+
+
 class GzipFile(object):
     """Wrapper to read and write gzip-compressed files.
 
@@ -339,3 +689,154 @@ class GzipFile(object):
 
     def iter(self):
         self.fh.iter()
+
+
+def _format_ints(values):
+    """Format non-negative integers as right-aligned ASCII digits.
+
+    Returns a [len(values), nb_digit] uint8 matrix with leading zeros set to
+    zero, which are removed by :func:`format_bedgraph`.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    nb_digit = len(str(values.max())) if len(values) else 1
+    powers = 10**np.arange(nb_digit - 1, -1, -1, dtype=np.int64)
+    digits = (values[:, None] // powers) % 10
+    # Keep the last digit and all digits after the first non-zero digit
+    keep = np.cumsum(digits, axis=1) > 0
+    keep[:, -1] = True
+    return np.where(keep, digits + ord('0'), 0).astype(np.uint8)
+
+
+def format_bedgraph(chromo, pos, value, precision=5):
+    """Format sites as lines of bedGraph file.
+
+    Builds lines of all sites at once as byte matrix instead of formatting
+    each value separately. Lines are identical to
+    :meth:`pandas.DataFrame.to_csv` with `float_format='%.{precision}f'`
+    except for values on the rounding boundary of the last digit.
+
+    Parameters
+    ----------
+    chromo: :class:`numpy.ndarray`
+        :class:`numpy.ndarray` with chromosome names, e.g. `chr1`, as bytes.
+    pos: :class:`numpy.ndarray`
+        :class:`numpy.ndarray` with start positions. End positions are
+        `pos + 1`.
+    value: :class:`numpy.ndarray`
+        :class:`numpy.ndarray` with finite values.
+    precision: int
+        Number of decimal digits of values.
+
+    Returns
+    -------
+    bytes
+        Lines of bedGraph file.
+    """
+    if not len(pos):
+        return b''
+    pos = np.asarray(pos, dtype=np.int64)
+    chromo = np.asarray(chromo, dtype=bytes)
+    chromo = chromo.view(np.uint8).reshape(len(chromo), -1)
+    scale = 10**precision
+    value = np.round(np.asarray(value, dtype=np.float64) * scale)
+    value = value.astype(np.int64)
+    absolute = np.abs(value)
+    sign = np.where(value < 0, ord('-'), 0).astype(np.uint8)[:, None]
+    fraction = ((absolute % scale)[:, None] //
+                10**np.arange(precision - 1, -1, -1, dtype=np.int64)) % 10
+    fraction = (fraction + ord('0')).astype(np.uint8)
+
+    def char(c):
+        return np.full((len(pos), 1), ord(c), dtype=np.uint8)
+
+    columns = [chromo, char('\t'), _format_ints(pos), char('\t'),
+               _format_ints(pos + 1), char('\t'), sign,
+               _format_ints(absolute // scale)]
+    if precision > 0:
+        columns += [char('.'), fraction]
+    columns.append(char('\n'))
+    lines = np.hstack(columns)
+    return lines[lines != 0].tobytes()
+
+
+# Empty BGZF block marking the end of file.
+BGZF_EOF = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00' \
+    b'\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+
+def compress_bgzf_block(data, level=6):
+    """Compress `data` as single BGZF block.
+
+    BGZF blocks are independent gzip members with the compressed block size
+    stored in an extra field, such that files can be indexed, e.g. by
+    `tabix`, and decompressed by `gzip`.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+    bsize = len(header) + 2 + len(cdata) + 8 - 1
+    return header + struct.pack('<H', bsize) + cdata + \
+        struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+
+class BgzfWriter(object):
+    """Write BGZF-compressed file using multiple threads.
+
+    Splits data into blocks of at most `block_size` bytes, which are
+    compressed independently by `nb_thread` threads and written in order.
+    The output is a valid gzip file.
+
+    Parameters
+    ----------
+    filename: str
+        Path of file.
+    nb_thread: int
+        Number of compression threads.
+    level: int
+        Compression level.
+    block_size: int
+        Uncompressed size of blocks, which must be at most 65536 bytes.
+    """
+
+    def __init__(self, filename, nb_thread=1, level=6, block_size=65280):
+        self.out_file = open(filename, 'wb')
+        self.level = level
+        self.block_size = block_size
+        self.buffer = b''
+        self.pool = None
+        if nb_thread > 1:
+            self.pool = ThreadPool(nb_thread)
+        # Number of blocks that are compressed at once
+        self.nb_block = max(1, nb_thread) * 4
+
+    def _compress(self, data):
+        return compress_bgzf_block(data, self.level)
+
+    def _flush(self, final=False):
+        nb_byte = len(self.buffer)
+        if not final:
+            nb_byte -= nb_byte % self.block_size
+        blocks = [self.buffer[i:(i + self.block_size)]
+                  for i in range(0, nb_byte, self.block_size)]
+        self.buffer = self.buffer[nb_byte:]
+        if self.pool is not None:
+            blocks = self.pool.map(self._compress, blocks)
+        else:
+            blocks = [self._compress(block) for block in blocks]
+        for block in blocks:
+            self.out_file.write(block)
+
+    def write(self, data):
+        if isinstance(data, six.text_type):
+            data = data.encode()
+        self.buffer += data
+        if len(self.buffer) >= self.block_size * self.nb_block:
+            self._flush()
+
+    def close(self):
+        self._flush(final=True)
+        self.out_file.write(BGZF_EOF)
+        self.out_file.close()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
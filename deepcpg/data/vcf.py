@@ -0,0 +1,88 @@
+"""Functions for reading variants from VCF files."""
+
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+
+from .utils import format_chromo
+
+# Names of the first VCF columns that are read
+VCF_COLUMNS = ['chromo', 'pos', 'id', 'ref', 'alt']
+
+
+def read_vcf(filename, chromos=None, chunk_size=10000):
+    """Read single-nucleotide variants (SNVs) from VCF file chunk-wise.
+
+    Only reads the first five columns of the VCF file, such that memory is
+    bounded by `chunk_size` independent of the number of samples or variants.
+    Variants with multiple alternative alleles are split into one SNV per
+    allele and variants that are not SNVs are skipped.
+
+    Parameters
+    ----------
+    filename: str
+        Path of VCF file, which can be gzip or bgzip compressed.
+    chromos: list
+        Chromosomes of variants that are read.
+    chunk_size: int
+        Number of VCF records that are read at once.
+
+    Returns
+    -------
+    generator
+        Generator of :class:`pandas.DataFrame` with columns `chromo`, `pos`,
+        `id`, `ref`, and `alt`, where `chromo` is formatted by
+        :func:`format_chromo` and `ref` and `alt` are upper case.
+    """
+    reader = pd.read_table(filename, header=None, comment='#',
+                           usecols=list(range(len(VCF_COLUMNS))),
+                           names=VCF_COLUMNS,
+                           dtype={'chromo': str, 'pos': np.int32,
+                                  'id': str, 'ref': str, 'alt': str},
+                           chunksize=chunk_size)
+    for chunk in reader:
+        chunk['chromo'] = format_chromo(chunk['chromo'])
+        if chromos is not None:
+            chunk = chunk.loc[chunk['chromo'].isin(chromos)]
+        chunk['ref'] = chunk['ref'].str.upper()
+        # One row per alternative allele
+        alts = chunk['alt'].str.upper().str.split(',')
+        chunk = chunk.loc[np.repeat(chunk.index.values, alts.str.len())]
+        chunk['alt'] = np.concatenate(alts.values) if len(alts) else []
+        is_snv = chunk['ref'].isin(list('ACGT')) & \
+            chunk['alt'].isin(list('ACGT'))
+        chunk = chunk.loc[is_snv].reset_index(drop=True)
+        if len(chunk):
+            yield chunk
+
+
+def get_nearby(pos, sites, max_dist):
+    """Return pairs of positions and sites that are at most `max_dist` apart.
+
+    Parameters
+    ----------
+    pos: :class:`numpy.ndarray`
+        Positions, e.g. of variants.
+    sites: :class:`numpy.ndarray`
+        Sorted positions of sites, e.g. CpG sites.
+    max_dist: int
+        Maximum distance.
+
+    Returns
+    -------
+    tuple
+        Tuple (`pos_idx`, `site_idx`) of :class:`numpy.ndarray` with the index
+        of pairs in `pos` and `sites`, which are sorted by `pos_idx` and
+        `site_idx`.
+    """
+    pos = np.asarray(pos)
+    starts = np.searchsorted(sites, pos - max_dist, side='left')
+    ends = np.searchsorted(sites, pos + max_dist, side='right')
+    counts = ends - starts
+    pos_idx = np.repeat(np.arange(len(pos)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                  counts)
+    site_idx = np.repeat(starts, counts) + offsets
+    return (pos_idx, site_idx)
@@ -8,11 +8,11 @@ from collections import OrderedDict
 import numpy as np
 import pandas as pd
 import sklearn.metrics as skm
-from scipy.stats import kendalltau
+from scipy.stats import kendalltau, rankdata
 from six.moves import range
 
 from .data import CPG_NAN, OUTPUT_SEP
-from .utils import get_from_module
+from .utils import get_from_module, merge_moments, update_reservoir
 
 
 def cor(y, z):
@@ -189,6 +189,312 @@ def evaluate_cat(y, z, metrics=CAT_METRICS,
     return p
 
 
+def _div(a, b):
+    """Divide `a` by `b` and return zero if `b` is zero."""
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    return np.where(b == 0, 0, a / np.where(b == 0, 1, b))
+
+
+def confusion_counts(y, z, mask=None, axis=0):
+    """Count true and false positives and negatives of binary predictions.
+
+    Parameters
+    ----------
+    y: :class:`numpy.ndarray`
+        :class:`numpy.ndarray` with binary labels, which are rounded.
+    z: :class:`numpy.ndarray`
+        :class:`numpy.ndarray` with predictions, which are rounded.
+    mask: :class:`numpy.ndarray`
+        Boolean :class:`numpy.ndarray` indicating which labels are counted.
+    axis: int
+        Axis along which labels are counted.
+
+    Returns
+    -------
+    tuple
+        Tuple (`tp`, `tn`, `fp`, `fn`) of counts.
+    """
+    y = np.round(y) == 1
+    z = np.round(z) == 1
+    if mask is None:
+        mask = np.ones(y.shape, dtype=bool)
+    tp = np.sum(y & z & mask, axis=axis)
+    tn = np.sum(~y & ~z & mask, axis=axis)
+    fp = np.sum(~y & z & mask, axis=axis)
+    fn = np.sum(y & ~z & mask, axis=axis)
+    return (tp, tn, fp, fn)
+
+
+def metrics_from_counts(tp, tn, fp, fn):
+    """Compute classification metrics from confusion counts.
+
+    Undefined metrics, e.g. the true positive rate without positive labels,
+    are zero as in :mod:`sklearn.metrics`.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict` with 'acc', 'tpr', 'tnr', 'f1', and 'mcc' as keys.
+    """
+    tp, tn, fp, fn = [np.asarray(x, dtype=np.float64)
+                      for x in [tp, tn, fp, fn]]
+    p = OrderedDict()
+    p['acc'] = _div(tp + tn, tp + tn + fp + fn)
+    p['tpr'] = _div(tp, tp + fn)
+    p['tnr'] = _div(tn, tn + fp)
+    p['f1'] = _div(2 * tp, 2 * tp + fp + fn)
+    p['mcc'] = _div(tp * tn - fp * fn,
+                    np.sqrt((tp + fp) * (tp + fn) * (tn + fp) * (tn + fn)))
+    return p
+
+
+def auc_from_hist(pos, neg):
+    """Compute area under the ROC curve from histograms of predictions.
+
+    Predictions within the same bin are treated as ties, such that the error
+    is at most half the fraction of positive-negative pairs in the same bin.
+
+    Parameters
+    ----------
+    pos: :class:`numpy.ndarray`
+        Number of predictions of positive labels in bins of increasing
+        prediction values along the last axis.
+    neg: :class:`numpy.ndarray`
+        Number of predictions of negative labels in the same bins.
+
+    Returns
+    -------
+    float
+        AUC or `np.nan` if positive or negative labels are missing.
+    """
+    pos = np.asarray(pos, dtype=np.float64)
+    neg = np.asarray(neg, dtype=np.float64)
+    neg_below = np.cumsum(neg, axis=-1) - neg
+    nb_pair = pos.sum(axis=-1) * neg.sum(axis=-1)
+    auc = np.sum(pos * (neg_below + 0.5 * neg), axis=-1)
+    return np.where(nb_pair > 0, auc / np.where(nb_pair > 0, nb_pair, 1),
+                    np.nan)
+
+
+def auc_rank(y, z):
+    """Compute area under the ROC curve from ranks of predictions.
+
+    Equivalent to :func:`auc` but computed by the Mann-Whitney U statistic of
+    predictions, with tied predictions assigned their average rank.
+    """
+    y = np.round(y) == 1
+    nb_pos = y.sum()
+    nb_neg = len(y) - nb_pos
+    if not nb_pos or not nb_neg:
+        return np.nan
+    ranks = rankdata(z)
+    return (ranks[y].sum() - nb_pos * (nb_pos + 1) / 2) / (nb_pos * nb_neg)
+
+
+def evaluate_binary(y, z, mask=CPG_NAN):
+    """Compute `CLA_METRICS` of multiple binary outputs at once.
+
+    Vectorized version of :func:`evaluate` for the columns of `y` and `z`.
+    Classification metrics of all outputs are derived from confusion counts,
+    which are computed from the entire matrices at once, and AUC by ranking
+    predictions of each output.
+
+    Parameters
+    ----------
+    y: :class:`numpy.ndarray`
+        [samples, outputs] :class:`numpy.ndarray` with labels.
+    z: :class:`numpy.ndarray`
+        [samples, outputs] :class:`numpy.ndarray` with predictions.
+    mask: scalar
+        Value to mask unobserved labels in `y`.
+
+    Returns
+    -------
+    list
+        List with one ordered dict per output as returned by :func:`evaluate`.
+    """
+    if mask is None:
+        observed = np.ones(y.shape, dtype=bool)
+    else:
+        observed = y != mask
+    nb_obs = observed.sum(axis=0)
+    cla = metrics_from_counts(*confusion_counts(y, z, observed))
+    perf = []
+    for i in range(y.shape[1]):
+        p = OrderedDict()
+        for metric in CLA_METRICS:
+            name = metric.__name__
+            if not nb_obs[i]:
+                p[name] = np.nan
+            elif name == 'auc':
+                p[name] = auc_rank(y[observed[:, i], i], z[observed[:, i], i])
+            else:
+                p[name] = float(cla[name][i])
+        p['n'] = int(nb_obs[i])
+        perf.append(p)
+    return perf
+
+
+def _hist(z, nb_bin):
+    """Count predictions in `nb_bin` equally-sized bins between 0 and 1."""
+    idx = np.clip((z * nb_bin).astype(np.int64), 0, nb_bin - 1)
+    return np.bincount(idx, minlength=nb_bin)
+
+
+class MetricAccumulator(object):
+    """Accumulate performance metrics of a single output batch-wise.
+
+    Stores sufficient statistics instead of labels and predictions such that
+    memory is constant. Classification metrics are computed from confusion
+    counts, AUC from histograms of predictions with `nb_bin` bins, and
+    regression metrics from running moments. Only 'kendall' is computed on a
+    reservoir sample of at most `nb_sample` labels and predictions.
+
+    Parameters
+    ----------
+    metrics: list
+        List of evaluation functions of this module, e.g. `CLA_METRICS`.
+    mask: scalar
+        Value to mask unobserved labels.
+    nb_bin: int
+        Number of bins for computing AUC.
+    nb_sample: int
+        Size of reservoir sample for computing Kendall's correlation.
+    """
+
+    def __init__(self, metrics=CLA_METRICS, mask=CPG_NAN, nb_bin=1000,
+                 nb_sample=100000):
+        self.metrics = [metric.__name__ for metric in metrics]
+        for metric in self.metrics:
+            if metric not in ['auc', 'acc', 'tpr', 'tnr', 'f1', 'mcc', 'mse',
+                              'rmse', 'mad', 'cor', 'kendall']:
+                raise ValueError('Metric "%s" not supported!' % metric)
+        self.mask = mask
+        self.nb_bin = nb_bin
+        self.nb_sample = nb_sample
+        self.n = 0
+        self.counts = np.zeros(4, dtype=np.int64)
+        self.pos_hist = np.zeros(nb_bin, dtype=np.int64)
+        self.neg_hist = np.zeros(nb_bin, dtype=np.int64)
+        # Mean of labels and predictions, matrix of sums of products of their
+        # deviations, and sums of squared and absolute errors
+        self.mean = np.zeros(2)
+        self.m2 = np.zeros((2, 2))
+        self.sse = 0.0
+        self.sae = 0.0
+        self.reservoir = np.empty((0, 2))
+
+    def update(self, y, z):
+        """Update statistics given labels `y` and predictions `z`."""
+        y = np.asarray(y, dtype=np.float64).ravel()
+        z = np.asarray(z, dtype=np.float64).ravel()
+        if self.mask is not None:
+            idx = y != self.mask
+            y = y[idx]
+            z = z[idx]
+        n = len(y)
+        if not n:
+            return
+
+        self.counts += np.array(confusion_counts(y, z))
+        pos = np.round(y) == 1
+        self.pos_hist += _hist(z[pos], self.nb_bin)
+        self.neg_hist += _hist(z[~pos], self.nb_bin)
+
+        data = np.vstack([y, z]).T
+        mean = data.mean(axis=0)
+        dev = data - mean
+        self.mean, self.m2 = merge_moments(self.n, self.mean, self.m2,
+                                           n, mean, dev.T.dot(dev))
+        self.sse += np.sum((y - z)**2)
+        self.sae += np.sum(np.abs(y - z))
+
+        if 'kendall' in self.metrics:
+            self.reservoir = update_reservoir(self.reservoir, data, self.n,
+                                             self.nb_sample)
+        self.n += n
+
+    def result(self):
+        """Return performance metrics.
+
+        Returns
+        -------
+        OrderedDict
+            `OrderedDict` with the same keys as :func:`evaluate`.
+        """
+        p = OrderedDict()
+        cla = metrics_from_counts(*self.counts)
+        for metric in self.metrics:
+            if not self.n:
+                value = np.nan
+            elif metric == 'auc':
+                value = auc_from_hist(self.pos_hist, self.neg_hist)
+            elif metric in cla:
+                value = cla[metric]
+            elif metric == 'mse':
+                value = self.sse / self.n
+            elif metric == 'rmse':
+                value = np.sqrt(self.sse / self.n)
+            elif metric == 'mad':
+                value = self.sae / self.n
+            elif metric == 'cor':
+                value = self.m2[0, 1] / np.sqrt(self.m2[0, 0] * self.m2[1, 1])
+            else:
+                value = kendall(self.reservoir[:, 0], self.reservoir[:, 1],
+                                nb_sample=self.nb_sample)
+            p[metric] = float(value)
+        p['n'] = self.n
+        return p
+
+
+class CatMetricAccumulator(object):
+    """Accumulate performance metrics of a categorical output batch-wise.
+
+    Computes the same metrics as :func:`evaluate_cat` with `binary_metrics`
+    set to `[auc]`.
+
+    Parameters
+    ----------
+    nb_bin: int
+        Number of bins for computing AUC.
+    """
+
+    def __init__(self, nb_bin=1000):
+        self.nb_bin = nb_bin
+        self.n = 0
+        self.nb_correct = 0
+        self.pos_hist = None
+        self.neg_hist = None
+
+    def update(self, y, z):
+        """Update statistics given one-hot labels `y` and probabilities `z`."""
+        idx = y.sum(axis=1) > 0
+        y = y[idx]
+        z = z[idx]
+        if self.pos_hist is None:
+            shape = (y.shape[1], self.nb_bin)
+            self.pos_hist = np.zeros(shape, dtype=np.int64)
+            self.neg_hist = np.zeros(shape, dtype=np.int64)
+        self.nb_correct += np.sum(y.argmax(axis=1) == z.argmax(axis=1))
+        for i in range(y.shape[1]):
+            pos = np.round(y[:, i]) == 1
+            self.pos_hist[i] += _hist(z[pos, i], self.nb_bin)
+            self.neg_hist[i] += _hist(z[~pos, i], self.nb_bin)
+        self.n += len(y)
+
+    def result(self):
+        """Return performance metrics."""
+        p = OrderedDict()
+        p['cat_acc'] = self.nb_correct / self.n if self.n else np.nan
+        if self.pos_hist is not None:
+            aucs = auc_from_hist(self.pos_hist, self.neg_hist)
+            for i, value in enumerate(aucs):
+                p['auc_%d' % i] = float(value)
+        p['n'] = self.n
+        return p
+
+
 def get_output_metrics(output_name):
     """Return list of evaluation metrics for model output name."""
     _output_name = output_name.split(OUTPUT_SEP)
@@ -227,10 +533,26 @@ def evaluate_outputs(outputs, preds):
     :class:`pandas.DataFrame`
         :class:`pandas.DataFrame` with columns `metric`, `output`, `value`.
     """
-    perf = []
+    perf = OrderedDict()
+    # Evaluate binary outputs of the same length at once
+    binary = OrderedDict()
+    for output_name in outputs:
+        if output_name.split(OUTPUT_SEP)[-1] != 'cat_var' and \
+                get_output_metrics(output_name) == CLA_METRICS and \
+                outputs[output_name].ndim == 1:
+            binary.setdefault(len(outputs[output_name]), []).append(
+                output_name)
+    binary_perf = dict()
+    for names in binary.values():
+        y = np.stack([outputs[name] for name in names], axis=1)
+        z = np.stack([preds[name].ravel() for name in names], axis=1)
+        binary_perf.update(zip(names, evaluate_binary(y, z)))
+
     for output_name in outputs:
         _output_name = output_name.split(OUTPUT_SEP)
-        if _output_name[-1] in ['cat_var']:
+        if output_name in binary_perf:
+            tmp = binary_perf[output_name]
+        elif _output_name[-1] in ['cat_var']:
             tmp = evaluate_cat(outputs[output_name],
                                preds[output_name],
                                binary_metrics=[auc])
@@ -239,14 +561,65 @@ def evaluate_outputs(outputs, preds):
             tmp = evaluate(outputs[output_name],
                            preds[output_name],
                            metrics=metrics)
+        perf[output_name] = tmp
+    return _format_report(perf)
+
+
+def _format_report(perf):
+    """Format `dict` with performance metrics of outputs as data frame."""
+    report = []
+    for output_name, tmp in perf.items():
         tmp = pd.DataFrame({'output': output_name,
                             'metric': list(tmp.keys()),
                             'value': list(tmp.values())})
-        perf.append(tmp)
-    perf = pd.concat(perf)
-    perf = perf[['metric', 'output', 'value']]
-    perf.sort_values(['metric', 'value'], inplace=True)
-    return perf
+        report.append(tmp)
+    report = pd.concat(report)
+    report = report[['metric', 'output', 'value']]
+    report.sort_values(['metric', 'value'], inplace=True)
+    return report
+
+
+class StreamingEvaluator(object):
+    """Evaluate performance metrics of multiple outputs batch-wise.
+
+    Streaming alternative to :func:`evaluate_outputs`, which evaluates
+    outputs on all data with constant memory using :class:`MetricAccumulator`
+    and :class:`CatMetricAccumulator`.
+
+    Parameters
+    ----------
+    nb_bin: int
+        Number of bins for computing AUC.
+    nb_sample: int
+        Size of reservoir sample for computing Kendall's correlation.
+    """
+
+    def __init__(self, nb_bin=1000, nb_sample=100000):
+        self.nb_bin = nb_bin
+        self.nb_sample = nb_sample
+        self.accumulators = OrderedDict()
+
+    def update(self, outputs, preds):
+        """Update metrics given `dict` of labels and predictions."""
+        for output_name in outputs:
+            if output_name not in self.accumulators:
+                _output_name = output_name.split(OUTPUT_SEP)
+                if _output_name[-1] in ['cat_var']:
+                    acc = CatMetricAccumulator(nb_bin=self.nb_bin)
+                else:
+                    acc = MetricAccumulator(get_output_metrics(output_name),
+                                            nb_bin=self.nb_bin,
+                                            nb_sample=self.nb_sample)
+                self.accumulators[output_name] = acc
+            self.accumulators[output_name].update(outputs[output_name],
+                                                  preds[output_name])
+
+    def report(self):
+        """Return performance metrics as :func:`evaluate_outputs`."""
+        perf = OrderedDict()
+        for output_name, acc in self.accumulators.items():
+            perf[output_name] = acc.result()
+        return _format_report(perf)
 
 
 def is_binary_output(output_name):
@@ -109,6 +109,14 @@ def cat_acc(y, z):
     return _acc
 
 
+def masked_acc(y, z, mask=CPG_NAN):
+    """Compute accuracy of stacked binary outputs ignoring `mask` labels."""
+    weights = _sample_weights(y, mask)
+    _acc = K.cast(K.equal(y, K.round(z)), K.floatx())
+    _acc = K.sum(_acc * weights) / K.sum(weights)
+    return _acc
+
+
 def mse(y, z, mask=CPG_NAN):
     """Compute mean squared error."""
     weights = _sample_weights(y, mask)
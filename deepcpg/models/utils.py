@@ -4,20 +4,27 @@
 from __future__ import division
 from __future__ import print_function
 
+from collections import OrderedDict
+import fcntl
+from glob import glob
+import hashlib
+import os
 from os import path as pt
+import time
+import uuid
 
 from keras import backend as K
 from keras import models as km
 from keras import layers as kl
-from keras.utils.np_utils import to_categorical
 import numpy as np
 import pandas as pd
+import six
 
 from .. import data as dat
 from .. import evaluation as ev
 from ..data import hdf, OUTPUT_SEP
 from ..data.dna import int_to_onehot
-from ..utils import to_list
+from ..utils import make_dir, to_list
 
 
 class ScaledSigmoid(kl.Layer):
@@ -44,7 +51,51 @@ class ScaledSigmoid(kl.Layer):
         return dict(list(base_config.items()) + list(config.items()))
 
 
-CUSTOM_OBJECTS = {'ScaledSigmoid': ScaledSigmoid}
+# Name of output layer that predicts all CpG outputs in stacked output mode.
+CPG_STACKED = 'cpg'
+
+
+class StackedDense(kl.Dense):
+    """Output layer that predicts multiple binary outputs.
+
+    Predicts all outputs in `output_names` by a single `Dense` layer with one
+    unit per output, which is equivalent to one `Dense(1)` layer per output
+    but faster for many outputs. Labels are [batch_size, nb_output] matrices
+    with `CPG_NAN` for missing labels.
+
+    Parameters
+    ----------
+    output_names: list
+        Names of stacked outputs.
+    """
+    def __init__(self, output_names, **kwargs):
+        self.output_names = list(output_names)
+        kwargs.pop('units', None)
+        kwargs.setdefault('activation', 'sigmoid')
+        super(StackedDense, self).__init__(len(self.output_names), **kwargs)
+
+    def get_config(self):
+        config = super(StackedDense, self).get_config()
+        config.pop('units')
+        config['output_names'] = self.output_names
+        return config
+
+
+def masked_binary_crossentropy(y, z, mask=dat.CPG_NAN):
+    """Binary cross-entropy of stacked outputs that ignores missing labels.
+
+    Sums the binary cross-entropy over all outputs whose labels are not `mask`.
+    """
+    weights = 1 - K.cast(K.equal(y, mask), K.floatx())
+    y = y * weights
+    z = K.clip(z, K.epsilon(), 1 - K.epsilon())
+    loss = -(y * K.log(z) + (1 - y) * K.log(1 - z))
+    return K.sum(loss * weights, axis=-1)
+
+
+CUSTOM_OBJECTS = {'ScaledSigmoid': ScaledSigmoid,
+                  'StackedDense': StackedDense,
+                  'masked_binary_crossentropy': masked_binary_crossentropy}
 
 
 def get_first_conv_layer(layers, get_act=False):
@@ -110,6 +161,72 @@ def get_sample_weights(y, class_weights=None):
     return sample_weights
 
 
+def get_weight_table(output_names, class_weights=None):
+    """Build lookup table of sample weights for :func:`get_batch_weights`.
+
+    Encodes the weights of :func:`get_sample_weights` for all outputs in a
+    single table, such that sample weights of all outputs can be computed by
+    one lookup.
+
+    Parameters
+    ----------
+    output_names: list
+        Names of outputs.
+    class_weights: dict
+        dict of dict with class weights of individual outputs.
+
+    Returns
+    -------
+    tuple
+        Tuple (`table`, `offset`), where `table` is a
+        [nb_output, nb_class + 1] :class:`numpy.ndarray` with the weight of
+        label `offset + i` in column `i`. The last column is the weight of
+        labels that are not in the table.
+    """
+    classes = [dat.CPG_NAN]
+    if class_weights:
+        for name in output_names:
+            classes.extend((class_weights.get(name) or dict()).keys())
+    offset = int(np.floor(min(classes)))
+    nb_class = int(np.floor(max(classes))) - offset + 1
+    table = np.ones((len(output_names), nb_class + 1), dtype=K.floatx())
+    table[:, dat.CPG_NAN - offset] = K.epsilon()
+    if class_weights:
+        for i, name in enumerate(output_names):
+            for cla, weight in six.iteritems(class_weights.get(name) or dict()):
+                if cla == int(cla):
+                    table[i, int(cla) - offset] = weight
+    return (table, offset)
+
+
+def get_batch_weights(labels, table, offset):
+    """Compute sample weights of all outputs by a single table lookup.
+
+    Parameters
+    ----------
+    labels: :class:`numpy.ndarray`
+        [nb_output, batch_size] :class:`numpy.ndarray` with output labels.
+    table: :class:`numpy.ndarray`
+        Weight table returned by :func:`get_weight_table`.
+    offset: int
+        Label offset returned by :func:`get_weight_table`.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        [nb_output, batch_size] :class:`numpy.ndarray` with sample weights.
+    """
+    nb_class = table.shape[1] - 1
+    idx = labels - offset
+    if labels.dtype.kind == 'f':
+        out = (idx < 0) | (idx >= nb_class) | (idx != np.floor(idx))
+    else:
+        out = (idx < 0) | (idx >= nb_class)
+    idx = np.where(out, nb_class, idx).astype(np.int64)
+    rows = np.arange(len(table)).reshape(-1, 1)
+    return table[rows, idx]
+
+
 def save_model(model, model_file, weights_file=None):
     """Save Keras model to file.
 
@@ -213,7 +330,9 @@ def get_objectives(output_names):
     objectives = dict()
     for output_name in output_names:
         _output_name = output_name.split(OUTPUT_SEP)
-        if _output_name[0] in ['bulk']:
+        if output_name == CPG_STACKED:
+            objective = masked_binary_crossentropy
+        elif _output_name[0] in ['bulk']:
             objective = 'mean_squared_error'
         elif _output_name[-1] in ['mean', 'var']:
             objective = 'mean_squared_error'
@@ -225,7 +344,8 @@ def get_objectives(output_names):
     return objectives
 
 
-def add_output_layers(stem, output_names, init='glorot_uniform'):
+def add_output_layers(stem, output_names, init='glorot_uniform',
+                      stacked=False):
     """Add and return outputs to a given layer.
 
     Adds output layer for each output in `output_names` to layer `stem`.
@@ -236,6 +356,9 @@ def add_output_layers(stem, output_names, init='glorot_uniform'):
         Keras layer to which output layers are added.
     output_names: list
         List of output names.
+    stacked: bool
+        If `True`, predict all CpG outputs 'cpg/*' by a single
+        :class:`StackedDense` layer with name `CPG_STACKED`.
 
     Returns
     -------
@@ -243,9 +366,18 @@ def add_output_layers(stem, output_names, init='glorot_uniform'):
         Output layers added to `stem`.
     """
     outputs = []
+    cpg_names = []
+    if stacked:
+        cpg_names = [output_name for output_name in output_names
+                     if output_name.split(OUTPUT_SEP)[0] == 'cpg']
     for output_name in output_names:
         _output_name = output_name.split(OUTPUT_SEP)
-        if _output_name[-1] in ['entropy']:
+        if output_name in cpg_names:
+            if output_name != cpg_names[0]:
+                continue
+            x = StackedDense(cpg_names, kernel_initializer=init,
+                             name=CPG_STACKED)(stem)
+        elif _output_name[-1] in ['entropy']:
             x = kl.Dense(1, kernel_initializer=init, activation='relu')(stem)
         elif _output_name[-1] in ['var']:
             x = kl.Dense(1, kernel_initializer=init)(stem)
@@ -262,6 +394,374 @@ def add_output_layers(stem, output_names, init='glorot_uniform'):
     return outputs
 
 
+def get_stacked_outputs(model):
+    """Return names of stacked outputs of `model`.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict` with names of :class:`StackedDense` output layers as
+        keys and the names of their stacked outputs as values.
+    """
+    stacked_outputs = OrderedDict()
+    for layer in model.output_layers:
+        if isinstance(layer, StackedDense):
+            stacked_outputs[layer.name] = layer.output_names
+    return stacked_outputs
+
+
+def get_dna_embedding_layer(model):
+    """Return the last layer of the DNA module of `model`.
+
+    Trailing dropout layers are not part of the DNA embedding, such that they
+    are still applied when training on cached embeddings.
+
+    Returns
+    -------
+    :class:`keras.layers.Layer`
+        Layer whose output is the DNA embedding or `None` if `model` has no
+        DNA module.
+    """
+    emb_layer = None
+    for layer in model.layers:
+        if layer.name.startswith('dna/') and \
+                not isinstance(layer, kl.Dropout):
+            emb_layer = layer
+    return emb_layer
+
+
+def get_dna_model_hash(model, emb_layer=None):
+    """Return hash of the DNA module of `model`.
+
+    The hash is computed from the weights and names of all layers of the DNA
+    module and changes if the DNA module is retrained.
+    """
+    if emb_layer is None:
+        emb_layer = get_dna_embedding_layer(model)
+    md5 = hashlib.md5()
+    md5.update(emb_layer.name.encode())
+    for layer in model.layers:
+        if layer.name == 'dna' or layer.name.startswith('dna/'):
+            md5.update(layer.name.encode())
+            md5.update(str(layer.get_config()).encode())
+            for weight in layer.get_weights():
+                md5.update(np.ascontiguousarray(weight).tobytes())
+    return md5.hexdigest()[:16]
+
+
+def get_dna_model(model, emb_layer=None):
+    """Return model that maps the DNA input of `model` to DNA embeddings."""
+    if emb_layer is None:
+        emb_layer = get_dna_embedding_layer(model)
+    if emb_layer is None:
+        raise ValueError('Model has no DNA module!')
+    return km.Model(model.get_layer('dna').output, emb_layer.output,
+                    name='dna')
+
+
+def _get_inbound_layers(layer):
+    # `inbound_nodes` became private in Keras 2.1.3
+    nodes = getattr(layer, '_inbound_nodes', None)
+    if nodes is None:
+        nodes = layer.inbound_nodes
+    return nodes[0].inbound_layers
+
+
+def build_head_model(model, emb_layer=None, emb_name='dna/embedding'):
+    """Build model that predicts outputs of `model` from DNA embeddings.
+
+    Replaces the DNA module up to `emb_layer` by a new input `emb_name` for
+    the output of `emb_layer` and re-applies all following layers, which share
+    their weights with `model`. Other inputs, e.g. of the CpG module, are
+    kept.
+
+    Parameters
+    ----------
+    model: :class:`keras.models.Model`
+        DNA or joint model.
+    emb_layer: :class:`keras.layers.Layer`
+        Last layer of DNA module returned by :func:`get_dna_embedding_layer`.
+    emb_name: str
+        Name of embedding input.
+
+    Returns
+    -------
+    :class:`keras.models.Model`
+        Model with the same outputs as `model`.
+    """
+    if emb_layer is None:
+        emb_layer = get_dna_embedding_layer(model)
+    if emb_layer is None:
+        raise ValueError('Model has no DNA module!')
+
+    tensors = dict()
+    inputs = [kl.Input(shape=emb_layer.output_shape[1:], name=emb_name)]
+    tensors[emb_layer.name] = inputs[0]
+    for layer in model.input_layers:
+        if layer.name != 'dna':
+            tensors[layer.name] = kl.Input(shape=layer.output_shape[1:],
+                                           name=layer.name)
+            inputs.append(tensors[layer.name])
+
+    # Layers are sorted topologically, such that layers of the DNA module
+    # before `emb_layer` precede it
+    emb_idx = model.layers.index(emb_layer)
+    for idx, layer in enumerate(model.layers):
+        if layer.name in tensors or layer.name == 'dna' or \
+                (layer.name.startswith('dna/') and idx < emb_idx):
+            continue
+        inbound = [tensors[inbound_layer.name] for inbound_layer
+                   in to_list(_get_inbound_layers(layer))]
+        if len(inbound) == 1:
+            inbound = inbound[0]
+        tensors[layer.name] = layer(inbound)
+
+    outputs = [tensors[layer.name] for layer in model.output_layers]
+    return km.Model(inputs, outputs, name=model.name)
+
+
+class DnaEmbeddingCache(object):
+    """Persistent cache of DNA embeddings of CpG sites.
+
+    Stores the output of the DNA module of a model for CpG sites in the
+    directory `cache_dir`/`model_hash`, such that the DNA module needs to be
+    evaluated only once per site and model. Embeddings are appended to
+    `embedding.bin` in the order in which they are added, which is
+    memory-mapped. Each call of :meth:`add` writes one index shard
+    `index.*.npz` with the chromosome, position, and row in `embedding.bin` of
+    the added sites. Shards are merged into one index sorted by chromosome and
+    position when the cache is loaded or first queried after adding sites.
+    Multiple processes can add sites to the same cache at once, since
+    :meth:`add` holds an exclusive lock on `lock` in the cache directory.
+
+    Parameters
+    ----------
+    cache_dir: str
+        Cache directory.
+    model_hash: str
+        Hash of DNA module returned by :func:`get_dna_model_hash`.
+    """
+
+    def __init__(self, cache_dir, model_hash):
+        self.dirname = pt.join(cache_dir, model_hash)
+        self.chromo = np.array([], dtype='S')
+        self.pos = np.array([], dtype=np.int32)
+        self.rows = np.array([], dtype=np.int64)
+        self.shape = None
+        self.embedding = None
+        self.ranges = dict()
+        self._shards = []
+        self._load()
+
+    def _load(self):
+        filenames = sorted(glob(pt.join(self.dirname, 'index.*.npz')))
+        for filename in filenames:
+            shard = np.load(filename)
+            self.shape = tuple(shard['shape'])
+            self._shards.append((shard['chromo'], shard['pos'], shard['row']))
+        self._update()
+
+    def _update(self):
+        """Merge index shards that were added since the last update."""
+        if not self._shards:
+            return
+        shards = [(self.chromo, self.pos, self.rows)] + self._shards
+        chromo, pos, rows = [np.concatenate(values)
+                             for values in zip(*shards)]
+        order = np.lexsort((pos, chromo))
+        self.chromo = chromo[order]
+        self.pos = pos[order]
+        self.rows = rows[order]
+        self._shards = []
+
+        shape = (self.rows.max() + 1,) + self.shape
+        self.embedding = np.memmap(pt.join(self.dirname, 'embedding.bin'),
+                                   dtype=np.float32, mode='r', shape=shape)
+        self.ranges = dict()
+        chromos, starts = np.unique(self.chromo, return_index=True)
+        ends = np.append(starts[1:], len(self.chromo))
+        for chromo, start, end in zip(chromos, starts, ends):
+            self.ranges[chromo] = (start, end)
+
+    def __len__(self):
+        self._update()
+        return len(self.pos)
+
+    def lookup(self, chromo, pos):
+        """Return index of sites in cache or -1 if sites are not cached."""
+        self._update()
+        chromo = np.asarray(chromo)
+        pos = np.asarray(pos)
+        idx = np.empty(len(pos), dtype=np.int64)
+        idx.fill(-1)
+        for _chromo in np.unique(chromo):
+            if _chromo not in self.ranges:
+                continue
+            start, end = self.ranges[_chromo]
+            sel = chromo == _chromo
+            cached_pos = self.pos[start:end]
+            tmp = np.minimum(np.searchsorted(cached_pos, pos[sel]),
+                             len(cached_pos) - 1)
+            idx[sel] = np.where(cached_pos[tmp] == pos[sel], tmp + start, -1)
+        return idx
+
+    def get(self, chromo, pos):
+        """Return embeddings of sites, which must be cached."""
+        idx = self.lookup(chromo, pos)
+        if np.any(idx < 0):
+            raise ValueError('%d sites not cached!' % np.sum(idx < 0))
+        return np.asarray(self.embedding[self.rows[idx]])
+
+    def add(self, chromo, pos, embedding):
+        """Append embeddings of new sites to cache.
+
+        Only `embedding` and an index shard of the new sites are written,
+        such that the cost of adding sites does not depend on the number of
+        sites that are already cached.
+        """
+        if not len(pos):
+            return
+        embedding = np.ascontiguousarray(embedding, dtype=np.float32)
+        if self.shape is not None and self.shape != embedding.shape[1:]:
+            raise ValueError('Embeddings of shape %s expected!' %
+                             str(self.shape))
+
+        make_dir(self.dirname)
+        chromo = np.asarray(chromo)
+        pos = np.asarray(pos).astype(np.int32)
+        order = np.lexsort((pos, chromo))
+        row_size = embedding[0].nbytes
+        # Shard names are unique across processes
+        name = uuid.uuid4().hex
+        filename = pt.join(self.dirname, 'index.%s.npz' % name)
+        tmp_filename = pt.join(self.dirname, 'tmp.%s.npz' % name)
+        with open(pt.join(self.dirname, 'lock'), 'w') as lock:
+            # Rows of other processes must not be appended between computing
+            # the offset of rows and writing the index shard
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(pt.join(self.dirname, 'embedding.bin'), 'ab') as f:
+                    # Discard incomplete row of an interrupted add
+                    nb_row = f.tell() // row_size
+                    f.truncate(nb_row * row_size)
+                    f.write(embedding.tobytes())
+                rows = np.arange(nb_row, nb_row + len(embedding))
+                # Renaming makes sites visible only after embeddings were
+                # written
+                np.savez(tmp_filename, chromo=chromo[order], pos=pos[order],
+                         row=rows[order],
+                         shape=np.array(embedding.shape[1:], dtype=np.int64))
+                os.rename(tmp_filename, filename)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        self.shape = embedding.shape[1:]
+        self._shards.append((chromo, pos, rows))
+
+
+def fill_dna_cache(cache, dna_model, data_files, nb_sample=None,
+                   batch_size=128, nb_batch_add=100, log=None):
+    """Compute DNA embeddings of sites in `data_files` that are not cached.
+
+    Parameters
+    ----------
+    cache: :class:`DnaEmbeddingCache`
+        Cache of DNA embeddings.
+    dna_model: :class:`keras.models.Model`
+        Model with DNA input and embedding output.
+    data_files: list
+        Data files from `dcpg_data.py`.
+    nb_sample: int
+        Maximum number of samples.
+    batch_size: int
+        Batch size.
+    nb_batch_add: int
+        Number of batches whose embeddings are added to `cache` at once,
+        which bounds memory usage.
+    log: function
+        Function to log progress.
+
+    Returns
+    -------
+    int
+        Number of sites that were added to `cache`.
+    """
+    meta = hdf.read(data_files, ['chromo', 'pos'], nb_sample=nb_sample)
+    missing = cache.lookup(meta['chromo'], meta['pos']) < 0
+    if log:
+        log('%d / %d sites cached' % (np.sum(~missing), len(missing)))
+    if not np.any(missing):
+        return 0
+    # Sites might occur multiple times in `data_files`
+    _, first = np.unique(np.rec.fromarrays([meta['chromo'], meta['pos']]),
+                         return_index=True)
+    is_first = np.zeros(len(missing), dtype=bool)
+    is_first[first] = True
+    missing &= is_first
+
+    reader = DataReader(use_dna=True, dna_wlen=dna_model.input_shape[1])
+    reader = reader(data_files, meta_names=['chromo', 'pos'],
+                    nb_sample=nb_sample, batch_size=batch_size,
+                    loop=False, shuffle=False)
+    chromos = []
+    positions = []
+    embeddings = []
+
+    def add():
+        nb_site = sum([len(batch_pos) for batch_pos in positions])
+        cache.add(np.concatenate(chromos), np.concatenate(positions),
+                  np.concatenate(embeddings).astype(np.float32))
+        del chromos[:], positions[:], embeddings[:]
+        return nb_site
+
+    nb_add = 0
+    idx = 0
+    for inputs, batch_meta in reader:
+        batch_missing = missing[idx:(idx + len(batch_meta['pos']))]
+        idx += len(batch_meta['pos'])
+        if not np.any(batch_missing):
+            continue
+        embeddings.append(dna_model.predict(inputs['dna'][batch_missing],
+                                            batch_size=batch_size))
+        chromos.append(batch_meta['chromo'][batch_missing])
+        positions.append(batch_meta['pos'][batch_missing])
+        if len(embeddings) == nb_batch_add:
+            nb_add += add()
+            if log:
+                log('%d sites added' % nb_add)
+    if embeddings:
+        nb_add += add()
+    return nb_add
+
+
+@dat.threadsafe_generator
+def add_dna_embeddings(reader, cache, name='dna/embedding'):
+    """Add cached DNA embeddings to batches of `reader`.
+
+    Parameters
+    ----------
+    reader: generator
+        Generator returned by :class:`DataReader` with `meta_names` 'chromo'
+        and 'pos', which yields `meta` as last element.
+    cache: :class:`DnaEmbeddingCache`
+        Cache of DNA embeddings.
+    name: str
+        Name of embedding input.
+
+    Returns
+    -------
+    generator
+        Generator that yields the batches of `reader` without `meta` and with
+        embeddings as additional input `name`.
+    """
+    for data in reader:
+        meta = data[-1]
+        data[0][name] = cache.get(meta['chromo'], meta['pos'])
+        if len(data) == 2:
+            yield data[0]
+        else:
+            yield data[:-1]
+
+
 def predict_generator(model, generator, nb_sample=None):
     """Predict model outputs using generator.
 
@@ -410,6 +910,130 @@ def copy_weights(src_model, dst_model, must_exist=True):
     return copied
 
 
+def set_nb_thread(model, intra_op=0, inter_op=0):
+    """Set number of threads of TensorFlow operations.
+
+    Replaces the current TensorFlow session, which is closed to release its
+    thread pools, by a new session with the given number of threads and
+    restores the weights of `model` in the new session. Only supported by the
+    TensorFlow backend.
+
+    Parameters
+    ----------
+    model: :class:`keras.models.Model`
+        Loaded Keras model.
+    intra_op: int
+        Number of threads within operations. Zero lets TensorFlow choose.
+    inter_op: int
+        Number of operations that are run in parallel. Zero lets TensorFlow
+        choose.
+    """
+    if K.backend() != 'tensorflow':
+        raise ValueError('Setting the number of threads requires the'
+                         ' TensorFlow backend!')
+    import tensorflow as tf
+    weights = model.get_weights()
+    config = tf.ConfigProto(intra_op_parallelism_threads=intra_op,
+                            inter_op_parallelism_threads=inter_op)
+    K.get_session().close()
+    K.set_session(tf.Session(config=config))
+    model.set_weights(weights)
+
+
+def parse_nb_threads(values):
+    """Parse list of 'intra_op,inter_op' strings into list of tuples."""
+    nb_threads = []
+    for value in to_list(values) or []:
+        nb_thread = tuple([int(x) for x in value.split(',')])
+        if len(nb_thread) != 2:
+            raise ValueError('Invalid thread setting "%s"!' % value)
+        nb_threads.append(nb_thread)
+    return nb_threads
+
+
+def _slice_inputs(inputs, idx):
+    if isinstance(inputs, dict):
+        return {name: value[idx] for name, value in six.iteritems(inputs)}
+    return [value[idx] for value in inputs]
+
+
+def benchmark_inference(fun, inputs, batch_size):
+    """Measure the number of samples per second processed by `fun`.
+
+    Parameters
+    ----------
+    fun: function
+        Function that takes a batch of `inputs`, e.g. `model.predict` or a
+        function returned by `K.function`.
+    inputs: dict or list
+        `dict` or list with model inputs, which are split into batches of
+        size `batch_size`.
+    batch_size: int
+        Batch size.
+
+    Returns
+    -------
+    float
+        Number of samples per second.
+    """
+    nb_sample = len(list(inputs.values())[0] if isinstance(inputs, dict)
+                    else inputs[0])
+    # Exclude initialization time from measurement
+    fun(_slice_inputs(inputs, slice(0, batch_size)))
+    start = time.time()
+    for i in range(0, nb_sample, batch_size):
+        fun(_slice_inputs(inputs, slice(i, i + batch_size)))
+    return nb_sample / max(time.time() - start, 1e-6)
+
+
+def tune_inference(model, fun, inputs, batch_sizes, nb_threads=None,
+                   log=None):
+    """Choose the fastest batch size and number of threads for inference.
+
+    Benchmarks `fun` by :func:`benchmark_inference` for all batch sizes and
+    thread settings and sets the number of threads of the fastest setting by
+    :func:`set_nb_thread`.
+
+    Parameters
+    ----------
+    model: :class:`keras.models.Model`
+        Loaded Keras model that is used by `fun`.
+    fun: function
+        Inference function as described by :func:`benchmark_inference`.
+    inputs: dict or list
+        Model inputs with at least `max(batch_sizes)` samples.
+    batch_sizes: list
+        Batch sizes to be benchmarked.
+    nb_threads: list
+        List of tuples (`intra_op`, `inter_op`) with thread settings to be
+        benchmarked. The current setting is used if `None`.
+    log: function
+        Function to log benchmark results.
+
+    Returns
+    -------
+    tuple
+        Tuple (`batch_size`, `nb_thread`, `rate`) with the fastest batch size,
+        thread setting, and number of samples per second.
+    """
+    best = None
+    for nb_thread in nb_threads or [None]:
+        if nb_thread is not None:
+            set_nb_thread(model, *nb_thread)
+        for batch_size in batch_sizes:
+            rate = benchmark_inference(fun, inputs, batch_size)
+            if log:
+                log('batch_size=%d threads=%s: %.1f samples/s' %
+                    (batch_size, nb_thread, rate))
+            if best is None or rate > best[2]:
+                best = (batch_size, nb_thread, rate)
+    if best[1] is not None and best[1] != nb_threads[-1]:
+        set_nb_thread(model, *best[1])
+    if log:
+        log('Using batch_size=%d threads=%s: %.1f samples/s' % best)
+    return best
+
+
 class Model(object):
     """Abstract model call.
 
@@ -503,6 +1127,12 @@ class DataReader(object):
     encode_replicates: bool
         If `True`, encode replicated names in key of returned dict. This option
         is deprecated and will be removed in the future.
+    stacked_outputs: dict
+        `dict` with names of stacked outputs in `output_names` as keys and the
+        names of individual outputs as values, e.g. returned by
+        :func:`get_stacked_outputs`. Labels of stacked outputs are returned as
+        [batch_size, nb_output] matrices with `CPG_NAN` for missing labels,
+        which are handled by the loss instead of sample weights.
 
     Returns
     -------
@@ -514,8 +1144,9 @@ class DataReader(object):
     def __init__(self, output_names=None,
                  use_dna=True, dna_wlen=None,
                  replicate_names=None, cpg_wlen=None, cpg_max_dist=25000,
-                 encode_replicates=False):
+                 encode_replicates=False, stacked_outputs=None):
         self.output_names = to_list(output_names)
+        self.stacked_outputs = stacked_outputs or dict()
         self.use_dna = use_dna
         self.dna_wlen = dna_wlen
         self.replicate_names = to_list(replicate_names)
@@ -523,6 +1154,13 @@ class DataReader(object):
         self.cpg_max_dist = cpg_max_dist
         self.encode_replicates = encode_replicates
 
+    def _get_label_names(self):
+        """Return names of individual outputs in the order of labels."""
+        label_names = []
+        for name in self.output_names:
+            label_names.extend(self.stacked_outputs.get(name, [name]))
+        return label_names
+
     def _prepro_dna(self, dna):
         """Preprocess DNA sequence windows.
 
@@ -586,8 +1224,97 @@ class DataReader(object):
             prepro_dists = prepro_dists[:, :, tmp]
         return (prepro_states, prepro_dists)
 
+    def prepro_inputs(self, data_raw):
+        """Preprocess model inputs.
+
+        Parameters
+        ----------
+        data_raw: dict
+            `dict` with integer-encoded DNA sequence windows 'inputs/dna' and
+            the state 'inputs/cpg/`name`/state' and distance
+            'inputs/cpg/`name`/dist' of neighboring CpG sites of replicate
+            `name` as stored by `dcpg_data.py`.
+
+        Returns
+        -------
+        dict
+            `dict` with model inputs.
+        """
+        inputs = dict()
+
+        if self.use_dna:
+            inputs['dna'] = self._prepro_dna(data_raw['inputs/dna'])
+
+        if self.replicate_names:
+            states = []
+            dists = []
+            for name in self.replicate_names:
+                tmp = 'inputs/cpg/%s/' % name
+                states.append(data_raw[tmp + 'state'])
+                dists.append(data_raw[tmp + 'dist'])
+            states, dists = self._prepro_cpg(states, dists)
+            if self.encode_replicates:
+                # DEPRECATED: to support loading data for legacy models
+                tmp = '/' + encode_replicate_names(self.replicate_names)
+            else:
+                tmp = ''
+            inputs['cpg/state%s' % tmp] = states
+            inputs['cpg/dist%s' % tmp] = dists
+
+        return inputs
+
+    def _prepro_outputs(self, data_raw, weight_table, weight_offset):
+        """Preprocess output labels and compute sample weights.
+
+        Stacks labels of all outputs into a single [nb_output, batch_size]
+        matrix, computes sample weights by a single table lookup, and one-hot
+        encodes labels of 'cat_var' outputs.
+
+        Parameters
+        ----------
+        data_raw: dict
+            `dict` with data read by :func:`hdf.reader`.
+        weight_table: :class:`numpy.ndarray`
+            Weight table returned by :func:`get_weight_table`.
+        weight_offset: int
+            Label offset returned by :func:`get_weight_table`.
+
+        Returns
+        -------
+        tuple
+            Tuple (`outputs`, `weights`) of `dict` with output labels and
+            sample weights. Values are views of stacked matrices.
+        """
+        label_names = self._get_label_names()
+        batch_size = len(data_raw['outputs/%s' % label_names[0]])
+        labels = np.empty((len(label_names), batch_size), dtype=K.floatx())
+        for i, name in enumerate(label_names):
+            labels[i] = data_raw['outputs/%s' % name]
+        batch_weights = get_batch_weights(labels, weight_table, weight_offset)
+
+        outputs = dict()
+        weights = dict()
+        i = 0
+        for name in self.output_names:
+            if name in self.stacked_outputs:
+                nb_stacked = len(self.stacked_outputs[name])
+                outputs[name] = labels[i:(i + nb_stacked)].T
+                weights[name] = np.ones(batch_size, dtype=K.floatx())
+                i += nb_stacked
+                continue
+            outputs[name] = labels[i]
+            weights[name] = batch_weights[i]
+            if name.endswith('cat_var'):
+                output = labels[i]
+                idx = np.clip(output, 0, 2).astype(np.int64)
+                outputs[name] = np.eye(3, dtype=K.floatx())[idx]
+                outputs[name][output == dat.CPG_NAN] = 0
+            i += 1
+        return (outputs, weights)
+
     @dat.threadsafe_generator
-    def __call__(self, data_files, class_weights=None, *args, **kwargs):
+    def __call__(self, data_files, class_weights=None, meta_names=None,
+                 *args, **kwargs):
         """Return generator for reading data from `data_files`.
 
         Parameters
@@ -596,6 +1323,10 @@ class DataReader(object):
             List of data files to be read.
         class_weights: dict
             dict of dict with class weights of individual outputs.
+        meta_names: list
+            Names of datasets, e.g. 'chromo' and 'pos', that are read in the
+            same pass and returned as additional `dict` `meta` without
+            preprocessing.
         *args: list
             Unnamed arguments passed to :func:`hdf.reader`
         *kwargs: dict
@@ -604,9 +1335,13 @@ class DataReader(object):
         Returns
         -------
         generator
-            Python generator for reading data.
+            Python generator for reading data. Yields `inputs` and, if
+            `self.output_names` is defined, `outputs` and `weights` as
+            described by :class:`DataReader`, followed by `meta` if
+            `meta_names` is defined.
         """
-        names = []
+        meta_names = to_list(meta_names) or []
+        names = list(meta_names)
         if self.use_dna:
             names.append('inputs/dna')
 
@@ -616,47 +1351,25 @@ class DataReader(object):
                 names.append('inputs/cpg/%s/dist' % name)
 
         if self.output_names:
-            for name in self.output_names:
+            for name in self._get_label_names():
                 names.append('outputs/%s' % name)
 
+        if self.output_names:
+            weight_table, weight_offset = get_weight_table(
+                self._get_label_names(), class_weights)
+
         for data_raw in hdf.reader(data_files, names, *args, **kwargs):
-            inputs = dict()
-
-            if self.use_dna:
-                inputs['dna'] = self._prepro_dna(data_raw['inputs/dna'])
-
-            if self.replicate_names:
-                states = []
-                dists = []
-                for name in self.replicate_names:
-                    tmp = 'inputs/cpg/%s/' % name
-                    states.append(data_raw[tmp + 'state'])
-                    dists.append(data_raw[tmp + 'dist'])
-                states, dists = self._prepro_cpg(states, dists)
-                if self.encode_replicates:
-                    # DEPRECATED: to support loading data for legacy models
-                    tmp = '/' + encode_replicate_names(self.replicate_names)
-                else:
-                    tmp = ''
-                inputs['cpg/state%s' % tmp] = states
-                inputs['cpg/dist%s' % tmp] = dists
-
-            if not self.output_names:
-                yield inputs
+            data = [self.prepro_inputs(data_raw)]
+            if self.output_names:
+                data.extend(self._prepro_outputs(
+                    data_raw, weight_table, weight_offset))
+            if meta_names:
+                data.append({name: data_raw[name] for name in meta_names})
+
+            if len(data) == 1:
+                yield data[0]
             else:
-                outputs = dict()
-                weights = dict()
-
-                for name in self.output_names:
-                    outputs[name] = data_raw['outputs/%s' % name]
-                    cweights = class_weights[name] if class_weights else None
-                    weights[name] = get_sample_weights(outputs[name], cweights)
-                    if name.endswith('cat_var'):
-                        output = outputs[name]
-                        outputs[name] = to_categorical(output, 3)
-                        outputs[name][output == dat.CPG_NAN] = 0
-
-                yield (inputs, outputs, weights)
+                yield tuple(data)
 
 
 def data_reader_from_model(model, outputs=True, replicate_names=None):
@@ -709,13 +1422,16 @@ def data_reader_from_model(model, outputs=True, replicate_names=None):
                 raise ValueError(tmp)
             cpg_wlen = input_shape[2]
 
+    stacked_outputs = None
     if outputs:
         # Return output labels.
         output_names = model.output_names
+        stacked_outputs = get_stacked_outputs(model)
 
     return DataReader(output_names=output_names,
                       use_dna=use_dna,
                       dna_wlen=dna_wlen,
                       cpg_wlen=cpg_wlen,
                       replicate_names=replicate_names,
-                      encode_replicates=encode_replicates)
+                      encode_replicates=encode_replicates,
+                      stacked_outputs=stacked_outputs)
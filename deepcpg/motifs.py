@@ -6,7 +6,11 @@ from __future__ import print_function
 from collections import OrderedDict
 import re
 
+import numpy as np
 import pandas as pd
+from six.moves import range
+
+from .utils import linear_weights, merge_moments, update_reservoir
 
 
 def read_tomtom(path):
@@ -84,3 +88,246 @@ def get_report(filter_stats_file, tomtom_file, meme_motifs):
     d = pd.merge(d, meme_motifs, on='target id', how='left')
     d.index.name = None
     return d
+
+
+class FilterActStats(object):
+    """Streaming statistics of filter activations.
+
+    Summarizes activations of the filters of a convolutional layer batch-wise
+    without storing all activations, as needed by `dcpg_filter_motifs.py`:
+
+    * `mean`, `std`, and `max` of the activations of each filter;
+    * the `nb_top` highest activations of each filter and the k-mers of
+      length `filter_len` at which they occur;
+    * a reservoir sample of at most `nb_sample` activation vectors for
+      plotting activation densities;
+    * the mean, weighted mean, and maximum activation of each filter in the
+      first `nb_pca` sequences;
+    * nucleotide counts of sequences.
+
+    Parameters
+    ----------
+    nb_filter: int
+        Number of filters.
+    filter_len: int
+        Filter length.
+    nb_top: int
+        Number of highest activations and k-mers stored per filter.
+    nb_sample: int
+        Size of reservoir sample of activations.
+    nb_pca: int
+        Number of sequences whose mean activations are stored.
+    """
+
+    def __init__(self, nb_filter, filter_len, nb_top=25000, nb_sample=10000,
+                 nb_pca=1000):
+        self.nb_filter = nb_filter
+        self.filter_len = filter_len
+        self.nb_top = nb_top
+        self.nb_sample = nb_sample
+        self.nb_pca = nb_pca
+        self.n = 0
+        self.mean = np.zeros(nb_filter)
+        self.m2 = np.zeros(nb_filter)
+        self.max = np.empty(nb_filter)
+        self.max.fill(-np.inf)
+        self.top_act = [np.array([], dtype=np.float32)
+                        for i in range(nb_filter)]
+        self.top_kmers = [np.empty((0, filter_len), dtype=np.int8)
+                          for i in range(nb_filter)]
+        self.sample = np.empty((0, nb_filter), dtype=np.float32)
+        self.pca_act = OrderedDict()
+        for name in ['mean', 'wmean', 'max']:
+            self.pca_act[name] = np.empty((0, nb_filter), dtype=np.float32)
+        self.nt_count = np.zeros(4, dtype=np.int64)
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / max(self.n, 1))
+
+    def _get_kmers(self, seqs, seq_idx, pos):
+        """Return k-mers of `seqs` at activations at positions `pos`.
+
+        k-mers at the sequence borders as defined by :func:`get_act_kmers` of
+        `dcpg_filter_motifs.py` are invalid and filled with -1.
+        """
+        filter_del = self.filter_len // 2
+        valid = (pos >= filter_del) & \
+            (pos <= seqs.shape[1] - self.filter_len - 1)
+        idx = np.expand_dims(pos - filter_del, 1) + np.arange(self.filter_len)
+        idx = np.clip(idx, 0, seqs.shape[1] - 1)
+        kmers = seqs[np.expand_dims(seq_idx, 1), idx].astype(np.int8)
+        kmers[~valid] = -1
+        return kmers
+
+    def update(self, act, seqs):
+        """Update statistics.
+
+        Parameters
+        ----------
+        act: :class:`numpy.ndarray`
+            [nb_seq, seq_len, nb_filter] :class:`numpy.ndarray` with filter
+            activations.
+        seqs: :class:`numpy.ndarray`
+            [nb_seq, seq_len] :class:`numpy.ndarray` with integer sequences
+            that are aligned with `act`.
+        """
+        nb_seq, seq_len = act.shape[:2]
+        n = nb_seq * seq_len
+        if not n:
+            return
+        for i in range(4):
+            self.nt_count[i] += np.sum(seqs == i)
+
+        nb_pca = min(self.nb_pca - len(self.pca_act['mean']), nb_seq)
+        if nb_pca > 0:
+            pca_act = act[:nb_pca]
+            weights = linear_weights(seq_len)
+            for name, value in [
+                    ('mean', pca_act.mean(axis=1)),
+                    ('wmean', np.average(pca_act, axis=1, weights=weights)),
+                    ('max', pca_act.max(axis=1))]:
+                self.pca_act[name] = np.vstack([self.pca_act[name], value])
+
+        self.sample = update_reservoir(self.sample, act.reshape(n, -1),
+                                       self.n, self.nb_sample)
+
+        mean = act.mean(axis=(0, 1), dtype=np.float64)
+        m2 = np.sum((act - mean.astype(act.dtype))**2, axis=(0, 1),
+                    dtype=np.float64)
+        self.mean, self.m2 = merge_moments(self.n, self.mean, self.m2,
+                                           n, mean, m2)
+        self.max = np.maximum(self.max, act.max(axis=(0, 1)))
+        self.n += n
+
+        # Only activations above the lowest stored activation can be among
+        # the `nb_top` highest activations
+        for i in range(self.nb_filter):
+            top_act = self.top_act[i]
+            thr = -np.inf
+            if len(top_act) >= self.nb_top:
+                thr = top_act.min()
+            seq_idx, pos = np.nonzero(act[:, :, i] > thr)
+            if not len(seq_idx):
+                continue
+            values = act[seq_idx, pos, i]
+            if len(values) > self.nb_top:
+                idx = np.argpartition(-values, self.nb_top - 1)[:self.nb_top]
+                seq_idx = seq_idx[idx]
+                pos = pos[idx]
+                values = values[idx]
+            values = np.concatenate([top_act, values])
+            kmers = np.vstack([self.top_kmers[i],
+                               self._get_kmers(seqs, seq_idx, pos)])
+            if len(values) > self.nb_top:
+                idx = np.argpartition(-values, self.nb_top - 1)[:self.nb_top]
+                values = values[idx]
+                kmers = kmers[idx]
+            self.top_act[i] = values
+            self.top_kmers[i] = kmers
+
+    def _get_thr_per(self, idx, thr_per):
+        """Return minimum activation of filter `idx` given `thr_per`."""
+        if not thr_per:
+            return 0
+        return thr_per * (self.max[idx] - self.mean[idx]) + self.mean[idx]
+
+    def get_kmers(self, idx, thr_per=0.5, thr_max=25000):
+        """Return activating k-mers of filter `idx`.
+
+        Selects k-mers like :func:`get_act_kmers` of `dcpg_filter_motifs.py`,
+        except that the maximum threshold is the `thr_max`-th highest
+        activation instead of the corresponding percentile.
+
+        Parameters
+        ----------
+        idx: int
+            Index of filter.
+        thr_per: float
+            Minimum activation as percentage of the maximum activation above
+            the mean activation.
+        thr_max: int
+            Maximum number of k-mers, which must not exceed `nb_top`.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            [nb_kmer, filter_len] :class:`numpy.ndarray` with integer k-mers.
+        """
+        top_act = self.top_act[idx]
+        thr = self._get_thr_per(idx, thr_per)
+        if thr_max and len(top_act):
+            if thr_max > self.nb_top:
+                raise ValueError('Maximum number of k-mers must be at most'
+                                 ' %d!' % self.nb_top)
+            thr_max = min(thr_max, len(top_act))
+            thr = max(thr, np.sort(top_act)[-thr_max])
+        kmers = self.top_kmers[idx][top_act >= thr]
+        return kmers[kmers[:, 0] >= 0]
+
+    def is_truncated(self, idx, thr_per=0.5, thr_max=25000):
+        """Test if activating k-mers of filter `idx` are truncated.
+
+        k-mers returned by :meth:`get_kmers` are truncated if all `nb_top`
+        stored activations pass `thr_per` and `thr_max` does not limit the
+        number of k-mers to less than `nb_top`. In this case, activations
+        that were not stored might also pass `thr_per`.
+
+        Parameters
+        ----------
+        idx: int
+            Index of filter.
+        thr_per: float
+            Minimum activation as in :meth:`get_kmers`.
+        thr_max: int
+            Maximum number of k-mers as in :meth:`get_kmers`.
+
+        Returns
+        -------
+        bool
+            `True` if k-mers are truncated.
+        """
+        top_act = self.top_act[idx]
+        if len(top_act) < self.nb_top or 0 < thr_max < self.nb_top:
+            return False
+        return top_act.min() >= self._get_thr_per(idx, thr_per)
+
+    def save(self, group):
+        """Save statistics to HDF5 group."""
+        group.attrs['n'] = self.n
+        group.attrs['nb_top'] = self.nb_top
+        for name in ['mean', 'std', 'max', 'nt_count', 'sample']:
+            group[name] = getattr(self, name)
+        for name, value in self.pca_act.items():
+            group['pca_act/%s' % name] = value
+        top_act = np.empty((self.nb_filter, self.nb_top), dtype=np.float32)
+        top_act.fill(np.nan)
+        top_kmers = np.empty((self.nb_filter, self.nb_top, self.filter_len),
+                             dtype=np.int8)
+        top_kmers.fill(-1)
+        for i in range(self.nb_filter):
+            top_act[i, :len(self.top_act[i])] = self.top_act[i]
+            top_kmers[i, :len(self.top_kmers[i])] = self.top_kmers[i]
+        group.create_dataset('top_act', data=top_act, compression='gzip')
+        group.create_dataset('top_kmers', data=top_kmers, compression='gzip')
+
+    @classmethod
+    def load(cls, group):
+        """Load statistics from HDF5 group written by :meth:`save`."""
+        top_act = group['top_act'][()]
+        top_kmers = group['top_kmers'][()]
+        nb_filter, nb_top, filter_len = top_kmers.shape
+        stats = cls(nb_filter, filter_len, nb_top=nb_top)
+        stats.n = int(group.attrs['n'])
+        stats.mean = group['mean'][()]
+        stats.m2 = group['std'][()]**2 * stats.n
+        stats.max = group['max'][()]
+        stats.nt_count = group['nt_count'][()]
+        stats.sample = group['sample'][()]
+        for name in stats.pca_act:
+            stats.pca_act[name] = group['pca_act/%s' % name][()]
+        for i in range(nb_filter):
+            valid = ~np.isnan(top_act[i])
+            stats.top_act[i] = top_act[i][valid]
+            stats.top_kmers[i] = top_kmers[i][valid]
+        return stats
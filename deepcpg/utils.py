@@ -6,8 +6,10 @@ from __future__ import print_function
 from collections import OrderedDict
 import os
 import re
+import threading
+
 import six
-from six.moves import range
+from six.moves import queue, range
 
 import numpy as np
 
@@ -117,7 +119,7 @@ def linear_weights(length, start=0.1):
     :class:`np.ndarray`
         Array of length `length` with weight.
     """
-    weights = np.linspace(start, 1, np.ceil(length / 2))
+    weights = np.linspace(start, 1, int(np.ceil(length / 2)))
     tmp = weights
     if length % 2:
         tmp = tmp[:-1]
@@ -125,6 +127,79 @@ def linear_weights(length, start=0.1):
     return weights
 
 
+def merge_moments(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    """Merge running moments of two sets of samples as in Chan et al.
+
+    Parameters
+    ----------
+    n_a: int
+        Number of samples of the first set, which can be zero.
+    mean_a: :class:`numpy.ndarray`
+        Mean of variables in the first set.
+    m2_a: :class:`numpy.ndarray`
+        Sums of squared deviations from `mean_a` of each variable or, if it
+        has one more dimension than `mean_a`, matrix with sums of products of
+        deviations of all pairs of variables.
+    n_b: int
+        Number of samples of the second set.
+    mean_b: :class:`numpy.ndarray`
+        Mean of variables in the second set.
+    m2_b: :class:`numpy.ndarray`
+        Sums of (products of) deviations of the second set like `m2_a`.
+
+    Returns
+    -------
+    tuple
+        Tuple (`mean`, `m2`) of the merged set.
+    """
+    tot = n_a + n_b
+    delta = mean_b - mean_a
+    if np.ndim(m2_a) > np.ndim(delta):
+        delta2 = np.outer(delta, delta)
+    else:
+        delta2 = delta**2
+    mean = mean_a + delta * n_b / tot
+    m2 = m2_a + m2_b + delta2 * n_a * n_b / tot
+    return (mean, m2)
+
+
+def update_reservoir(sample, data, nb_seen, nb_sample):
+    """Update reservoir sample of rows with rows of `data`.
+
+    Appends rows of `data` until `sample` has `nb_sample` rows and then
+    replaces rows of `sample` by reservoir sampling, where the replaced rows of
+    all rows in `data` are drawn at once.
+
+    Parameters
+    ----------
+    sample: :class:`numpy.ndarray`
+        Reservoir sample with at most `nb_sample` rows.
+    data: :class:`numpy.ndarray`
+        New rows.
+    nb_seen: int
+        Number of rows seen before `data`.
+    nb_sample: int
+        Maximum number of rows in `sample`.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Updated sample, which is a new array if rows were appended.
+    """
+    nb_free = nb_sample - len(sample)
+    if nb_free > 0:
+        sample = np.vstack([sample, data[:nb_free]])
+        data = data[nb_free:]
+    if not len(data):
+        return sample
+    nb_seen = nb_seen + nb_free + np.arange(len(data))
+    idx = (np.random.uniform(0, 1, len(data)) * (nb_seen + 1))
+    idx = idx.astype(np.int64)
+    keep = idx < nb_sample
+    sample[idx[keep]] = data[keep]
+    return sample
+
+
 def to_list(value):
     """Convert `value` to a list."""
     if not isinstance(value, list) and value is not None:
@@ -328,3 +403,108 @@ class ProgressBar(object):
     def close(self):
         if self._value < self.nb_tot:
             self.update(self.nb_tot)
+
+
+def prefetch(generator, max_size=10):
+    """Prefetch values of `generator` in a background thread.
+
+    Values are stored in a queue of at most `max_size` values, such that
+    reading data overlaps with computations on previously read values.
+    Exceptions raised by `generator` are re-raised by the returned generator.
+
+    Parameters
+    ----------
+    generator: generator
+        Generator whose values are prefetched.
+    max_size: int
+        Maximum number of prefetched values.
+
+    Returns
+    -------
+    generator
+        Generator that yields the values of `generator` in the same order.
+    """
+    values = queue.Queue(max_size)
+    stop = threading.Event()
+    end = object()
+
+    def produce():
+        try:
+            for value in generator:
+                if stop.is_set():
+                    return
+                values.put((value, None))
+            values.put((end, None))
+        except Exception as error:
+            values.put((end, error))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            value, error = values.get()
+            if error is not None:
+                raise error
+            if value is end:
+                break
+            yield value
+    finally:
+        # Unblock producer if the returned generator is closed early
+        stop.set()
+        while thread.is_alive():
+            try:
+                values.get_nowait()
+            except queue.Empty:
+                thread.join(0.01)
+
+
+class AsyncWriter(object):
+    """Call a writing function asynchronously in a background thread.
+
+    Arguments of :meth:`__call__` are stored in a queue of at most `max_size`
+    items and passed in the same order to `fun`, such that writing data
+    overlaps with computations. Exceptions raised by `fun` are re-raised by
+    the next call of :meth:`__call__` or :meth:`close`.
+
+    Parameters
+    ----------
+    fun: function
+        Function that writes data.
+    max_size: int
+        Maximum number of queued items.
+    """
+
+    def __init__(self, fun, max_size=10):
+        self.fun = fun
+        self.items = queue.Queue(max_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._consume)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _consume(self):
+        while True:
+            item = self.items.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self.fun(*item[0], **item[1])
+            except Exception as error:
+                self.error = error
+
+    def _check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def __call__(self, *args, **kwargs):
+        self._check_error()
+        self.items.put((args, kwargs))
+
+    def close(self):
+        """Wait until all items are written."""
+        self.items.put(None)
+        self.thread.join()
+        self._check_error()
@@ -47,8 +47,10 @@ from __future__ import print_function
 from __future__ import division
 
 from collections import OrderedDict #import dictory remember order of adding
+from multiprocessing import Pool
 import os
 import sys
+import time
 import warnings
 
 import argparse
@@ -63,9 +65,11 @@ from six.moves import range
 #mainly used the self-defined functions in ./deepcpg/data/*.py.
 from deepcpg import data as dat # import folder ./deepcpg/data/, use functions in this folder
 from deepcpg.data import annotations as an
+from deepcpg.data import cpg_matrix
 from deepcpg.data import stats
 from deepcpg.data import dna
 from deepcpg.data import fasta
+from deepcpg.data import hdf
 from deepcpg.data import feature_extractor as fext
 from deepcpg.utils import make_dir
 
@@ -79,26 +83,45 @@ def prepro_pos_table(pos_tables):
         #isinstance(object, classinfo), used to check if the object belongs to the class.
         pos_tables = [pos_tables]
 
-    pos_table = None
-    for next_pos_table in pos_tables:
-        if pos_table is None:  #for 1st round of loop: pos_table = None because just assigned, next_pos_table = pos_tables[0]
-            pos_table = next_pos_table #pos_table = next_pos_table = pos_tables[0]
-        else:  #for 2nd and all following round, pos_table != None
-            pos_table = pd.concat([pos_table, next_pos_table]) # concatenate all samples' pos together.
-        pos_table = pos_table.groupby('chromo').apply(
-            lambda df: pd.DataFrame({'pos': np.unique(df['pos'])})) ##keep only unique position value (int32).
-        #also, 'pos' has been grouped by chromo
-        pos_table.reset_index(inplace=True)  #reset index, will show three columns, "chromo", "level_1", "pos"
-        pos_table = pos_table[['chromo', 'pos']] #select columns
-        
-#>>> pos_table.iloc[:10,]
-#   chromo  level_1      pos
-#0      1        0  3000827
-#1      1        1  3001007
-#2      1        2  3001018
+    pos_table = pd.concat(pos_tables) # concatenate all samples' pos together.
+    chromo_pos = OrderedDict()
+    for chromo in sorted(pos_table.chromo.unique()):
+        pos = pos_table.pos.values[(pos_table.chromo == chromo).values]
+        chromo_pos[chromo] = pos
+    return make_pos_table(chromo_pos)
+
+
+def make_pos_table(chromo_pos):
+    """Builds position table from `dict` with positions of chromosomes.
 
-        pos_table.sort_values(['chromo', 'pos'], inplace=True)
-    return pos_table
+    Positions are made unique and sorted.
+    """
+    pos_tables = []
+    for chromo, pos in six.iteritems(chromo_pos):
+        pos = np.unique(pos).astype(np.int32) ##keep only unique position value (int32).
+        pos_tables.append(pd.DataFrame({'chromo': np.repeat(chromo, len(pos)),
+                                        'pos': pos}))
+    pos_table = pd.concat(pos_tables, ignore_index=True)
+#>>> pos_table.iloc[:10,]
+#   chromo      pos
+#0      1  3000827
+#1      1  3001007
+#2      1  3001018
+    return pos_table[['chromo', 'pos']]
+
+
+def profiles_pos_table(cpg_profiles):
+    """Extracts unique positions of CpG profiles and sorts them."""
+    chromos = set()
+    for cpg_profile in six.itervalues(cpg_profiles):
+        chromos.update(cpg_profile.keys())
+    chromo_pos = OrderedDict()
+    for chromo in sorted(chromos):
+        chromo_pos[chromo] = np.concatenate(
+            [cpg_profile[chromo][0]
+             for cpg_profile in six.itervalues(cpg_profiles)
+             if chromo in cpg_profile])
+    return make_pos_table(chromo_pos)
 
 
 def split_ext(filename):
@@ -106,30 +129,67 @@ def split_ext(filename):
     return os.path.basename(filename).split(os.extsep)[0] #return file name
 
 
-def read_cpg_profiles(filenames, log=None, *args, **kwargs):
+def _read_cpg_profile(args):
+    """Read single CpG profile and measure the reading time.
+
+    Defined at module level for being called by worker processes of
+    :func:`read_cpg_profiles`.
+    """
+    filename, kwargs = args
+    start = time.time()
+    cpg_profile = dat.parse_cpg_profile(filename, **kwargs) #Read CpG profile from TSV or bedGraph file.
+    return (cpg_profile, time.time() - start)
+
+
+def read_cpg_profiles(filenames, log=None, nb_worker=1, **kwargs):
     """Read methylation profiles.
 
-    Input files can be gzip compressed.
+    Input files can be gzip compressed. Profiles are read in parallel by
+    `nb_worker` processes if `nb_worker` is greater than one. Records are
+    sampled by `nb_sample_chromo` in the calling process in the order of
+    `filenames`, such that samples are reproducible independent of
+    `nb_worker`.
 
     Returns
     -------
     dict
         `dict (key, value)`, where `key` is the output name and `value` the CpG
-        table.
+        profile returned by :func:`deepcpg.data.utils.parse_cpg_profile`, i.e.
+        `dict` with chromosomes as keys and tuples (`pos`, `value`) as values.
     """
 
     cpg_profiles = OrderedDict() #a dictionary which remember the order of item inserted, when iterating it, 
                                  #items are returned in the order their keys were first added.
-    for filename in filenames:
-        if log:
-            log(filename)
-        cpg_file = dat.GzipFile(filename, 'r') #Wrapper to read and write gzip-compressed files.
-        output_name = split_ext(filename) #Remove file extension from `filename`, defined above
-        cpg_profile = dat.read_cpg_profile(cpg_file, sort=True, *args, **kwargs) #Read CpG profile from TSV or bedGraph file.
-        #return :class:`pandas.DataFrame` with columns `chromo`, `pos`, `value`.
-        cpg_profiles[output_name] = cpg_profile #cpg_profiles store multiple sample information
-        cpg_file.close()
-    return cpg_profiles #return ordered dictory, each item is a pandas data frame
+    # Sample records after reading since workers share the random state
+    select_kwargs = dict()
+    if kwargs.get('nb_sample_chromo') is not None:
+        select_kwargs['nb_sample_chromo'] = kwargs.pop('nb_sample_chromo')
+        select_kwargs['nb_sample'] = kwargs.pop('nb_sample', None)
+    args = [(filename, kwargs) for filename in filenames]
+    pool = None
+    if nb_worker > 1:
+        pool = Pool(min(nb_worker, len(filenames)))
+        results = pool.imap(_read_cpg_profile, args)
+    else:
+        results = six.moves.map(_read_cpg_profile, args)
+    try:
+        for i, (filename, result) in enumerate(zip(filenames, results)):
+            cpg_profile, elapsed = result
+            if select_kwargs:
+                cpg_profile = dat.select_cpg_profile(cpg_profile,
+                                                     **select_kwargs)
+            output_name = split_ext(filename) #Remove file extension from `filename`, defined above
+            cpg_profiles[output_name] = cpg_profile #cpg_profiles store multiple sample information
+            if log:
+                nb_site = sum([len(pos) for pos, _ in
+                               six.itervalues(cpg_profile)])
+                log('%s (%d / %d): %d sites in %.1fs' % (
+                    filename, i + 1, len(filenames), nb_site, elapsed))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return cpg_profiles #return ordered dictory, each item is a dict of sorted chromosome arrays
 
 
 def extract_seq_windows(seq, pos, wlen, seq_index=1, assert_cpg=False):
@@ -137,8 +197,9 @@ def extract_seq_windows(seq, pos, wlen, seq_index=1, assert_cpg=False):
 
     Parameters
     ----------
-    seq: str
-        DNA sequence.
+    seq: str or :class:`numpy.ndarray`
+        DNA sequence or integer-encoded sequence returned by
+        :func:`deepcpg.data.dna.seq_to_int`.
     pos: list
         Positions at which windows are extracted.
     wlen: int
@@ -155,102 +216,34 @@ def extract_seq_windows(seq, pos, wlen, seq_index=1, assert_cpg=False):
     """
 
     delta = wlen // 2
-    nb_win = len(pos) #nb_win=32768, which is the default chunk size
-    seq = seq.upper() #change to upper case
-    seq_wins = np.zeros((nb_win, wlen), dtype='int8') #seq_wins.shape = (32768, 1001)
-
-    for i in range(nb_win):
-        p = pos[i] - seq_index
-        if p < 0 or p >= len(seq):
-            raise ValueError('Position %d not on chromosome!' % (p + seq_index))
-        if seq[p:p + 2] != 'CG':
-            warnings.warn('No CpG site at position %d!' % (p + seq_index))
-        win = seq[max(0, p - delta): min(len(seq), p + delta + 1)]
-        if len(win) < wlen: #which means cannot extract 1001 window size from original fasta sequence.
-            #this may caused by the targeted position is so close to end of the chromosome
-            win = max(0, delta - p) * 'N' + win #add NNN to seq
-            win += max(0, p + delta + 1 - len(seq)) * 'N' #add something and assign the new value to it.
-            #this equals to win = win + max(0, p + delta + 1 - len(seq)) * 'N'
-            assert len(win) == wlen #assert: used to catch bugs
-        seq_wins[i] = dna.char_to_int(win) #Translate chars of single sequence `seq` to ints
-                                           #ATGCN were transferred to 0-4
-    # Randomly choose missing nucleotides
-    idx = seq_wins == dna.CHAR_TO_INT['N'] #idx is numpy array with both True/False value
-    seq_wins[idx] = np.random.randint(0, 4, idx.sum())
-    #np.random.randint(0, 4, idx.sum()).shape = (992,) which is the same shape as idx
-    assert seq_wins.max() < 4 #make sure this is true, or it will stop and report error
+    if not isinstance(seq, np.ndarray):
+        seq = dna.seq_to_int(seq)
+    seq_wins = dna.extract_windows(seq, pos, wlen, seq_index=seq_index)
+    idx = np.asarray(pos) - seq_index
+    is_cpg = (seq[idx] == dna.CHAR_TO_INT['C']) & \
+        (seq[np.minimum(idx + 1, len(seq) - 1)] == dna.CHAR_TO_INT['G']) & \
+        (idx + 1 < len(seq))
+    nb_no_cpg = np.sum(~is_cpg)
+    if nb_no_cpg:
+        warnings.warn('No CpG site at %d positions!' % nb_no_cpg)
+    assert seq_wins.max() < 4
     if assert_cpg:
-        assert np.all(seq_wins[:, delta] == 3) #Test whether all array elements along a given axis evaluate to True.
+        assert np.all(seq_wins[:, delta] == 3)
         assert np.all(seq_wins[:, delta + 1] == 2)
     return seq_wins
 
 
-def map_values(values, pos, target_pos, dtype=None, nan=dat.CPG_NAN):
-    """Maps `values` array at positions `pos` to `target_pos`.
-
-    Inserts `nan` for uncovered positions. 
-    """
-    assert len(values) == len(pos) #judge T/F, T: keep running; F: stop the program
-    assert np.all(pos == np.sort(pos)) #check if pos has been sorted
-    assert np.all(target_pos == np.sort(target_pos)) #check if target_pos has been sorted
-
-    values = values.ravel() #returns contiguous flattened array(1D array with all the input-array 
-                            #elements and with the same type as it).
-        #however, values = cpg_table.value.values, it is already a 1D array
-    pos = pos.ravel()
-    target_pos = target_pos.ravel() #maybe just double verify??
-    idx = np.in1d(pos, target_pos) #Test whether each element of a 1-D array is also present in a second array. 
-    #pos is much shorter than the target_pos, but make sure the first is fully covered by the second.
-    pos = pos[idx] #idx is all TRUE.
-    values = values[idx]
-    if not dtype:
-        dtype = values.dtype #dtype set as int8
-    target_values = np.empty(len(target_pos), dtype=dtype) #create empty array with specified shape and type
-    target_values.fill(nan) #fill it with missing, default is -1
-    idx = np.in1d(target_pos, pos).nonzero()[0] #Return the indices of the elements that are non-zero.
-    assert len(idx) == len(values)
-    assert np.all(target_pos[idx] == pos)
-    target_values[idx] = values
-    return target_values
-
-
-def map_cpg_tables(cpg_tables, chromo, chromo_pos):
-    """Maps values from cpg_tables to `chromo_pos`.
-
-    Positions in `cpg_tables` for `chromo`  must be a subset of `chromo_pos`.
-    Inserts `dat.CPG_NAN` for uncovered positions.
-    """
-    chromo_pos.sort() #sorts the elements of a given list in a specific order, numpy array with 1D 
-    mapped_tables = OrderedDict() #create dictionary
-    for name, cpg_table in six.iteritems(cpg_tables): #cpg_tables, OrderedDict, 
-        ##cpg_tables: sample items, each item stored each sample's chro pos, and value
-        cpg_table = cpg_table.loc[cpg_table.chromo == chromo] #selected cpg_table, #samples rows * 3 column
-        cpg_table = cpg_table.sort_values('pos') #sort by position column
-        mapped_table = map_values(cpg_table.value.values, #1D numpy array, (266747,)
-                                  cpg_table.pos.values, #1D numpy array, (266747,)
-                                  chromo_pos) #1D numpy array, (402166,)
-        #return numpy 1D array. (402166,), exit 1, 0, -1 (nan default value)
-        assert len(mapped_table) == len(chromo_pos)
-        mapped_tables[name] = mapped_table
-    return mapped_tables
+def get_chromo_profile(cpg_profile, chromo):
+    """Return positions and values of `chromo` in `cpg_profile`."""
+    if chromo in cpg_profile:
+        return cpg_profile[chromo]
+    return (np.array([], dtype=np.int32), np.array([], dtype=np.int8))
 
 
 def format_out_of(out, of):
     return '%d / %d (%.1f%%)' % (out, of, out / of * 100)
 
 
-def get_stats_meta(names):
-    funs = OrderedDict()
-    for name in names:
-        fun = stats.get(name) #Return object from module by its name
-        if name in ['mode', 'cat_var', 'cat2_var', 'diff']:
-            dtype = np.int8
-        else:
-            dtype = np.float32
-        funs[name] = (fun, dtype)
-    return funs
-
-
 def select_dict(data, idx):
     data = data.copy()
     for key, value in six.iteritems(data):
@@ -261,20 +254,19 @@ def select_dict(data, idx):
     return data
 
 
-def annotate(anno_file, chromo, pos):
-    anno_file = dat.GzipFile(anno_file, 'r')
-    anno = pd.read_table(anno_file, header=None, usecols=[0, 1, 2],
-                         dtype={0: 'str', 1: 'int32', 2: 'int32'})
-    anno_file.close()
-    anno.columns = ['chromo', 'start', 'end']
-    anno.chromo = anno.chromo.str.upper().str.replace('CHR', '')
-    anno = anno.loc[anno.chromo == chromo]
-    anno.sort_values('start', inplace=True)
-    start, end = an.join_overlapping(anno.start.values, anno.end.values)
+def annotate(anno_index, chromo, pos):
+    """Test if `pos` on `chromo` are covered by intervals in `anno_index`."""
+    start, end = an.get_chromo_intervals(anno_index, chromo)
     anno = np.array(an.is_in(pos, start, end), dtype='int8')
     return anno
 
 
+def anno_distance(anno_index, chromo, pos):
+    """Compute distance of `pos` on `chromo` to intervals in `anno_index`."""
+    start, end = an.get_chromo_intervals(anno_index, chromo)
+    return an.distance(pos, start, end).astype(np.int32)
+
+
 class App(object):
 
     def run(self, args):
@@ -304,6 +296,11 @@ class App(object):
             '--cpg_wlen',
             help='If provided, extract `cpg_wlen`//2 neighboring CpG sites',
             type=int)
+        p.add_argument(
+            '--cpg_out_mat',
+            help='Store CpG profiles as single sites x cells matrix instead of'
+            ' one dataset per cell, which is faster to read for many cells',
+            action='store_true')
         p.add_argument(
             '--cpg_cov',
             help='Minimum CpG coverage. Only use CpG sites for which the true'
@@ -325,6 +322,16 @@ class App(object):
             help='Files with genomic annotations that are used as input'
             ' features. Currently ignored by `dcpg_train.py`.',
             nargs='+')
+        p.add_argument(
+            '--anno_cache',
+            help='Cache the index of annotation files next to BED files to'
+            ' speed up subsequent runs',
+            action='store_true')
+        p.add_argument(
+            '--anno_dist',
+            help='Also store the distance of CpG sites to the nearest interval'
+            ' of each annotation file',
+            action='store_true')
         p.add_argument(
             '-o', '--out_dir',
             help='Output directory',
@@ -337,8 +344,7 @@ class App(object):
             ' Required, e.g., for predicting mean methylation levels or'
             ' cell-to-cell variance.',
             nargs='+',
-            choices=['mean', 'mode', 'var', 'cat_var', 'cat2_var', 'entropy',
-                     'diff', 'cov'])
+            choices=stats.STATS)
         g.add_argument(
             '--cpg_stats_cov',
             help='Minimum coverage for computing per CpG statistics',
@@ -350,8 +356,7 @@ class App(object):
             ' profiles. Required, e.g., for predicting mean methylation levels'
             ' or cell-to-cell variance.',
             nargs='+',
-            choices=['mean', 'mode', 'var', 'cat_var', 'cat2_var', 'entropy',
-                     'diff', 'cov'])
+            choices=stats.STATS)
         g.add_argument(
             '--win_stats_wlen',
             help='Window lengths for computing statistics',
@@ -378,6 +383,21 @@ class App(object):
             default=32768,
             help='Maximum number of samples per output file. Should be'
             ' divisible by batch size.')
+        g.add_argument(
+            '--cpg_cache',
+            help='Directory for caching parsed CpG profiles to speed up'
+            ' subsequent runs')
+        g.add_argument(
+            '--nb_worker',
+            help='Number of processes for reading CpG profiles in parallel',
+            type=int,
+            default=1)
+        g.add_argument(
+            '--nb_thread',
+            help='Number of threads for decompressing gzip-compressed CpG'
+            ' profiles with pigz if installed',
+            type=int,
+            default=1)
         g.add_argument(
             '--seed',
             help='Seed of random number generator',
@@ -415,15 +435,9 @@ class App(object):
         if opts.cpg_wlen and opts.cpg_wlen % 2 != 0:
             raise '--cpg_wlen must be even!'
 
-        # Parse functions for computing output statistics
-        cpg_stats_meta = None
-        win_stats_meta = None
-        if opts.cpg_stats:
-            cpg_stats_meta = get_stats_meta(opts.cpg_stats)
-        if opts.win_stats:
-            win_stats_meta = get_stats_meta(opts.win_stats)
-
         make_dir(opts.out_dir)
+        if opts.cpg_cache:
+            make_dir(opts.cpg_cache)
         outputs = OrderedDict()
 
         # Read single-cell profiles if provided
@@ -434,6 +448,9 @@ class App(object):
                 chromos=opts.chromos,
                 nb_sample=opts.nb_sample,
                 nb_sample_chromo=opts.nb_sample_chromo,
+                nb_thread=opts.nb_thread,
+                nb_worker=opts.nb_worker,
+                cache_dir=opts.cpg_cache,
                 log=log.info)
 
         # Create table with unique positions
@@ -448,10 +465,7 @@ class App(object):
             pos_table = prepro_pos_table(pos_table)
         else:
             # Extract positions from profiles, if not provided. Predict position which available in at least one cells.
-            pos_tables = []
-            for cpg_table in list(outputs['cpg'].values()):
-                pos_tables.append(cpg_table[['chromo', 'pos']])
-            pos_table = prepro_pos_table(pos_tables)
+            pos_table = profiles_pos_table(outputs['cpg'])
 
         if opts.chromos:
             pos_table = pos_table.loc[pos_table.chromo.isin(opts.chromos)]
@@ -462,6 +476,15 @@ class App(object):
 
         log.info('%d samples' % len(pos_table))
 
+        # Index annotation files once for all chromosomes
+        anno_indexes = None
+        if opts.anno_files:
+            log.info('Indexing annotation files ...')
+            anno_indexes = OrderedDict()
+            for anno_file in opts.anno_files:
+                anno_indexes[split_ext(anno_file)] = an.read_anno_index(
+                    anno_file, cache=opts.anno_cache)
+
         make_dir(opts.out_dir)
 
         # Iterate over chromosomes
@@ -474,22 +497,16 @@ class App(object):
             chromo_outputs = OrderedDict()
 
             if 'cpg' in outputs:
-                # Concatenate CpG tables into single nb_site x nb_output matrix
-                chromo_outputs['cpg'] = map_cpg_tables(outputs['cpg'],
-                                                       chromo, chromo_pos) 
-                #chromo_outputs, one array called 'cpg', 'cpg' has #sample array, 
-                #each item is mapped table of target_pos with value filled
-                #OrderedDict([('BS27_1_SER', array([1, 1, 1, ..., 1, 1, 0], dtype=int8)), 
-                #('BS27_3_SER', array([-1,  1,  1, ...,  1, -1, -1], dtype=int8))])
-                chromo_outputs['cpg_mat'] = np.vstack(
-                    list(chromo_outputs['cpg'].values())).T
-                #add one more array to it. np.vstack, stack array sequence vertically
+                # Map CpG profiles to sparse nb_site x nb_output matrix, which
+                # is only densified chunk-wise
+                chromo_outputs['cpg_mat'] = cpg_matrix.from_profiles(
+                    outputs['cpg'], chromo, chromo_pos)
                 #chromo_outputs['cpg_mat'].shape=(402166, 2)
                 #402166 is the CHR1 target pos number, 2 is the input two samples, BS27_1_SER, BS27_3_SER
                 assert len(chromo_outputs['cpg_mat']) == len(chromo_pos)
 
             if 'cpg_mat' in chromo_outputs and opts.cpg_cov:
-                cov = np.sum(chromo_outputs['cpg_mat'] != dat.CPG_NAN, axis=1)
+                cov = chromo_outputs['cpg_mat'].coverage()
                 assert np.all(cov >= 1)
                 idx = cov >= opts.cpg_cov
                 tmp = '%s sites matched minimum coverage filter'
@@ -504,15 +521,31 @@ class App(object):
             # Read DNA of chromosome
             chromo_dna = None
             if opts.dna_files: #this will only read the corresponding chromosome sequence
-                chromo_dna = fasta.read_chromo(opts.dna_files, chromo) #chromo_dna is string, len=195471971 for chr1
+                chromo_dna = dna.seq_to_int(
+                    fasta.read_chromo(opts.dna_files, chromo)) #chromo_dna is int8 array, len=195471971 for chr1
  
             annos = None
-            if opts.anno_files:
+            if anno_indexes:
                 log.info('Annotating CpG sites ...')
                 annos = dict()
-                for anno_file in opts.anno_files:
-                    name = split_ext(anno_file)
-                    annos[name] = annotate(anno_file, chromo, chromo_pos)
+                for name, anno_index in six.iteritems(anno_indexes):
+                    annos[name] = annotate(anno_index, chromo, chromo_pos)
+
+            anno_dists = None
+            if anno_indexes and opts.anno_dist:
+                log.info('Computing distances to annotations ...')
+                anno_dists = dict()
+                for name, anno_index in six.iteritems(anno_indexes):
+                    anno_dists[name] = anno_distance(anno_index, chromo,
+                                                     chromo_pos)
+
+            # Select CpG neighbors of chromosome once for all chunks
+            chromo_cpg_tables = None
+            if 'cpg' in outputs and opts.cpg_wlen:
+                chromo_cpg_tables = OrderedDict()
+                for name, cpg_table in six.iteritems(outputs['cpg']):
+                    chromo_cpg_tables[name] = get_chromo_profile(cpg_table,
+                                                                 chromo)
 
             # Iterate over chunks
             # -------------------
@@ -545,35 +578,44 @@ class App(object):
                     #list(out_group) = []
                     
                 # Write cpg profiles
-                if 'cpg' in chunk_outputs:
-                    for name, value in six.iteritems(chunk_outputs['cpg']):
-                        #name = ["BS27_1_SER", 'BS27_3_SER'] # the sample name
-                        #value= 2 numpy array, both with shape=(32768,)
-                        assert len(value) == len(chunk_pos)
-                        # Round continuous values
-                        out_group.create_dataset('cpg/%s' % name,
-                                                 data=value.round(),
-                                                 dtype=np.int8,
-                                                 compression='gzip')
-                        #type(out_group)= <class 'h5py._hl.group.Group'>
-                        #list(out_group) = ['cpg']
-                        #list(out_group['cpg']) = ['BS27_1_SER', 'BS27_3_SER']
-                        
+                if 'cpg_mat' in chunk_outputs:
+                    chunk_cpg_mat = chunk_outputs['cpg_mat'].todense()
+                    if opts.cpg_out_mat:
+                        # Single matrix with cell names as virtual columns,
+                        # which is read by one I/O operation per batch
+                        dataset = out_group.create_dataset(
+                            'cpg', data=chunk_cpg_mat.round(), dtype=np.int8,
+                            compression='gzip')
+                        dataset.attrs[hdf.COLUMNS_ATTR] = [
+                            name.encode() for name in outputs['cpg'].keys()]
+                    else:
+                        for i, name in enumerate(outputs['cpg'].keys()):
+                            #name = ["BS27_1_SER", 'BS27_3_SER'] # the sample name
+                            #value= 2 numpy array, both with shape=(32768,)
+                            value = chunk_cpg_mat[:, i]
+                            assert len(value) == len(chunk_pos)
+                            # Round continuous values
+                            out_group.create_dataset('cpg/%s' % name,
+                                                     data=value.round(),
+                                                     dtype=np.int8,
+                                                     compression='gzip')
+                            #type(out_group)= <class 'h5py._hl.group.Group'>
+                            #list(out_group) = ['cpg']
+                            #list(out_group['cpg']) = ['BS27_1_SER', 'BS27_3_SER']
+
                     # Compute and write statistics
-                    if cpg_stats_meta is not None:
+                    if opts.cpg_stats:
                         log.info('Computing per CpG statistics ...')
-                        cpg_mat = np.ma.masked_values(chunk_outputs['cpg_mat'],
-                                                      dat.CPG_NAN)
                         #cpg_mat.shape=(32768, 2)
-                        mask = np.sum(~cpg_mat.mask, axis=1)
-                        mask = mask < opts.cpg_stats_cov
-                        for name, fun in six.iteritems(cpg_stats_meta):
-                            stat = fun[0](cpg_mat).data.astype(fun[1])
-                            stat[mask] = dat.CPG_NAN
+                        cpg_stats = stats.summarize(
+                            opts.cpg_stats,
+                            *chunk_outputs['cpg_mat'].moments(
+                                minmax='diff' in opts.cpg_stats),
+                            min_cov=opts.cpg_stats_cov)
+                        for name, stat in six.iteritems(cpg_stats):
                             assert len(stat) == len(chunk_pos)
                             out_group.create_dataset('cpg_stats/%s' % name,
                                                      data=stat,
-                                                     dtype=fun[1],
                                                      compression='gzip')
 
  #until here: 
@@ -589,7 +631,7 @@ class App(object):
                 in_group = chunk_file.create_group('inputs')
 
                 # DNA windows
-                if chromo_dna:
+                if chromo_dna is not None:
                     log.info('Extracting DNA sequence windows ...')
                     dna_wins = extract_seq_windows(chromo_dna, pos=chunk_pos,
                                                    wlen=opts.dna_wlen)
@@ -602,25 +644,28 @@ class App(object):
                     #>>> in_group.visit(printname) = dna
 
                 # CpG neighbors
+                # Neighbors are kept in memory for computing window-based
+                # statistics instead of reading them back from `chunk_file`.
+                cpg_states = []
+                cpg_dists = []
                 if opts.cpg_wlen:
                     log.info('Extracting CpG neighbors ...')
                     cpg_ext = fext.KnnCpgFeatureExtractor(opts.cpg_wlen // 2)
                     context_group = in_group.create_group('cpg')
                     # outputs['cpg'], since neighboring CpG sites might lie
                     # outside chunk borders and un-mapped values are needed
-                    for name, cpg_table in six.iteritems(outputs['cpg']):
+                    for name, cpg_table in six.iteritems(chromo_cpg_tables):
                         #name="BS27_1_SER" and "BS27_3_SER"
-                        #cpg_table = numpy array, with three columns information for each input sample.
-                        cpg_table = cpg_table.loc[cpg_table.chromo == chromo]
-                        state, dist = cpg_ext.extract(chunk_pos,
-                                                      cpg_table.pos.values,
-                                                      cpg_table.value.values) #extract the cpg distance and state with wlen
+                        #cpg_table = tuple with positions and values of chromosome
+                        table_pos, table_value = cpg_table
+                        state, dist = cpg_ext.extract(chunk_pos, table_pos,
+                                                      table_value) #extract the cpg distance and state with wlen
                         nan = np.isnan(state)
                         state[nan] = dat.CPG_NAN #set nan value as -1, which means unknown
                         dist[nan] = dat.CPG_NAN
                         # States can be binary (np.int8) or continuous
                         # (np.float32).
-                        state = state.astype(cpg_table.value.dtype, copy=False) #set data type
+                        state = state.astype(table_value.dtype, copy=False) #set data type
                         dist = dist.astype(np.float32, copy=False)
 
                         assert len(state) == len(chunk_pos)
@@ -633,40 +678,29 @@ class App(object):
                         group.create_dataset('dist', data=dist,
                                              compression='gzip')
                         #list(group) = ['state','dist']
+                        cpg_states.append(state)
+                        cpg_dists.append(dist)
 
-                if win_stats_meta is not None and opts.cpg_wlen:
+                if opts.win_stats and opts.cpg_wlen:
                     log.info('Computing window-based statistics ...')
-                    states = []
-                    dists = []
-                    cpg_states = []
-                    cpg_group = out_group['cpg']
-                    context_group = in_group['cpg']
-                    for output_name in six.iterkeys(cpg_group):
-                        state = context_group[output_name]['state'].value
-                        states.append(np.expand_dims(state, 2))
-                        dist = context_group[output_name]['dist'].value
-                        dists.append(np.expand_dims(dist, 2))
-                        cpg_states.append(cpg_group[output_name].value)
                     # samples x outputs x cpg_wlen
-                    states = np.swapaxes(np.concatenate(states, axis=2), 1, 2)
-                    dists = np.swapaxes(np.concatenate(dists, axis=2), 1, 2)
-                    cpg_states = np.expand_dims(np.vstack(cpg_states).T, 2)
-                    cpg_dists = np.zeros_like(cpg_states)
+                    states = np.stack(cpg_states, axis=1)
+                    dists = np.stack(cpg_dists, axis=1)
+                    # Add rounded states of center CpG sites as written to
+                    # `outputs/cpg`
+                    cpg_states = np.expand_dims(chunk_cpg_mat.round(), 2)
+                    cpg_states = cpg_states.astype(states.dtype)
+                    cpg_dists = np.zeros_like(cpg_states, dtype=dists.dtype)
                     states = np.concatenate([states, cpg_states], axis=2)
                     dists = np.concatenate([dists, cpg_dists], axis=2)
 
-                    for wlen in opts.win_stats_wlen:
-                        idx = (states == dat.CPG_NAN) | (dists > wlen // 2)
-                        states_wlen = np.ma.masked_array(states, idx)
+                    win_stats = stats.window_stats(states, dists,
+                                                   opts.win_stats_wlen,
+                                                   opts.win_stats)
+                    for wlen, wlen_stats in six.iteritems(win_stats):
                         group = out_group.create_group('win_stats/%d' % wlen)
-                        for name, fun in six.iteritems(win_stats_meta):
-                            stat = fun[0](states_wlen)
-                            if hasattr(stat, 'mask'):
-                                idx = stat.mask
-                                stat = stat.data
-                                if np.sum(idx):
-                                    stat[idx] = dat.CPG_NAN
-                            group.create_dataset(name, data=stat, dtype=fun[1],
+                        for name, stat in six.iteritems(wlen_stats):
+                            group.create_dataset(name, data=stat,
                                                  compression='gzip')
 
                 if annos:
@@ -677,6 +711,13 @@ class App(object):
                                              dtype='int8',
                                              compression='gzip')
 
+                if anno_dists:
+                    group = in_group.create_group('anno_dist')
+                    for name, anno_dist in six.iteritems(anno_dists):
+                        group.create_dataset(name, data=anno_dist[chunk_idx],
+                                             dtype=np.int32,
+                                             compression='gzip')
+
                 chunk_file.close()
 
         log.info('Done!')
@@ -167,7 +167,7 @@ class App(object):
                     output_names = hdf.ls(filename, 'outputs', recursive=True)
                 outputs = []
                 for output_name in output_names:
-                    output = pd.Series(group[output_name].value,
+                    output = pd.Series(hdf.read_item(group, output_name),
                                        name=output_name)
                     outputs.append(output)
                 outputs = pd.concat(outputs, axis=1)
@@ -31,6 +31,7 @@ from __future__ import division
 import os
 import random
 import sys
+import time
 
 import argparse
 import h5py as h5
@@ -42,8 +43,7 @@ import six
 from deepcpg import data as dat
 from deepcpg import evaluation as ev
 from deepcpg import models as mod
-from deepcpg.data import hdf
-from deepcpg.utils import ProgressBar, to_list
+from deepcpg.utils import AsyncWriter, ProgressBar, prefetch, to_list
 
 
 class H5Writer(object):
@@ -128,11 +128,46 @@ class App(object):
             ' batch-wise evaluation. If zero, evaluate on entire data set.',
             type=int,
             default=100000)
+        p.add_argument(
+            '--stream_eval',
+            help='Evaluate on entire data set batch-wise with constant memory'
+            ' instead of averaging metrics over blocks of --eval_size'
+            ' samples. AUC is computed from histograms of predictions.',
+            action='store_true')
+        p.add_argument(
+            '--nb_bin',
+            help='Number of histogram bins for computing AUC with'
+            ' --stream_eval',
+            type=int,
+            default=1000)
         p.add_argument(
             '--batch_size',
             help='Batch size',
             type=int,
             default=128)
+        p.add_argument(
+            '--tune_batch_sizes',
+            help='Benchmark inference with these batch sizes on startup and'
+            ' use the fastest instead of --batch_size',
+            type=int,
+            nargs='+')
+        p.add_argument(
+            '--tune_threads',
+            help='Thread settings "intra_op,inter_op" of TensorFlow that are'
+            ' benchmarked with --tune_batch_sizes, e.g. "4,1 8,2"',
+            nargs='+')
+        p.add_argument(
+            '--data_q_size',
+            help='Size of queues of batches that are read and written in'
+            ' background threads',
+            type=int,
+            default=10)
+        p.add_argument(
+            '--dna_cache',
+            help='Directory for caching DNA embeddings of CpG sites. The DNA'
+            ' module is evaluated only for sites that are not cached yet for'
+            ' the same DNA module, e.g. when evaluating different CpG modules'
+            ' or data sets with overlapping sites.')
         p.add_argument(
             '--seed',
             help='Seed of random number generator',
@@ -174,51 +209,103 @@ class App(object):
             nb_key=opts.nb_replicate)
         data_reader = mod.data_reader_from_model(
             model, replicate_names, replicate_names=replicate_names)
+        stacked_outputs = mod.get_stacked_outputs(model)
+
+        if opts.tune_batch_sizes:
+            log.info('Tuning inference ...')
+            tune_size = min(nb_sample, max(opts.tune_batch_sizes) * 2)
+            inputs = next(data_reader(opts.data_files, nb_sample=tune_size,
+                                      batch_size=tune_size,
+                                      loop=False, shuffle=False))[0]
+            opts.batch_size = mod.tune_inference(
+                model, lambda x: model.predict(x, batch_size=tune_size),
+                inputs, opts.tune_batch_sizes,
+                nb_threads=mod.parse_nb_threads(opts.tune_threads),
+                log=log.info)[0]
+
+        dna_cache = None
+        if opts.dna_cache:
+            emb_layer = mod.get_dna_embedding_layer(model)
+            if emb_layer is None:
+                raise ValueError('Model has no DNA module!')
+            dna_cache = mod.DnaEmbeddingCache(
+                opts.dna_cache, mod.get_dna_model_hash(model, emb_layer))
+            log.info('Caching DNA embeddings in %s ...' % dna_cache.dirname)
+            nb_new = mod.fill_dna_cache(
+                dna_cache, mod.get_dna_model(model, emb_layer),
+                opts.data_files, nb_sample=nb_sample,
+                batch_size=opts.batch_size, log=log.info)
+            log.info('%d sites added to cache' % nb_new)
+            # Predict from cached embeddings instead of DNA sequences
+            model = mod.build_head_model(model, emb_layer)
+            data_reader.use_dna = False
 
         # Seed used since unobserved input CpG states are randomly sampled
         if opts.seed is not None:
             np.random.seed(opts.seed)
             random.seed(opts.seed)
 
+        # Read data in background thread while predicting
         data_reader = data_reader(opts.data_files,
+                                  meta_names=['chromo', 'pos'],
                                   nb_sample=nb_sample,
                                   batch_size=opts.batch_size,
                                   loop=False, shuffle=False)
-
-        meta_reader = hdf.reader(opts.data_files, ['chromo', 'pos'],
-                                 nb_sample=nb_sample,
-                                 batch_size=opts.batch_size,
-                                 loop=False, shuffle=False)
+        data_reader = prefetch(data_reader, max_size=opts.data_q_size)
 
         writer = None
+        write_data = None
         if opts.out_data:
+            # Write data in background thread
             writer = H5Writer(opts.out_data, nb_sample)
+            write_data = AsyncWriter(writer.write_dict,
+                                     max_size=opts.data_q_size)
 
         log.info('Predicting ...')
+        start = time.time()
         nb_tot = 0
         nb_eval = 0
         data_eval = dict()
         perf_eval = []
+        evaluator = None
+        if opts.stream_eval:
+            evaluator = ev.StreamingEvaluator(nb_bin=opts.nb_bin)
         progbar = ProgressBar(nb_sample, log.info)
-        for inputs, outputs, weights in data_reader:
+        for inputs, outputs, weights, meta in data_reader:
             batch_size = len(list(inputs.values())[0])
             nb_tot += batch_size
             progbar.update(batch_size)
 
-            preds = to_list(model.predict(inputs))
+            if dna_cache:
+                # First input of head model is DNA embedding
+                inputs[model.input_names[0]] = dna_cache.get(meta['chromo'],
+                                                             meta['pos'])
+            preds = to_list(model.predict(inputs,
+                                          batch_size=opts.batch_size))
 
             data_batch = dict()
             data_batch['preds'] = dict()
             data_batch['outputs'] = dict()
             for i, name in enumerate(model.output_names):
+                if name in stacked_outputs:
+                    # Evaluate and store individual outputs of stacked outputs
+                    for j, output_name in enumerate(stacked_outputs[name]):
+                        data_batch['preds'][output_name] = preds[i][:, j]
+                        data_batch['outputs'][output_name] = \
+                            outputs[name][:, j]
+                    continue
                 data_batch['preds'][name] = preds[i].squeeze()
                 data_batch['outputs'][name] = outputs[name].squeeze()
 
-            for name, value in six.iteritems(next(meta_reader)):
+            for name, value in six.iteritems(meta):
                 data_batch[name] = value
 
-            if writer:
-                writer.write_dict(data_batch)
+            if write_data:
+                write_data(data_batch)
+
+            if evaluator:
+                evaluator.update(data_batch['outputs'], data_batch['preds'])
+                continue
 
             nb_eval += batch_size
             dat.add_to_dict(data_batch, data_eval)
@@ -233,9 +320,14 @@ class App(object):
 
         progbar.close()
         if writer:
+            write_data.close()
             writer.close()
+        log.info('%.1f samples/s' % (nb_tot / (time.time() - start)))
 
-        report = pd.concat(perf_eval)
+        if evaluator:
+            report = evaluator.report()
+        else:
+            report = pd.concat(perf_eval)
         report = report.groupby(['metric', 'output']).mean().reset_index()
 
         if opts.out_report:
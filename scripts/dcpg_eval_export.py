@@ -33,37 +33,139 @@ Export the profile of cell Ca01 for chromosomes 4 and 5 to a bedGraph file:
 from __future__ import print_function
 from __future__ import division
 
+from collections import OrderedDict
 import os
 import sys
 
 import argparse
 import h5py as h5
 import logging
+from multiprocessing import Pool
+
 import numpy as np
-import pandas as pd
 import six
 
 from deepcpg import data as dat
+from deepcpg.data import hdf
 from deepcpg.utils import make_dir
 
 
-def write_to_bedGraph(data, filename, compression=None):
-    data = pd.DataFrame({'chromo': data['chromo'],
-                         'start': data['pos'],
-                         'end': data['pos'] + 1,
-                         'value': data['value']},
-                        columns=['chromo', 'start', 'end', 'value'])
-    data['chromo'] = 'chr' + data['chromo'].str.decode('utf')
-    data.to_csv(filename, sep='\t', index=False, header=None,
-                float_format='%.5f',
-                compression=compression)
-
-
-def write_to_hdf(data, filename):
-    out_file = h5.File(filename, 'w')
-    for name in ['chromo', 'pos', 'value']:
-        out_file.create_dataset(name, data=data[name], compression='gzip')
-    out_file.close()
+class BedGraphWriter(object):
+    """Write values chunk-wise to BGZF-compressed bedGraph file."""
+
+    def __init__(self, filename, nb_thread=1):
+        self.out_file = dat.BgzfWriter(filename, nb_thread=nb_thread)
+
+    def __call__(self, chromo, pos, value):
+        chromo = np.char.add(b'chr', np.asarray(chromo, dtype=bytes))
+        self.out_file.write(dat.format_bedgraph(chromo, pos, value))
+
+    def close(self):
+        self.out_file.close()
+
+
+class HdfWriter(hdf.ChunkWriter):
+    """Write values chunk-wise to resizable datasets of HDF5 file."""
+
+    def __call__(self, chromo, pos, value):
+        self.write_dict(OrderedDict([('chromo', chromo), ('pos', pos),
+                                     ('value', value)]))
+
+
+def get_chromo_index(data_file, chromos=None, nb_sample=None,
+                     chunk_size=1000000):
+    """Return index ranges of sites on chromosomes.
+
+    Reads `chromo` dataset chunk-wise and merges consecutive sites on the same
+    chromosome into ranges.
+
+    Parameters
+    ----------
+    data_file: :class:`h5py.File`
+        Data file from `dcpg_eval.py`.
+    chromos: list
+        List of chromosomes to be selected. Selects all chromosomes if `None`.
+    nb_sample: int
+        Maximum number of samples.
+    chunk_size: int
+        Number of samples that are read at once.
+
+    Returns
+    -------
+    list
+        List of tuples (`start`, `end`) of index ranges.
+    """
+    if chromos is not None:
+        chromos = [chromo.encode() for chromo in chromos]
+    if nb_sample is None:
+        nb_sample = len(data_file['chromo'])
+    ranges = []
+    for start in range(0, nb_sample, chunk_size):
+        end = min(start + chunk_size, nb_sample)
+        chromo = data_file['chromo'][start:end]
+        # Index of first site of each run of the same chromosome
+        run_starts = np.concatenate(
+            [[0], np.flatnonzero(chromo[1:] != chromo[:-1]) + 1])
+        run_ends = np.concatenate([run_starts[1:], [len(chromo)]])
+        for run_start, run_end in zip(run_starts, run_ends):
+            if chromos is not None and chromo[run_start] not in chromos:
+                continue
+            run_start += start
+            run_end += start
+            if ranges and ranges[-1][1] == run_start:
+                ranges[-1] = (ranges[-1][0], run_end)
+            else:
+                ranges.append((run_start, run_end))
+    return ranges
+
+
+def export_output(args):
+    """Export imputed profile of single output chunk-wise.
+
+    Defined at module level for being called by worker processes.
+
+    Parameters
+    ----------
+    args: tuple
+        Tuple (`data_file`, `output_name`, `ranges`, `out_file`,
+        `out_format`, `chunk_size`, `nb_thread`) with index `ranges` from
+        :func:`get_chromo_index` and the number of compression threads
+        `nb_thread`.
+
+    Returns
+    -------
+    int
+        Number of exported sites.
+    """
+    data_file, output_name, ranges, out_file, out_format, chunk_size, \
+        nb_thread = args
+    if out_format == 'bedGraph':
+        writer = BedGraphWriter(out_file + '.bedGraph.gz',
+                                nb_thread=nb_thread)
+    elif out_format == 'hdf':
+        writer = HdfWriter(out_file + '.h5')
+    else:
+        raise ValueError('Invalid output format "%s"!' % out_format)
+
+    nb_site = 0
+    data_file = h5.File(data_file, 'r')
+    try:
+        for range_start, range_end in ranges:
+            for start in range(range_start, range_end, chunk_size):
+                end = min(start + chunk_size, range_end)
+                output = data_file['outputs'][output_name][start:end]
+                # Use `output` label if known, otherwise prediction
+                value = data_file['preds'][output_name][start:end]
+                tmp = output != dat.CPG_NAN
+                value[tmp] = output[tmp]
+                writer(data_file['chromo'][start:end],
+                       data_file['pos'][start:end],
+                       value)
+                nb_site += len(value)
+    finally:
+        data_file.close()
+        writer.close()
+    return nb_site
 
 
 class App(object):
@@ -103,6 +205,22 @@ class App(object):
             '--nb_sample',
             help='Number of samples',
             type=int)
+        p.add_argument(
+            '--chunk_size',
+            help='Number of sites that are read and written at once',
+            type=int,
+            default=1000000)
+        p.add_argument(
+            '--nb_worker',
+            help='Number of processes for exporting outputs in parallel',
+            type=int,
+            default=1)
+        p.add_argument(
+            '--nb_thread',
+            help='Number of threads for compressing bedGraph files of each'
+            ' output',
+            type=int,
+            default=1)
         p.add_argument(
             '--verbose',
             help='More detailed log messages',
@@ -122,55 +240,46 @@ class App(object):
             log.setLevel(logging.INFO)
 
         data_file = h5.File(opts.data_file, 'r')
-
         nb_sample = len(data_file['pos'])
         if opts.nb_sample:
             nb_sample = min(nb_sample, opts.nb_sample)
-
-        data = dict()
-        for name in ['chromo', 'pos']:
-            data[name] = data_file[name][:nb_sample]
-
-        idx = None
-        if opts.chromos:
-            idx = np.in1d(data['chromo'],
-                          [chromo.encode() for chromo in opts.chromos])
-            for key, value in six.iteritems(data):
-                data[key] = value[idx]
+        ranges = get_chromo_index(data_file, chromos=opts.chromos,
+                                  nb_sample=nb_sample,
+                                  chunk_size=opts.chunk_size)
+        data_file.close()
 
         output_names = dat.get_output_names(opts.data_file,
                                             regex=opts.output_names)
+        if not output_names:
+            log.warning('No outputs found!')
+            return 0
 
         make_dir(opts.out_dir)
 
+        args = []
         for output_name in output_names:
-            log.info(output_name)
-            data['output'] = data_file['outputs'][output_name][:nb_sample]
-            data['pred'] = data_file['preds'][output_name][:nb_sample]
-            if idx is not None:
-                for name in ['output', 'pred']:
-                    data[name] = data[name][idx]
-
-            # Use `output` label if known, otherwise prediction
-            data['value'] = data['pred']
-            tmp = data['output'] != dat.CPG_NAN
-            data['value'][tmp] = data['output'][tmp]
-
             name = output_name.split(dat.OUTPUT_SEP)
             if name[0] == 'cpg':
                 name = name[-1]
             else:
                 name = '_'.join(name)
             out_file = os.path.join(opts.out_dir, name)
+            args.append((opts.data_file, output_name, ranges, out_file,
+                         opts.out_format, opts.chunk_size, opts.nb_thread))
 
-            if opts.out_format == 'bedGraph':
-                write_to_bedGraph(data, out_file + '.bedGraph.gz',
-                                  compression='gzip')
-            elif opts.out_format == 'hdf':
-                write_to_hdf(data, out_file + '.h5')
-            else:
-                tmp = 'Invalid output format "%s"!' % opts.out_format
-                raise ValueError()
+        pool = None
+        if opts.nb_worker > 1:
+            pool = Pool(min(opts.nb_worker, len(args)))
+            results = pool.imap(export_output, args)
+        else:
+            results = six.moves.map(export_output, args)
+        try:
+            for output_name, nb_site in zip(output_names, results):
+                log.info('%s: %d sites' % (output_name, nb_site))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
         log.info('Done!')
 
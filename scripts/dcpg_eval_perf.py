@@ -19,11 +19,17 @@ individual outputs:
         --annos_files ./bed/CGI.bed ./bed/TSS.bed ./bed/gene_body.bed
 """
 
+from __future__ import print_function
+from __future__ import division
+
 import os
 import sys
 
 import argparse
+from collections import OrderedDict
 import logging
+from multiprocessing import Pool
+
 import numpy as np
 import pandas as pd
 from sklearn import metrics as skm
@@ -31,7 +37,8 @@ from sklearn import metrics as skm
 from deepcpg import data as dat
 from deepcpg import evaluation as ev
 from deepcpg.data import hdf
-from deepcpg.data.annotations import is_in, join_overlapping_frame
+from deepcpg.data.annotations import get_chromo_intervals, is_in, \
+    read_anno_index
 from deepcpg.utils import fold_dict, make_dir, slice_dict, to_list
 
 
@@ -49,9 +56,9 @@ def annotate(chromos, pos, anno):
         :class:`numpy.ndarray` with chromosome of sites.
     pos: :class:`numpy.ndarray`
         :class:`numpy.ndarray` with position on chromosome of sites.
-    anno: :class:`pandas.DataFrame`
-        :class:`pandas.DataFrame` with columns `chromo`, `start`, `end` that
-        specify annotated regions.
+    anno: dict
+        Annotation index from :func:`read_anno_file` with chromosomes as keys
+        and tuples (`start`, `end`) of annotated regions as values.
 
     Returns
     -------
@@ -59,22 +66,19 @@ def annotate(chromos, pos, anno):
         Binary :class:`numpy.ndarray` of same length as `chromos` indicating if
         positions are annotated.
     """
-    idx = []
+    idx = np.zeros(len(pos), dtype=bool)
     for chromo in np.unique(chromos):
-        chromo_pos = pos[chromos == chromo]
-        chromo_anno = anno.loc[anno.chromo == chromo]
-        chromo_idx = is_in(chromo_pos,
-                           chromo_anno['start'].values,
-                           chromo_anno['end'].values)
-        idx.append(chromo_idx)
-    idx = np.hstack(idx)
+        chromo_idx = chromos == chromo
+        start, end = get_chromo_intervals(anno, chromo)
+        idx[chromo_idx] = is_in(pos[chromo_idx], start, end)
     return idx
 
 
-def read_anno_file(anno_file, chromos=None, nb_sample=None):
+def read_anno_file(anno_file, chromos=None, cache=False):
     """Read annotations from BED file.
 
-    Reads annotations from BED file merges overlapping annotations.
+    Reads annotations from BED file and merges overlapping annotations into an
+    annotation index.
 
     Parameters
     ----------
@@ -82,24 +86,18 @@ def read_anno_file(anno_file, chromos=None, nb_sample=None):
         File name.
     chromos: list
         List of chromosomes for filtering annotations.
-    nb_sample: int
-        Maximum number of annotated regions.
+    cache: bool
+        If `True`, cache annotation index next to `anno_file`.
 
     Returns
     -------
-    :class:`pandas.DataFrame`
-        :class:`pandas.DataFrame` with columns `chromo`, `start`, `end`.
+    dict
+        `dict` with chromosomes as keys and tuples (`start`, `end`) of
+        annotated regions as values.
     """
-    anno = pd.read_table(anno_file, header=None, usecols=[0, 1, 2],
-                         dtype={0: 'str', 1: 'int32', 2: 'int32'},
-                         nrows=nb_sample)
-    anno.columns = ['chromo', 'start', 'end']
-    anno.chromo = anno.chromo.str.upper().str.replace('chr', '', case=False)
     if chromos is not None:
         chromos = to_list(chromos)
-        anno = anno.loc[anno.chromo.isin(chromos)]
-    anno = join_overlapping_frame(anno)
-    return anno
+    return read_anno_index(anno_file, chromos=chromos, cache=cache)
 
 
 def get_curve_fun(name):
@@ -112,6 +110,97 @@ def get_curve_fun(name):
         raise ValueError('Invalid performance curve "%s"!' % name)
 
 
+# Data and annotation masks shared with worker processes of `evaluate_units`.
+_DATA = None
+_MASKS = None
+
+
+def _init_worker(data, masks):
+    """Set data shared by :func:`_evaluate_unit`.
+
+    Called once per worker process. Data are inherited without copying if
+    processes are forked.
+    """
+    global _DATA, _MASKS
+    _DATA = data
+    _MASKS = masks
+
+
+def _evaluate_unit(unit):
+    """Evaluate outputs at the sites of a single annotation.
+
+    Parameters
+    ----------
+    unit: tuple
+        Tuple (`anno_name`, `output_names`, `curves`, `nb_curve_point`) with
+        the annotation name, names of outputs to be evaluated, and names of
+        performance curves to be computed.
+
+    Returns
+    -------
+    tuple
+        Tuple (`report`, `curves`) with performance metrics and list of
+        performance curves.
+    """
+    anno_name, output_names, curve_names, nb_curve_point = unit
+    idx = _MASKS[anno_name]
+    outputs = dict()
+    preds = dict()
+    for output_name in output_names:
+        outputs[output_name] = _DATA['outputs'][output_name]
+        preds[output_name] = _DATA['preds'][output_name]
+        if idx is not None:
+            outputs[output_name] = outputs[output_name][idx]
+            preds[output_name] = preds[output_name][idx]
+
+    report = ev.evaluate_outputs(outputs, preds)
+    report['anno'] = anno_name
+
+    curves = []
+    for name in curve_names:
+        curve = ev.evaluate_curve(outputs, preds, fun=get_curve_fun(name),
+                                  nb_point=nb_curve_point)
+        if curve is not None:
+            curve['curve'] = name
+            curve['anno'] = anno_name
+            curves.append(curve)
+    return (report, curves)
+
+
+def evaluate_units(data, masks, units, nb_worker=1):
+    """Evaluate outputs in annotation contexts in parallel.
+
+    Parameters
+    ----------
+    data: dict
+        `dict` with labels `outputs` and predictions `preds` of outputs.
+    masks: dict
+        `dict` with annotation names as keys and the indices of annotated
+        sites as values, or `None` to select all sites.
+    units: list
+        List of tuples as described by :func:`_evaluate_unit`, which are
+        evaluated in parallel by `nb_worker` processes.
+
+    Returns
+    -------
+    generator
+        Generator of tuples (`report`, `curves`) in the order of `units`.
+    """
+    if nb_worker > 1:
+        pool = Pool(min(nb_worker, len(units)), initializer=_init_worker,
+                    initargs=(data, masks))
+        try:
+            for result in pool.imap(_evaluate_unit, units):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_worker(data, masks)
+        for unit in units:
+            yield _evaluate_unit(unit)
+
+
 class App(object):
 
     def run(self, args):
@@ -154,6 +243,11 @@ class App(object):
             '--anno_files',
             help='BED files with annotation tracks',
             nargs='+')
+        p.add_argument(
+            '--anno_cache',
+            help='Cache the index of annotation files next to BED files to'
+            ' speed up subsequent runs',
+            action='store_true')
         p.add_argument(
             '--anno_curves',
             help='Performance curves to be computed in annotations contexts',
@@ -168,6 +262,12 @@ class App(object):
             '--nb_sample',
             help='Maximum number of samples',
             type=int)
+        p.add_argument(
+            '--nb_worker',
+            help='Number of processes for evaluating outputs and annotations'
+            ' in parallel',
+            type=int,
+            default=1)
         p.add_argument(
             '--compress',
             help='Compress output files to reduce storage',
@@ -204,21 +304,18 @@ class App(object):
         self.opts = opts
         self.log = log
 
-        # Get performance curve functions from names.
-        curve_funs = dict()
-        if opts.curves:
-            for name in opts.curves:
-                curve_funs[name] = get_curve_fun(name)
-        anno_curve_funs = dict()
-        if opts.anno_curves:
-            for name in opts.anno_curves:
-                anno_curve_funs[name] = get_curve_fun(name)
+        # Check names of performance curves.
+        for name in (opts.curves or []) + (opts.anno_curves or []):
+            get_curve_fun(name)
 
         log.info('Loading data ...')
         # Read and sort predictions and outputs.
         output_names = dat.get_output_names(opts.data_file,
                                             regex=opts.output_names,
                                             nb_key=opts.nb_output)
+        if not output_names:
+            log.warning('No outputs found!')
+            return 0
         names = {'chromo': None, 'pos': None,
                  'outputs': output_names,
                  'preds': output_names}
@@ -234,57 +331,53 @@ class App(object):
             assert np.all(chromo_pos == tmp)
         log.info('%d samples' % len(data['pos']))
 
-        reports = []
-        curves = []
-
-        log.info('Evaluating globally ...')
-        # Evaluate performances globally.
-        report = ev.evaluate_outputs(data['outputs'], data['preds'])
-        report['anno'] = ANNO_GLOBAL
-        reports.append(report)
-        pd.set_option('display.width', 1000)
-        print(ev.unstack_report(report))
-
-        if curve_funs:
-            # Performance curves.
-            for name, fun in curve_funs.items():
-                log.info('%s curve' % name)
-                curve = ev.evaluate_curve(data['outputs'], data['preds'],
-                                          fun=fun, nb_point=opts.nb_curve_point)
-                if curve is not None:
-                    curve['curve'] = name
-                    curve['anno'] = ANNO_GLOBAL
-                    curves.append(curve)
-
+        # Indices of sites of each annotation. `None` selects all sites.
+        masks = OrderedDict()
+        masks[ANNO_GLOBAL] = None
         if opts.anno_files:
-            log.info('Evaluating annotations ...')
-            # Evaluate annotations.
+            log.info('Annotating sites ...')
+            chromos = list(np.unique(data['chromo']))
             for anno_file in opts.anno_files:
-                anno = read_anno_file(anno_file)
+                anno = read_anno_file(anno_file, chromos=chromos,
+                                      cache=opts.anno_cache)
                 anno_name = os.path.splitext(os.path.basename(anno_file))[0]
                 idx = annotate(data['chromo'], data['pos'], anno)
                 log.info('%s: %d' % (anno_name, idx.sum()))
                 if idx.sum() < opts.anno_min_sites:
                     log.info('Skipping due to insufficient annotated sites!')
                     continue
-                # Select data at annotated sites.
-                anno_data = slice_dict(data, idx)
-                report = ev.evaluate_outputs(anno_data['outputs'],
-                                             anno_data['preds'])
-                report['anno'] = anno_name
-                reports.append(report)
-
-                if curve_funs:
-                    # Performance curves.
-                    for name, fun in anno_curve_funs.items():
-                        log.info('%s curve' % name)
-                        curve = ev.evaluate_curve(
-                            data['outputs'], data['preds'],
-                            fun=fun, nb_point=opts.nb_curve_point)
-                        if curve is not None:
-                            curve['curve'] = name
-                            curve['anno'] = anno_name
-                            curves.append(curve)
+                masks[anno_name] = np.nonzero(idx)[0]
+
+        # Split outputs into blocks such that each worker evaluates multiple
+        # units of work per annotation.
+        output_names = list(data['outputs'].keys())
+        block_size = len(output_names)
+        if opts.nb_worker > 1:
+            block_size = int(np.ceil(block_size / (opts.nb_worker * 4)))
+        output_blocks = [output_names[i:(i + block_size)]
+                         for i in range(0, len(output_names), block_size)]
+        units = []
+        for anno_name in masks:
+            if anno_name == ANNO_GLOBAL:
+                curve_names = opts.curves or []
+            else:
+                curve_names = opts.anno_curves or []
+            for block in output_blocks:
+                units.append((anno_name, block, curve_names,
+                              opts.nb_curve_point))
+
+        log.info('Evaluating %d annotations ...' % len(masks))
+        reports = []
+        curves = []
+        results = evaluate_units(data, masks, units, nb_worker=opts.nb_worker)
+        for report, unit_curves in results:
+            reports.append(report)
+            curves.extend(unit_curves)
+
+        pd.set_option('display.width', 1000)
+        report = pd.concat([report for report in reports
+                            if report['anno'].iloc[0] == ANNO_GLOBAL])
+        print(ev.unstack_report(report))
 
         make_dir(opts.out_dir)
         if reports:
@@ -32,6 +32,18 @@ activations with model predictions.
         --out_file ./activations.h5
         --act_fun wmean
 
+Compute streaming statistics of activations of all sequence windows instead of
+storing activations, which can be analyzed by ``dcpg_filter_motifs.py``
+without storing the activation tensor:
+
+.. code:: bash
+
+    dcpg_filter_act.py
+        ./data/*.h5
+        --model_files ./models/dna
+        --out_file ./activations.h5
+        --online
+
 See Also
 --------
 * ``dcpg_filter_motifs.py``: For motif visualization and analysis.
@@ -42,6 +54,7 @@ from __future__ import division
 
 import sys
 import os
+import time
 
 import argparse
 import h5py as h5
@@ -52,7 +65,8 @@ import six
 
 from deepcpg import data as dat
 from deepcpg import models as mod
-from deepcpg.data import hdf, dna
+from deepcpg.data import dna
+from deepcpg.motifs import FilterActStats
 from deepcpg.utils import ProgressBar, to_list, linear_weights
 
 
@@ -92,6 +106,30 @@ class App(object):
             '--act_wlen',
             help='Maximal length of sequence windows',
             type=int)
+        g.add_argument(
+            '--online',
+            help='Store statistics of activations that are needed by'
+            ' dcpg_filter_motifs.py, which are computed batch-wise, instead'
+            ' of activations',
+            action='store_true')
+        g.add_argument(
+            '--nb_top',
+            help='Number of highest activations and k-mers per filter that'
+            ' are stored with --online',
+            type=int,
+            default=25000)
+        g.add_argument(
+            '--nb_act_sample',
+            help='Number of randomly sampled activations that are stored'
+            ' with --online for plotting densities',
+            type=int,
+            default=10000)
+        g.add_argument(
+            '--nb_sample_pca',
+            help='Number of sequence windows whose mean activations are'
+            ' stored with --online for PCA',
+            type=int,
+            default=1000)
 
         g = p.add_argument_group('output arguments')
         g.add_argument(
@@ -121,6 +159,17 @@ class App(object):
             help='Batch size',
             type=int,
             default=128)
+        g.add_argument(
+            '--tune_batch_sizes',
+            help='Benchmark inference with these batch sizes on startup and'
+            ' use the fastest instead of --batch_size',
+            type=int,
+            nargs='+')
+        g.add_argument(
+            '--tune_threads',
+            help='Thread settings "intra_op,inter_op" of TensorFlow that are'
+            ' benchmarked with --tune_batch_sizes, e.g. "4,1 8,2"',
+            nargs='+')
         g.add_argument(
             '--seed',
             help='Seed of random number generator',
@@ -150,6 +199,8 @@ class App(object):
 
         if not opts.model_files:
             raise ValueError('No model files provided!')
+        if opts.online and opts.act_fun:
+            raise ValueError('--online and --act_fun are mutually exclusive!')
 
         log.info('Loading model ...')
         K.set_learning_phase(0)
@@ -180,18 +231,32 @@ class App(object):
             dna_wlen=to_list(model.input_shape)[dna_idx][1]
         )
         nb_sample = dat.get_nb_sample(opts.data_files, opts.nb_sample)
+
+        if opts.tune_batch_sizes:
+            log.info('Tuning inference ...')
+            tune_size = min(nb_sample, max(opts.tune_batch_sizes) * 2)
+            inputs = next(data_reader(opts.data_files, nb_sample=tune_size,
+                                      batch_size=tune_size,
+                                      loop=False, shuffle=False))
+            if isinstance(inputs, tuple):
+                inputs = inputs[0]
+            opts.batch_size = mod.tune_inference(
+                model, lambda x: fun(list(x.values())), inputs,
+                opts.tune_batch_sizes,
+                nb_threads=mod.parse_nb_threads(opts.tune_threads),
+                log=log.info)[0]
+            if opts.seed is not None:
+                np.random.seed(opts.seed)
+
+        # Read positions in the same pass, such that they match shuffled
+        # samples
         data_reader = data_reader(opts.data_files,
+                                  meta_names=['chromo', 'pos'],
                                   nb_sample=nb_sample,
                                   batch_size=opts.batch_size,
                                   loop=False,
                                   shuffle=opts.shuffle)
 
-        meta_reader = hdf.reader(opts.data_files, ['chromo', 'pos'],
-                                 nb_sample=nb_sample,
-                                 batch_size=opts.batch_size,
-                                 loop=False,
-                                 shuffle=False)
-
         out_file = h5.File(opts.out_file, 'w')
         out_group = out_file
 
@@ -199,6 +264,12 @@ class App(object):
         out_group['weights/weights'] = weights[0]
         out_group['weights/bias'] = weights[1]
 
+        act_stats = None
+        if opts.online:
+            act_stats = FilterActStats(
+                weights[0].shape[-1], len(weights[0]), nb_top=opts.nb_top,
+                nb_sample=opts.nb_act_sample, nb_pca=opts.nb_sample_pca)
+
         def h5_dump(path, data, idx, dtype=None, compression='gzip'):
             if path not in out_group:
                 if dtype is None:
@@ -212,28 +283,26 @@ class App(object):
             out_group[path][idx:idx+len(data)] = data
 
         log.info('Computing activations')
+        start = time.time()
         progbar = ProgressBar(nb_sample, log.info)
         idx = 0
         for data in data_reader:
-            if isinstance(data, tuple):
-                inputs, outputs, weights = data
+            if len(data) == 4:
+                inputs, outputs, weights, meta = data
             else:
-                inputs = data
-            if isinstance(inputs, dict):
-                inputs = list(inputs.values())
-            batch_size = len(inputs[0])
+                inputs, meta = data
+            batch_size = len(inputs['dna'])
             progbar.update(batch_size)
 
             if opts.store_inputs:
-                for i, name in enumerate(model.input_names):
-                    h5_dump('inputs/%s' % name,
-                            dna.onehot_to_int(inputs[i]), idx)
+                for name, value in six.iteritems(inputs):
+                    h5_dump('inputs/%s' % name, dna.onehot_to_int(value), idx)
 
             if opts.store_outputs:
                 for name, output in six.iteritems(outputs):
                     h5_dump('outputs/%s' % name, output, idx)
 
-            fun_eval = fun(inputs)
+            fun_eval = fun([inputs['dna']])
             act = fun_eval[0]
 
             if opts.act_wlen:
@@ -252,18 +321,28 @@ class App(object):
                 else:
                     raise ValueError('Invalid function "%s"!' % (opts.act_fun))
 
-            h5_dump('act', act, idx)
+            if act_stats:
+                # Align sequences with activations as
+                # `dcpg_filter_motifs.py`
+                seqs = dna.onehot_to_int(inputs['dna'])
+                delta = (seqs.shape[1] - act.shape[1]) // 2
+                act_stats.update(act, seqs[:, delta:(delta + act.shape[1])])
+            else:
+                h5_dump('act', act, idx)
 
             if opts.store_preds:
                 preds = fun_eval[1:]
                 for i, name in enumerate(model.output_names):
                     h5_dump('preds/%s' % name, preds[i].squeeze(), idx)
 
-            for name, value in six.iteritems(next(meta_reader)):
+            for name, value in six.iteritems(meta):
                 h5_dump(name, value, idx)
 
             idx += batch_size
         progbar.close()
+        if act_stats:
+            act_stats.save(out_group.create_group('act_stats'))
+        log.info('%.1f samples/s' % (idx / (time.time() - start)))
 
         out_file.close()
         log.info('Done!')
@@ -33,6 +33,13 @@ Visualize and analyze motifs:
         --plot_heat
         --plot_dens
         --plot_pca
+
+Activating k-mers, activation statistics, and densities can also be computed
+from statistics of ``dcpg_filter_act.py --online``, which does not require
+storing activations and DNA sequence windows. In this case, densities are
+plotted from a random sample of activations and the number of activating
+k-mers is limited by ``dcpg_filter_act.py --nb_top``, also if ``--act_thr_max``
+is zero or ``--act_thr_per`` is small.
 """
 
 from __future__ import print_function
@@ -61,7 +68,7 @@ import seaborn as sns
 
 from deepcpg.utils import EPS, linear_weights, make_dir
 from deepcpg.data import dna
-from deepcpg.motifs import read_meme_db, get_report
+from deepcpg.motifs import read_meme_db, get_report, FilterActStats
 
 
 sns.set_style('darkgrid')
@@ -220,10 +227,15 @@ def map_alphabets(values, src_alphabet, dst_alphabet):
     return _values
 
 
-def open_meme(filename, seqs):
-    nt_freq = np.zeros(len(ALPHABET))
+def get_nt_count(seqs):
+    nt_count = np.zeros(len(ALPHABET), dtype=np.int64)
     for nt_int in six.itervalues(ALPHABET):
-        nt_freq[nt_int] = np.sum(seqs == nt_int) + 1
+        nt_count[nt_int] = np.sum(seqs == nt_int)
+    return nt_count
+
+
+def open_meme(filename, nt_count):
+    nt_freq = np.asarray(nt_count, dtype=np.float64) + 1
     nt_freq = nt_freq / nt_freq.sum()
     nt_freq = map_alphabets(nt_freq, ALPHABET, MEME_ALPHABET)
 
@@ -431,11 +443,27 @@ class App(object):
         log.info('Reading data')
         in_file = h5.File(opts.in_file, 'r')
 
-        nb_sample = in_file['/act'].shape[0]
-        if opts.nb_sample:
-            nb_sample = min(opts.nb_sample, nb_sample)
+        # Activation statistics from `dcpg_filter_act.py --online`
+        act_stats = None
+        if '/act' not in in_file:
+            if 'act_stats' not in in_file:
+                raise ValueError('%s contains neither activations nor'
+                                 ' activation statistics!' % opts.in_file)
+            act_stats = FilterActStats.load(in_file['act_stats'])
+            nb_sample = in_file['pos'].shape[0]
+            nb_filter = act_stats.nb_filter
+            if opts.nb_sample:
+                log.warning('--nb_sample ignored for activation statistics')
+            if opts.act_thr_max > act_stats.nb_top:
+                log.warning('Only %d activating kmers stored per filter' %
+                            act_stats.nb_top)
+                opts.act_thr_max = act_stats.nb_top
+        else:
+            nb_sample = in_file['/act'].shape[0]
+            if opts.nb_sample:
+                nb_sample = min(opts.nb_sample, nb_sample)
+            nb_filter = in_file['/act'].shape[-1]
 
-        nb_filter = in_file['/act'].shape[-1]
         filters_idx = opts.filters
         if filters_idx is None:
             filters_idx = range(nb_filter)
@@ -443,16 +471,20 @@ class App(object):
             filters_idx = ranges_to_list(filters_idx, 0, nb_filter - 1)
             nb_filter = len(filters_idx)
 
-        # Get only view on data to reduce memory usage. Possible since filters
-        # can be processed independently.
-        filters_act = in_file['/act']
-
-        seqs = in_file['/inputs/dna'][:nb_sample]
-        if seqs.shape[1] != filters_act.shape[1]:
-            # Trim sequence length to length of activation layer
-            tmp = (seqs.shape[1] - filters_act.shape[1]) // 2
-            seqs = seqs[:, tmp:(tmp + filters_act.shape[1])]
-            assert seqs.shape[1] == filters_act.shape[1]
+        if act_stats is None:
+            # Get only view on data to reduce memory usage. Possible since
+            # filters can be processed independently.
+            filters_act = in_file['/act']
+
+            seqs = in_file['/inputs/dna'][:nb_sample]
+            if seqs.shape[1] != filters_act.shape[1]:
+                # Trim sequence length to length of activation layer
+                tmp = (seqs.shape[1] - filters_act.shape[1]) // 2
+                seqs = seqs[:, tmp:(tmp + filters_act.shape[1])]
+                assert seqs.shape[1] == filters_act.shape[1]
+            nt_count = get_nt_count(seqs)
+        else:
+            nt_count = act_stats.nt_count
 
         filters_weights = in_file['weights/weights']
         if filters_weights.ndim == 4:
@@ -484,27 +516,26 @@ class App(object):
             make_dir(dirname)
 
         meme_filename = pt.join(opts.out_dir, 'meme.txt')
-        meme_file = open_meme(meme_filename, seqs)
+        meme_file = open_meme(meme_filename, nt_count)
 
         if opts.plot_pca:
-            tmp = min(len(filters_act), opts.nb_sample_pca)
+            if act_stats is None:
+                tmp = min(len(filters_act), opts.nb_sample_pca)
+                # Down-sample activations to at most nb_sample_pca samples to
+                # reduce memory usage and run-time.
+                pca_act = filters_act[:tmp, :, filters_idx]
+                weights = linear_weights(pca_act.shape[1])
+                pca_acts = [('mean', pca_act.mean(axis=1)),
+                            ('wmean', np.average(pca_act, 1, weights)),
+                            ('max', pca_act.max(axis=1))]
+            else:
+                tmp = min(len(act_stats.pca_act['mean']), opts.nb_sample_pca)
+                pca_acts = [(name, value[:tmp, filters_idx]) for name, value
+                            in six.iteritems(act_stats.pca_act)]
             log.info('Performing PCA on activations using %d samples' % tmp)
-            # Down-sample activations to at most nb_sample_pca samples to reduce
-            # memory usage and run-time.
-            pca_act = filters_act[:tmp, :, filters_idx]
-
-            act = pca_act.mean(axis=1)
-            tmp = self.plot_filename(opts.out_dir, 'pca_mean')
-            plot_pca(act, labels=filters_idx, filename=tmp)
-
-            weights = linear_weights(pca_act.shape[1])
-            act = np.average(pca_act, 1, weights)
-            tmp = self.plot_filename(opts.out_dir, 'pca_wmean')
-            plot_pca(act, labels=filters_idx, filename=tmp)
-
-            act = pca_act.max(axis=1)
-            tmp = self.plot_filename(opts.out_dir, 'pca_max')
-            plot_pca(act, labels=filters_idx, filename=tmp)
+            for fun_name, act in pca_acts:
+                tmp = self.plot_filename(opts.out_dir, 'pca_%s' % fun_name)
+                plot_pca(act, labels=filters_idx, filename=tmp)
 
         log.info('Analyzing filters')
         log.info('-----------------')
@@ -514,15 +545,20 @@ class App(object):
             weblogo_opts = opts.weblogo_opts
         for idx in filters_idx:
             log.info('Filter %d' % idx)
-            filter_act = filters_act[:nb_sample, :, idx]
+            if act_stats is None:
+                filter_act = filters_act[:nb_sample, :, idx]
             filter_weights = filters_weights[:, :, idx].T
             assert len(filter_weights) == len(ALPHABET)
 
             stats = OrderedDict()
             stats['idx'] = idx
             stats['motif'] = get_motif_from_weights(filter_weights)
-            stats['act_mean'] = filter_act.mean()
-            stats['act_std'] = filter_act.std()
+            if act_stats is None:
+                stats['act_mean'] = filter_act.mean()
+                stats['act_std'] = filter_act.std()
+            else:
+                stats['act_mean'] = act_stats.mean[idx]
+                stats['act_std'] = act_stats.std[idx]
             stats['ic'] = 0
             stats['nb_site'] = 0
             stats = pd.Series(stats)
@@ -535,7 +571,10 @@ class App(object):
             if opts.plot_dens:
                 log.info('Plotting filter densities')
                 tmp = self.plot_filename(sub_dirs['dens'], '%03d' % idx)
-                plot_filter_densities(np.ravel(filter_act), tmp)
+                if act_stats is None:
+                    plot_filter_densities(np.ravel(filter_act), tmp)
+                else:
+                    plot_filter_densities(act_stats.sample[:, idx], tmp)
 
             if opts.plot_heat:
                 log.info('Plotting filter heatmap')
@@ -543,9 +582,20 @@ class App(object):
                 plot_filter_heatmap(filter_weights, tmp)
 
             log.info('Extracting activating kmers')
-            act_kmers = get_act_kmers(filter_act, filter_len, seqs,
-                                      thr_per=opts.act_thr_per,
-                                      thr_max=opts.act_thr_max)
+            if act_stats is None:
+                act_kmers = get_act_kmers(filter_act, filter_len, seqs,
+                                          thr_per=opts.act_thr_per,
+                                          thr_max=opts.act_thr_max)
+            else:
+                act_kmers = act_stats.get_kmers(idx,
+                                                thr_per=opts.act_thr_per,
+                                                thr_max=opts.act_thr_max)
+                if act_stats.is_truncated(idx, thr_per=opts.act_thr_per,
+                                          thr_max=opts.act_thr_max):
+                    log.warning('Activating kmers truncated to the %d highest'
+                                ' stored activations. Increase'
+                                ' --act_thr_per or dcpg_filter_act.py'
+                                ' --nb_top!' % act_stats.nb_top)
             stats.nb_site = len(act_kmers)
 
             if len(act_kmers) < 10:
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+
+"""Predict methylation states genome-wide.
+
+Predicts methylation states of CpG sites with a trained DeepCpG model without
+creating data files by `dcpg_data.py` first. Model inputs are extracted
+chunk-wise from DNA sequences and CpG profiles, which are read one chromosome
+at a time, such that memory is bounded by ``--chunk_size`` and the size of the
+largest chromosome. Predicts all CpG sites of the given chromosomes unless
+``--pos_file`` is provided.
+
+``--out_file`` will write predictions to a HDF5 file with the same structure as
+``dcpg_eval.py --out_data``, which can be exported by `dcpg_eval_export.py`:
+
+* ``chromo``: The chromosome of the CpG site.
+* ``pos``: The position of the CpG site on the chromosome.
+* ``outputs``: The observed methylation state of each cell in
+  ``--cpg_profiles`` and CpG site, or -1 if missing.
+* ``preds``: The predicted methylation state of each output and CpG site.
+
+``--out_bedgraph`` will write imputed profiles, i.e. the observed state if
+known and the predicted state otherwise, to bedGraph files.
+
+Examples
+--------
+Impute all CpG sites on chromosome 1 and 2:
+
+.. code:: bash
+
+    dcpg_predict.py
+        --model_files ./model
+        --dna_files ./mm10
+        --cpg_profiles ./cpg/*.tsv
+        --chromos 1 2
+        --out_file ./predict/data.h5
+        --out_bedgraph ./predict
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+from collections import OrderedDict
+import os
+import random
+import re
+import sys
+
+import argparse
+from glob import glob
+import logging
+import numpy as np
+import pandas as pd
+import six
+
+from deepcpg import data as dat
+from deepcpg import models as mod
+from deepcpg.data import dna, fasta, hdf
+from deepcpg.data import feature_extractor as fext
+from deepcpg.utils import make_dir, to_list
+
+
+def get_dna_chromos(dna_files):
+    """Return chromosomes of FASTA files named "*.chromosome.`chromo`.fa*"."""
+    dna_files = to_list(dna_files)
+    if len(dna_files) == 1 and os.path.isdir(dna_files[0]):
+        dna_files = glob(os.path.join(dna_files[0], '*.dna.chromosome.*.fa*'))
+    chromos = []
+    for dna_file in dna_files:
+        match = re.search(r'chromosome\.([^.]+)\.fa', dna_file)
+        if match:
+            chromos.append(match.group(1))
+    return chromos
+
+
+def read_chromo_profiles(cpg_files, chromo, nb_thread=1):
+    """Read CpG profiles of chromosome `chromo`.
+
+    Profiles without records on `chromo` are empty, instead of raising an
+    error like :func:`deepcpg.data.utils.parse_cpg_profile`.
+    """
+    cpg_profiles = OrderedDict()
+    for name, filename in six.iteritems(cpg_files):
+        cpg_profile = dat.parse_cpg_profile(filename, nb_thread=nb_thread)
+        cpg_profiles[name] = OrderedDict()
+        if chromo in cpg_profile:
+            cpg_profiles[name][chromo] = cpg_profile[chromo]
+    return cpg_profiles
+
+
+def get_observed(cpg_profile, chromo, pos):
+    """Return observed states of `cpg_profile` at `pos` or `CPG_NAN`."""
+    states = np.empty(len(pos), dtype=np.int8)
+    states.fill(dat.CPG_NAN)
+    if chromo not in cpg_profile:
+        return states
+    profile_pos, profile_value = cpg_profile[chromo]
+    if not len(profile_pos):
+        return states
+    idx = np.minimum(np.searchsorted(profile_pos, pos), len(profile_pos) - 1)
+    observed = profile_pos[idx] == pos
+    states[observed] = np.round(profile_value[idx[observed]])
+    return states
+
+
+def get_output_file(out_dir, output_name):
+    """Return name of bedGraph file of output `output_name`."""
+    name = output_name.split(dat.OUTPUT_SEP)
+    if name[0] == 'cpg':
+        name = name[-1]
+    else:
+        name = '_'.join(name)
+    return os.path.join(out_dir, '%s.bedGraph.gz' % name)
+
+
+class App(object):
+
+    def run(self, args):
+        name = os.path.basename(args[0])
+        parser = self.create_parser(name)
+        opts = parser.parse_args(args[1:])
+        return self.main(name, opts)
+
+    def create_parser(self, name):
+        p = argparse.ArgumentParser(
+            prog=name,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+            description='Predicts methylation states genome-wide')
+        p.add_argument(
+            '--model_files',
+            help='Model files',
+            nargs='+',
+            required=True)
+        p.add_argument(
+            '--dna_files',
+            help='Directory or FASTA files named "*.chromosome.`chromo`.fa*"'
+            ' with the DNA sequences for chromosome `chromo`. Required for'
+            ' models with DNA module.',
+            nargs='+')
+        p.add_argument(
+            '--cpg_profiles',
+            help='Single-cell methylation profiles in dcpg or bedGraph format'
+            ' of input cells. Required for models with CpG module.',
+            nargs='+')
+        p.add_argument(
+            '--pos_file',
+            help='File with positions of CpG sites that are to be predicted.'
+            ' If missing, all CpG sites in the DNA sequence or, without DNA'
+            ' module, all observed CpG sites are predicted.')
+        p.add_argument(
+            '--chromos',
+            help='Chromosomes that are predicted',
+            nargs='+')
+        p.add_argument(
+            '-o', '--out_file',
+            help='Output HDF5 file with predictions')
+        p.add_argument(
+            '--out_bedgraph',
+            help='Output directory for bedGraph files with imputed profiles')
+        p.add_argument(
+            '--chunk_size',
+            help='Number of CpG sites whose inputs are extracted at once',
+            type=int,
+            default=32768)
+        p.add_argument(
+            '--batch_size',
+            help='Batch size',
+            type=int,
+            default=128)
+        p.add_argument(
+            '--nb_thread',
+            help='Number of threads for reading and writing compressed files',
+            type=int,
+            default=1)
+        p.add_argument(
+            '--nb_sample',
+            help='Maximum number of CpG sites',
+            type=int)
+        p.add_argument(
+            '--seed',
+            help='Seed of random number generator',
+            type=int,
+            default=0)
+        p.add_argument(
+            '--verbose',
+            help='More detailed log messages',
+            action='store_true')
+        p.add_argument(
+            '--log_file',
+            help='Write log messages to file')
+        return p
+
+    def main(self, name, opts):
+        logging.basicConfig(filename=opts.log_file,
+                            format='%(levelname)s (%(asctime)s): %(message)s')
+        log = logging.getLogger(name)
+        if opts.verbose:
+            log.setLevel(logging.DEBUG)
+        else:
+            log.setLevel(logging.INFO)
+        log.debug(opts)
+
+        if not opts.out_file and not opts.out_bedgraph:
+            raise ValueError('Output file or directory required!')
+
+        # Seed used since unknown nucleotides are randomly sampled
+        if opts.seed is not None:
+            np.random.seed(opts.seed)
+            random.seed(opts.seed)
+
+        # CpG profiles are read per chromosome to bound memory
+        cpg_files = OrderedDict()
+        for filename in opts.cpg_profiles or []:
+            name = os.path.basename(filename).split(os.extsep)[0]
+            cpg_files[name] = filename
+
+        log.info('Loading model ...')
+        model = mod.load_model(opts.model_files)
+        replicate_names = None
+        if any([name.startswith('cpg/') for name in model.input_names]):
+            # Sorted like replicates in data files that models are trained on
+            replicate_names = sorted(cpg_files.keys())
+        data_reader = mod.data_reader_from_model(
+            model, outputs=False, replicate_names=replicate_names)
+        if data_reader.use_dna and not opts.dna_files:
+            raise ValueError('DNA files required!')
+        stacked_outputs = mod.get_stacked_outputs(model)
+
+        pos_table = None
+        if opts.pos_file:
+            log.info('Reading position table ...')
+            pos_table = pd.read_table(opts.pos_file, usecols=[0, 1],
+                                      dtype={0: str, 1: np.int32},
+                                      header=None, comment='#')
+            pos_table.columns = ['chromo', 'pos']
+            pos_table['chromo'] = dat.format_chromo(pos_table['chromo'])
+            chromos = list(pos_table['chromo'].unique())
+        elif data_reader.use_dna:
+            chromos = get_dna_chromos(opts.dna_files)
+        else:
+            log.info('Reading chromosomes of CpG profiles ...')
+            chromos = set()
+            for filename in six.itervalues(cpg_files):
+                chromos.update(dat.read_cpg_profile_chromos(
+                    filename, nb_thread=opts.nb_thread))
+        if opts.chromos:
+            chromos = [chromo for chromo in opts.chromos if chromo in chromos]
+        chromos = sorted(chromos)
+        if not chromos:
+            raise ValueError('No chromosomes found!')
+
+        cpg_ext = None
+        if data_reader.replicate_names:
+            cpg_ext = fext.KnnCpgFeatureExtractor(data_reader.cpg_wlen // 2)
+
+        writer = None
+        if opts.out_file:
+            make_dir(os.path.dirname(opts.out_file) or '.')
+            # Fixed width to not truncate longer chromosome names
+            chromo_len = max([len(chromo) for chromo in chromos])
+            writer = hdf.ChunkWriter(
+                opts.out_file, dtypes={'chromo': 'S%d' % max(2, chromo_len)})
+        bedgraph_writers = OrderedDict()
+        if opts.out_bedgraph:
+            make_dir(opts.out_bedgraph)
+
+        nb_sample = 0
+        for chromo in chromos:
+            if opts.nb_sample and nb_sample >= opts.nb_sample:
+                break
+            log.info('-' * 80)
+            log.info('Chromosome %s ...' % chromo)
+
+            cpg_profiles = OrderedDict()
+            if cpg_files:
+                log.info('Reading CpG profiles ...')
+                cpg_profiles = read_chromo_profiles(cpg_files, chromo,
+                                                    nb_thread=opts.nb_thread)
+
+            chromo_dna = None
+            if data_reader.use_dna:
+                chromo_dna = dna.seq_to_int(
+                    fasta.read_chromo(opts.dna_files, chromo))
+
+            if pos_table is not None:
+                chromo_pos = pos_table.loc[pos_table.chromo == chromo].pos
+                chromo_pos = np.unique(chromo_pos.values)
+            elif chromo_dna is not None:
+                chromo_pos = dna.find_cpgs(chromo_dna)
+            else:
+                chromo_pos = np.unique(np.concatenate(
+                    [cpg_profile[chromo][0]
+                     for cpg_profile in six.itervalues(cpg_profiles)
+                     if chromo in cpg_profile]))
+            if opts.nb_sample:
+                chromo_pos = chromo_pos[:(opts.nb_sample - nb_sample)]
+            nb_sample += len(chromo_pos)
+            log.info('%d CpG sites' % len(chromo_pos))
+
+            nb_chunk = int(np.ceil(len(chromo_pos) / opts.chunk_size))
+            for chunk in range(nb_chunk):
+                log.info('Chunk \t%d / %d' % (chunk + 1, nb_chunk))
+                chunk_pos = chromo_pos[(chunk * opts.chunk_size):
+                                       ((chunk + 1) * opts.chunk_size)]
+
+                # Extract inputs as stored by `dcpg_data.py`
+                data_raw = dict()
+                if chromo_dna is not None:
+                    data_raw['inputs/dna'] = dna.extract_windows(
+                        chromo_dna, chunk_pos, data_reader.dna_wlen)
+                if data_reader.replicate_names:
+                    data_raw.update(dat.extract_cpg_inputs(
+                        cpg_profiles, to_list(data_reader.replicate_names),
+                        cpg_ext, chromo, chunk_pos))
+                inputs = data_reader.prepro_inputs(data_raw)
+
+                preds = to_list(model.predict(inputs,
+                                              batch_size=opts.batch_size))
+                chunk_preds = OrderedDict()
+                for i, name in enumerate(model.output_names):
+                    if name in stacked_outputs:
+                        for j, output_name in enumerate(stacked_outputs[name]):
+                            chunk_preds[output_name] = preds[i][:, j]
+                    elif preds[i].ndim == 2 and preds[i].shape[1] == 1:
+                        chunk_preds[name] = preds[i][:, 0]
+                    else:
+                        chunk_preds[name] = preds[i]
+
+                # Observed states of output cells
+                chunk_outputs = OrderedDict()
+                for output_name in chunk_preds:
+                    name = output_name.split(dat.OUTPUT_SEP)
+                    if name[0] == 'cpg' and name[-1] in cpg_profiles:
+                        chunk_outputs[output_name] = get_observed(
+                            cpg_profiles[name[-1]], chromo, chunk_pos)
+
+                if writer:
+                    data = OrderedDict()
+                    data['chromo'] = np.array([chromo.encode()] *
+                                              len(chunk_pos))
+                    data['pos'] = chunk_pos.astype(np.int32)
+                    for output_name, value in six.iteritems(chunk_outputs):
+                        data['outputs/%s' % output_name] = value
+                    for output_name, value in six.iteritems(chunk_preds):
+                        data['preds/%s' % output_name] = value
+                    writer.write_dict(data)
+
+                if opts.out_bedgraph:
+                    bed_chromo = np.array([('chr%s' % chromo).encode()] *
+                                          len(chunk_pos))
+                    for output_name, value in six.iteritems(chunk_preds):
+                        if value.ndim > 1:
+                            continue
+                        if output_name in chunk_outputs:
+                            # Use observed state if known
+                            observed = chunk_outputs[output_name]
+                            value = np.where(observed != dat.CPG_NAN,
+                                             observed, value)
+                        if output_name not in bedgraph_writers:
+                            bedgraph_writers[output_name] = dat.BgzfWriter(
+                                get_output_file(opts.out_bedgraph,
+                                                output_name),
+                                nb_thread=opts.nb_thread)
+                        bedgraph_writers[output_name].write(
+                            dat.format_bedgraph(bed_chromo, chunk_pos, value))
+
+        if writer:
+            writer.close()
+        for bedgraph_writer in six.itervalues(bedgraph_writers):
+            bedgraph_writer.close()
+
+        log.info('Done!')
+
+        return 0
+
+
+if __name__ == '__main__':
+    app = App()
+    app.run(sys.argv)
@@ -3,7 +3,10 @@
 """Compute the effect of DNA mutations on methylation.
 
 Computes the effect of DNA mutation on the mean methylation rate or
-cell-to-cell variance using gradient backpropagation.
+cell-to-cell variance using gradient backpropagation or in-silico mutagenesis
+(ISM). ISM predicts the effect of all single-nucleotide substitutions by the
+difference between the predictions of mutated and reference sequences, which
+are stored as [nb_sample, wlen, 4] matrices with zeros for reference bases.
 
 Examples
 --------
@@ -28,10 +31,26 @@ Compute weighted mean effects in DNA sequence windows of length 101:
         --targets mean var
         --dna_wlen 101
         --agg_effects wmean
+
+Compute effects of all substitutions within 51 bp of CpG sites by ISM:
+
+.. code:: bash
+
+    dcpg_snp.py
+        ./data/*.h5
+        --model_files ./model/dna
+        --out_file ./effects.h5
+        --method ism
+        --dna_wlen 101
+        --batch_size 4096
 """
 
+from __future__ import division
+from __future__ import print_function
+
 import sys
 import os
+import time
 
 import argparse
 import h5py as h5
@@ -41,8 +60,115 @@ import logging
 
 from deepcpg import data as dat
 from deepcpg import models as mod
-from deepcpg.data import hdf
-from deepcpg.utils import ProgressBar, linear_weights
+from deepcpg.data import dna, hdf
+from deepcpg.utils import ProgressBar, linear_weights, to_list
+
+
+def get_targets(preds, targets):
+    """Compute targets, e.g. mean methylation rate, from model predictions.
+
+    Parameters
+    ----------
+    preds: list
+        Predictions of all model outputs.
+    targets: list
+        Names of targets.
+
+    Returns
+    -------
+    list
+        [nb_sample] :class:`numpy.ndarray` for each target.
+    """
+    preds = np.hstack([pred.reshape(len(pred), -1) for pred in preds])
+    values = []
+    for name in targets:
+        if name == 'mean':
+            values.append(preds.mean(axis=1))
+        elif name == 'var':
+            values.append(preds.var(axis=1))
+        else:
+            raise ValueError('Invalid effect size "%s"!' % name)
+    return values
+
+
+def get_center_slice(seq_len, wlen=None):
+    """Return slice of window of length `wlen` at the center of sequences.
+
+    The window includes `wlen // 2` positions on both sides of the center,
+    i.e. `wlen + 1` positions for even `wlen`, and is limited to `seq_len`.
+    """
+    if not wlen:
+        return slice(0, seq_len)
+    ctr = seq_len // 2
+    delta = wlen // 2
+    return slice(max(ctr - delta, 0), min(ctr + delta + 1, seq_len))
+
+
+def substitute_inputs(inputs, seq_idx, pos, base):
+    """Return model inputs of sequences with substituted bases.
+
+    Non-DNA inputs of mutated sequences are copied from the input sequence
+    `seq_idx`, whose DNA window is substituted by :func:`dna.substitute`.
+    """
+    mut_inputs = dict()
+    for name, value in inputs.items():
+        if name == 'dna':
+            mut_inputs[name] = dna.substitute(value, seq_idx, pos, base)
+        else:
+            mut_inputs[name] = value[seq_idx]
+    return mut_inputs
+
+
+def compute_ism(model, inputs, targets, wlen=None, batch_size=128):
+    """Compute effects of DNA substitutions by in-silico mutagenesis.
+
+    Predicts all single-nucleotide substitutions of DNA windows within the
+    center window of length `wlen` returned by :func:`get_center_slice` in
+    batches of `batch_size` mutated sequences. Predictions of reference
+    sequences are computed once per sample and non-DNA inputs are shared by
+    all mutated sequences of a sample.
+
+    Parameters
+    ----------
+    model: :class:`keras.models.Model`
+        DNA or joint model.
+    inputs: dict
+        Model inputs with one-hot encoded DNA windows 'dna'.
+    targets: list
+        Names of targets returned by :func:`get_targets`.
+    wlen: int
+        Length of window at center in which bases are substituted.
+    batch_size: int
+        Number of mutated sequences that are predicted at once.
+
+    Returns
+    -------
+    list
+        [nb_sample, wlen, 4] :class:`numpy.ndarray` for each target with the
+        effect of substituting the base at each position by each base, which
+        is zero for the reference base.
+    """
+    seqs = inputs['dna']
+    nb_sample, seq_len = seqs.shape[:2]
+    center = get_center_slice(seq_len, wlen)
+    start, end = center.start, center.stop
+    ref_values = get_targets(to_list(model.predict(inputs,
+                                                   batch_size=batch_size)),
+                             targets)
+    effects = [np.zeros((nb_sample, end - start, seqs.shape[2]),
+                        dtype=np.float32) for target in targets]
+
+    seq_idx, pos, base = dna.get_substitutions(seqs, start, end)
+    for i in range(0, len(seq_idx), batch_size):
+        idx = slice(i, i + batch_size)
+        mut_inputs = substitute_inputs(inputs, seq_idx[idx], pos[idx],
+                                       base[idx])
+        preds = to_list(model.predict(mut_inputs, batch_size=batch_size))
+        for effect, value, ref_value in zip(
+                effects, get_targets(preds, targets), ref_values):
+            effect[seq_idx[idx], pos[idx] - start, base[idx]] = \
+                value - ref_value[seq_idx[idx]]
+    return effects
 
 
 class App(object):
@@ -59,7 +185,7 @@ class App(object):
             prog=name,
             formatter_class=argparse.ArgumentDefaultsHelpFormatter,
             description='Computes effects of DNA mutations by gradient ' +
-            'backpropagation')
+            'backpropagation or in-silico mutagenesis')
         p.add_argument(
             'data_files',
             help='Input data files',
@@ -84,6 +210,13 @@ class App(object):
             help='Store model inputs in output file',
             action='store_true')
 
+        p.add_argument(
+            '--method',
+            help='Compute effects by gradient backpropagation or in-silico'
+            ' mutagenesis (ISM) of all bases within --dna_wlen. ISM requires'
+            ' 3 * --dna_wlen predictions per sample.',
+            choices=['grad', 'ism'],
+            default='grad')
         p.add_argument(
             '--targets',
             help='Targets on which the effect of DNA mutation is computed',
@@ -105,9 +238,21 @@ class App(object):
             type=int)
         p.add_argument(
             '--batch_size',
-            help='Batch size',
+            help='Batch size. Number of mutated sequences that are predicted'
+            ' at once with --method ism.',
             type=int,
             default=128)
+        p.add_argument(
+            '--tune_batch_sizes',
+            help='Benchmark inference with these batch sizes on startup and'
+            ' use the fastest instead of --batch_size',
+            type=int,
+            nargs='+')
+        p.add_argument(
+            '--tune_threads',
+            help='Thread settings "intra_op,inter_op" of TensorFlow that are'
+            ' benchmarked with --tune_batch_sizes, e.g. "4,1 8,2"',
+            nargs='+')
         p.add_argument(
             '--seed',
             help='Seed of random number generator',
@@ -151,24 +296,39 @@ class App(object):
         if not dna_layer:
             raise ValueError('The provided model is not a DNA model!')
 
-        # Create output vector.
-        outputs = []
-        for output in model.outputs:
-            outputs.append(K.reshape(output, (-1, 1)))
-        outputs = K.concatenate(outputs, axis=1)
-
-        # Compute gradient of outputs wrt. DNA layer.
-        grads = []
-        for name in opts.targets:
-            if name == 'mean':
-                target = K.mean(outputs, axis=1)
-            elif name == 'var':
-                target = K.var(outputs, axis=1)
-            else:
-                raise ValueError('Invalid effect size "%s"!' % name)
-            grad = K.gradients(target, dna_layer.output)
-            grads.extend(grad)
-        grad_fun = K.function(model.inputs, grads)
+        if opts.method == 'ism':
+            def effect_fun(inputs):
+                # As many mutated sequences per prediction as sites per batch
+                return compute_ism(model, inputs, opts.targets,
+                                   wlen=opts.dna_wlen,
+                                   batch_size=len(inputs['dna']))
+        else:
+            # Create output vector.
+            outputs = []
+            for output in model.outputs:
+                outputs.append(K.reshape(output, (-1, 1)))
+            outputs = K.concatenate(outputs, axis=1)
+
+            # Compute gradient of outputs wrt. DNA layer.
+            grads = []
+            for name in opts.targets:
+                if name == 'mean':
+                    target = K.mean(outputs, axis=1)
+                elif name == 'var':
+                    target = K.var(outputs, axis=1)
+                else:
+                    raise ValueError('Invalid effect size "%s"!' % name)
+                grad = K.gradients(target, dna_layer.output)
+                grads.extend(grad)
+            grad_fun = K.function(model.inputs, grads)
+
+            def effect_fun(inputs):
+                grads = grad_fun([inputs[name] for name in model.input_names])
+                # Slice window at center.
+                for i, grad in enumerate(grads):
+                    grads[i] = grad[:, get_center_slice(grad.shape[1],
+                                                        opts.dna_wlen)]
+                return grads
 
         log.info('Reading data ...')
         nb_sample = dat.get_nb_sample(opts.data_files, opts.nb_sample)
@@ -178,6 +338,41 @@ class App(object):
             nb_key=opts.nb_replicate)
         data_reader = mod.data_reader_from_model(
             model, outputs=False, replicate_names=replicate_names)
+
+        if opts.tune_batch_sizes:
+            log.info('Tuning inference ...')
+            tune_size = max(opts.tune_batch_sizes) * 2
+            if opts.method == 'ism':
+                # Sites are predicted up to 3 * `dna_wlen` times, such that
+                # only the prediction of mutated sequences of a few sites is
+                # benchmarked
+                nb_site = min(nb_sample, tune_size //
+                              (3 * data_reader.dna_wlen) + 1)
+                inputs = next(data_reader(opts.data_files, nb_sample=nb_site,
+                                          batch_size=nb_site,
+                                          loop=False, shuffle=False))
+                seq_idx, pos, base = [value[:tune_size] for value in
+                                      dna.get_substitutions(inputs['dna'])]
+                inputs = substitute_inputs(inputs, seq_idx, pos, base)
+
+                def tune_fun(x):
+                    return model.predict(x, batch_size=len(x['dna']))
+            else:
+                tune_size = min(nb_sample, tune_size)
+                inputs = next(data_reader(opts.data_files,
+                                          nb_sample=tune_size,
+                                          batch_size=tune_size,
+                                          loop=False, shuffle=False))
+
+                def tune_fun(x):
+                    return effect_fun(x)
+            opts.batch_size = mod.tune_inference(
+                model, tune_fun, inputs, opts.tune_batch_sizes,
+                nb_threads=mod.parse_nb_threads(opts.tune_threads),
+                log=log.info)[0]
+            if opts.seed is not None:
+                np.random.seed(opts.seed)
+
         data_reader = data_reader(opts.data_files,
                                   nb_sample=nb_sample,
                                   batch_size=opts.batch_size,
@@ -206,23 +401,15 @@ class App(object):
             out_group[path][idx:idx+len(data)] = data
 
         log.info('Computing effects ...')
+        start = time.time()
         progbar = ProgressBar(nb_sample, log.info)
         idx = 0
         for inputs in data_reader:
-            if isinstance(inputs, dict):
-                inputs = list(inputs.values())
-            batch_size = len(inputs[0])
+            batch_size = len(inputs['dna'])
             progbar.update(batch_size)
 
-            # Compute gradients.
-            grads = grad_fun(inputs)
-
-            # Slice window at center.
-            if opts.dna_wlen:
-                for i, grad in enumerate(grads):
-                    delta = opts.dna_wlen // 2
-                    ctr = grad.shape[1] // 2
-                    grads[i] = grad[:, (ctr-delta):(ctr+delta+1)]
+            # Compute gradients or ISM effects.
+            grads = effect_fun(inputs)
 
             # Aggregate effects in window
             if opts.agg_effects:
@@ -245,7 +432,7 @@ class App(object):
 
             # Store inputs
             if opts.store_inputs:
-                for name, value in zip(model.input_names, inputs):
+                for name, value in inputs.items():
                     h5_dump(name, value, idx)
 
             # Store positions
@@ -254,6 +441,7 @@ class App(object):
 
             idx += batch_size
         progbar.close()
+        log.info('%.1f samples/s' % (idx / (time.time() - start)))
 
         out_file.close()
         log.info('Done!')
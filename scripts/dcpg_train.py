@@ -162,6 +162,20 @@ def get_output_class_weights(output_name, output):
     return weights
 
 
+def get_sampled_files(data_files, nb_sample=None):
+    """Return first data files that contain at least `nb_sample` samples."""
+    if not nb_sample:
+        return data_files
+    sampled_files = []
+    nb_seen = 0
+    for data_file in data_files:
+        sampled_files.append(data_file)
+        nb_seen += dat.get_nb_sample([data_file])
+        if nb_seen >= nb_sample:
+            break
+    return sampled_files
+
+
 def perf_logs_str(logs):
     t = logs.to_csv(None, sep='\t', float_format='%.4f', index=False)
     return t
@@ -169,7 +183,9 @@ def perf_logs_str(logs):
 
 def get_metrics(output_name):
     _output_name = output_name.split(OUTPUT_SEP)
-    if _output_name[0] == 'cpg':
+    if output_name == mod.CPG_STACKED:
+        metrics = [met.masked_acc]
+    elif _output_name[0] == 'cpg':
         metrics = CLA_METRICS
     elif _output_name[0] == 'bulk':
         metrics = REG_METRICS + CLA_METRICS
@@ -254,7 +270,7 @@ class App(object):
         g.add_argument(
             '--fine_tune',
             help='Only train output layers',
-            action='store_true') . #action used to specify how the command line argument will be handled.
+            action='store_true') #action used to specify how the command line argument will be handled.
          #store_true: this store the value "TRUE" for this argument. It can also be "store_false"
         g.add_argument(
             '--train_models',
@@ -274,6 +290,12 @@ class App(object):
             help='Exclude filter weights of first convolutional layer from '
             'training',
             action='store_true')
+        g.add_argument(
+            '--dna_cache',
+            help='Directory for caching embeddings of the DNA module, which'
+            ' must not be trained, e.g. with --fine_tune or --train_models'
+            ' cpg joint. Embeddings are computed once per CpG site and the'
+            ' remaining layers are trained on them instead of DNA sequences.')
         g.add_argument(
             '--filter_weights',
             help='HDF5 file with weights to be used for initializing filters',
@@ -343,6 +365,12 @@ class App(object):
             '--nb_output',
             type=int,
             help='Maximum number of outputs')
+        g.add_argument(
+            '--stacked_outputs',
+            help='Predict all CpG outputs by a single output layer with a'
+            ' masked loss, which is faster for many cells. Classes of CpG'
+            ' outputs are not weighted.',
+            action='store_true')
         g.add_argument(
             '--no_class_weights',
             help='Do not weight classes',
@@ -639,7 +667,8 @@ class App(object):
             log.info('Removing existing output layers ...')
             remove_outputs(stem)
 
-        outputs = mod.add_output_layers(stem.outputs[0], output_names)
+        outputs = mod.add_output_layers(stem.outputs[0], output_names,
+                                        stacked=opts.stacked_outputs)
         model = Model(stem.inputs, outputs, stem.name)
         return model
 
@@ -682,6 +711,46 @@ class App(object):
         print(format_table(table))
         print()
 
+    def build_dna_cache(self, model):
+        """Cache DNA embeddings of training and validation data.
+
+        Returns
+        -------
+        tuple
+            Tuple (`head_model`, `dna_cache`) with the model that is trained
+            on cached embeddings and the cache.
+        """
+        opts = self.opts
+        log = self.log
+
+        emb_layer = mod.get_dna_embedding_layer(model)
+        if emb_layer is None:
+            raise ValueError('--dna_cache requires a model with DNA module!')
+        emb_idx = model.layers.index(emb_layer)
+        for layer in model.layers[:(emb_idx + 1)]:
+            if layer.name.startswith('dna/') and layer.trainable and \
+                    layer.trainable_weights:
+                raise ValueError('--dna_cache requires a frozen DNA module,'
+                                 ' but layer %s is trainable!' % layer.name)
+
+        dna_cache = mod.DnaEmbeddingCache(
+            opts.dna_cache, mod.get_dna_model_hash(model, emb_layer))
+        log.info('Caching DNA embeddings in %s ...' % dna_cache.dirname)
+        dna_model = mod.get_dna_model(model, emb_layer)
+        # Training samples are shuffled within the first files that contain
+        # `nb_train_sample` samples, which therefore must be cached entirely
+        train_files = get_sampled_files(opts.train_files,
+                                        opts.nb_train_sample)
+        for data_files, nb_sample in [(train_files, None),
+                                      (opts.val_files, opts.nb_val_sample)]:
+            if data_files:
+                nb_new = mod.fill_dna_cache(
+                    dna_cache, dna_model, data_files, nb_sample=nb_sample,
+                    batch_size=opts.batch_size, log=log.info)
+                log.info('%d sites added to cache' % nb_new)
+
+        return (mod.build_head_model(model, emb_layer), dna_cache)
+
     def init_filter_weights(self, filename, conv_layer):
         h5_file = h5.File(filename[0], 'r')
         group = h5_file
@@ -767,6 +836,11 @@ class App(object):
         output_names = []
         for output_layer in model.output_layers:
             output_names.append(output_layer.name)
+        # Names of individual outputs, which are labels of stacked outputs
+        stacked_outputs = mod.get_stacked_outputs(model)
+        label_names = []
+        for output_name in output_names:
+            label_names.extend(stacked_outputs.get(output_name, [output_name]))
 
         output_stats = OrderedDict()
 
@@ -775,12 +849,14 @@ class App(object):
         else:
             class_weights = OrderedDict()
 
-        for name in output_names:
+        for name in label_names:
             output = hdf.read(opts.train_files, 'outputs/%s' % name,
                               nb_sample=opts.nb_train_sample)
             output = list(output.values())[0]
             output_stats[name] = get_output_stats(output)
-            if class_weights is not None:
+            if class_weights is not None and name in output_names:
+                # Missing labels of stacked outputs are masked by the loss
+                # and classes are not weighted
                 class_weights[name] = get_output_class_weights(name, output)
 
         self.print_output_stats(output_stats)
@@ -803,11 +879,17 @@ class App(object):
         for output_name in output_names:
             self.metrics[output_name] = get_metrics(output_name)
 
+        # Model that is trained
+        train_model = model
+        dna_cache = None
+        if opts.dna_cache:
+            train_model, dna_cache = self.build_dna_cache(model)
+
         optimizer = Adam(lr=opts.learning_rate)
-        model.compile(optimizer=optimizer, #Configures the model for training.
-                      loss=mod.get_objectives(output_names),
-                      loss_weights=output_weights,
-                      metrics=self.metrics)
+        train_model.compile(optimizer=optimizer, #Configures the model for training.
+                            loss=mod.get_objectives(output_names),
+                            loss_weights=output_weights,
+                            metrics=self.metrics)
 
         log.info('Loading data ...')
         replicate_names = dat.get_replicate_names(
@@ -816,23 +898,36 @@ class App(object):
             nb_key=opts.nb_replicate)
         data_reader = mod.data_reader_from_model(
             model, replicate_names=replicate_names)
+        meta_names = None
+        if dna_cache:
+            # Read positions instead of DNA sequences to look up embeddings
+            data_reader.use_dna = False
+            meta_names = ['chromo', 'pos']
         nb_train_sample = dat.get_nb_sample(opts.train_files,
                                             opts.nb_train_sample)
         train_data = data_reader(opts.train_files,
                                  class_weights=class_weights,
+                                 meta_names=meta_names,
                                  batch_size=opts.batch_size,
                                  nb_sample=nb_train_sample,
                                  shuffle=True,
                                  loop=True)
+        if dna_cache:
+            train_data = mod.add_dna_embeddings(
+                train_data, dna_cache, train_model.input_names[0])
 
         if opts.val_files:
             nb_val_sample = dat.get_nb_sample(opts.val_files,
                                               opts.nb_val_sample)
             val_data = data_reader(opts.val_files,
+                                   meta_names=meta_names,
                                    batch_size=opts.batch_size,
                                    nb_sample=nb_val_sample,
                                    shuffle=False,
                                    loop=True)
+            if dna_cache:
+                val_data = mod.add_dna_embeddings(
+                    val_data, dna_cache, train_model.input_names[0])
         else:
             val_data = None
             nb_val_sample = None
@@ -845,7 +940,7 @@ class App(object):
         print('Training samples: %d' % nb_train_sample)
         if nb_val_sample:
             print('Validation samples: %d' % nb_val_sample)
-        model.fit_generator(
+        train_model.fit_generator(
             train_data,
             steps_per_epoch=nb_train_sample // opts.batch_size,
             epochs=opts.nb_epoch,
@@ -865,6 +960,18 @@ class App(object):
             print(format_table(self.perf_logger.val_epoch_logs,
                                precision=LOG_PRECISION))
 
+        if train_model is not model:
+            # Checkpoints only contain the weights of `train_model`, which
+            # are shared with `model`
+            weights = model.get_weights()
+            for filename in ['model_weights_train.h5',
+                             'model_weights_val.h5']:
+                filename = os.path.join(opts.out_dir, filename)
+                if os.path.isfile(filename):
+                    train_model.load_weights(filename)
+                    model.save_weights(filename)
+            model.set_weights(weights)
+
         # Restore model with highest validation performance
         filename = os.path.join(opts.out_dir, 'model_weights_val.h5')
         if os.path.isfile(filename):
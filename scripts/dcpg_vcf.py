@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+"""Score effects of variants in a VCF file on methylation.
+
+Predicts the effect of single-nucleotide variants (SNVs) on the methylation
+states of nearby CpG sites by the difference between predictions for DNA
+sequence windows with the alternative and reference allele. For each variant,
+all CpG sites of the reference genome within ``--max_dist`` of the variant are
+scored, which is by default half the DNA window length of the model.
+
+The VCF file is read chunk-wise and DNA sequences and CpG profiles are read
+one chromosome at a time, such that memory is bounded by ``--chunk_size`` and
+the size of the largest chromosome. Variants should therefore be sorted by
+chromosome, since CpG profiles are read again for each chromosome.
+
+``--out_file`` will write a tab-delimited file with one row per variant and
+CpG site and following columns:
+
+* ``chromo``, ``pos``, ``id``, ``ref``, ``alt``: The variant as in the VCF
+  file.
+* ``cpg_pos``: The position of the CpG site.
+* ``dist``: The distance ``cpg_pos - pos``.
+* One column per model output with the predicted methylation state of the
+  alternative allele minus the reference allele.
+
+Examples
+--------
+Score variants on chromosome 19 with a DNA model:
+
+.. code:: bash
+
+    dcpg_vcf.py
+        ./variants.vcf.gz
+        --model_files ./model/dna
+        --dna_files ./mm10
+        --chromos 19
+        --out_file ./effects.tsv.gz
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+from collections import OrderedDict
+import gzip
+import os
+import random
+import sys
+
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+import six
+
+from deepcpg import data as dat
+from deepcpg import models as mod
+from deepcpg.data import dna, fasta, vcf
+from deepcpg.data import feature_extractor as fext
+from deepcpg.utils import make_dir, to_list
+
+
+class App(object):
+
+    def run(self, args):
+        name = os.path.basename(args[0])
+        parser = self.create_parser(name)
+        opts = parser.parse_args(args[1:])
+        return self.main(name, opts)
+
+    def create_parser(self, name):
+        p = argparse.ArgumentParser(
+            prog=name,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+            description='Scores effects of variants in a VCF file on'
+            ' methylation')
+        p.add_argument(
+            'vcf_file',
+            help='VCF file with variants, which can be gzip compressed')
+        p.add_argument(
+            '--model_files',
+            help='Model files',
+            nargs='+',
+            required=True)
+        p.add_argument(
+            '--dna_files',
+            help='Directory or FASTA files named "*.chromosome.`chromo`.fa*"'
+            ' with the DNA sequences for chromosome `chromo`',
+            nargs='+',
+            required=True)
+        p.add_argument(
+            '--cpg_profiles',
+            help='Single-cell methylation profiles in dcpg or bedGraph format'
+            ' of input cells. Required for models with CpG module.',
+            nargs='+')
+        p.add_argument(
+            '--chromos',
+            help='Chromosomes of variants that are scored',
+            nargs='+')
+        p.add_argument(
+            '-o', '--out_file',
+            help='Output tab-delimited file with effects, which is gzip'
+            ' compressed if ending with ".gz"',
+            required=True)
+        p.add_argument(
+            '--max_dist',
+            help='Maximum distance of scored CpG sites from variants. Must be'
+            ' at most half the DNA window length of the model, which is the'
+            ' default.',
+            type=int)
+        p.add_argument(
+            '--chunk_size',
+            help='Number of variant-CpG pairs that are scored at once',
+            type=int,
+            default=16384)
+        p.add_argument(
+            '--vcf_chunk_size',
+            help='Number of VCF records that are read at once',
+            type=int,
+            default=10000)
+        p.add_argument(
+            '--batch_size',
+            help='Batch size',
+            type=int,
+            default=128)
+        p.add_argument(
+            '--nb_thread',
+            help='Number of threads for reading compressed CpG profiles',
+            type=int,
+            default=1)
+        p.add_argument(
+            '--seed',
+            help='Seed of random number generator',
+            type=int,
+            default=0)
+        p.add_argument(
+            '--verbose',
+            help='More detailed log messages',
+            action='store_true')
+        p.add_argument(
+            '--log_file',
+            help='Write log messages to file')
+        return p
+
+    def score(self, chromo, chromo_dna, cpg_pos, variants, pair_idx):
+        """Score variant-CpG pairs of chromosome `chromo`.
+
+        Returns
+        -------
+        :class:`pandas.DataFrame`
+            Table with one row per pair as written to `--out_file`.
+        """
+        opts = self.opts
+        data_reader = self.data_reader
+        var_idx, cpg_idx = pair_idx
+        pos = cpg_pos[cpg_idx]
+        var_pos = variants['pos'].values[var_idx]
+
+        # Reference and alternative windows share randomly sampled unknown
+        # nucleotides and only differ at the variant
+        ref_wins = dna.extract_windows(chromo_dna, pos, data_reader.dna_wlen)
+        alt_wins = ref_wins.copy()
+        offset = var_pos - pos + data_reader.dna_wlen // 2
+        alt_wins[np.arange(len(pos)), offset] = dna.seq_to_int(
+            ''.join(variants['alt'].values[var_idx]))
+
+        # Predict both alleles in one pass
+        data_raw = dict()
+        if data_reader.replicate_names:
+            # Positions of overlapping variant windows are not sorted, which
+            # is required for extracting neighboring CpG sites
+            upos, inv = np.unique(pos, return_inverse=True)
+            data_raw = dat.extract_cpg_inputs(
+                self.cpg_profiles, to_list(data_reader.replicate_names),
+                self.cpg_ext, chromo, upos)
+        for name, value in six.iteritems(data_raw):
+            value = value[inv]
+            data_raw[name] = np.concatenate([value, value])
+        data_raw['inputs/dna'] = np.concatenate([ref_wins, alt_wins])
+        inputs = data_reader.prepro_inputs(data_raw)
+        preds = to_list(self.model.predict(inputs,
+                                           batch_size=opts.batch_size))
+
+        effects = OrderedDict()
+        effects['chromo'] = variants['chromo'].values[var_idx]
+        effects['pos'] = var_pos
+        for name in ['id', 'ref', 'alt']:
+            effects[name] = variants[name].values[var_idx]
+        effects['cpg_pos'] = pos
+        effects['dist'] = pos - var_pos
+        for i, name in enumerate(self.model.output_names):
+            pred = preds[i].reshape(len(preds[i]), -1)
+            effect = pred[len(pos):] - pred[:len(pos)]
+            output_names = self.stacked_outputs.get(name, [name])
+            if len(output_names) != effect.shape[1]:
+                # Outputs with multiple classes, e.g. 'cat_var'
+                output_names = ['%s/%d' % (name, j)
+                                for j in range(effect.shape[1])]
+            for j, output_name in enumerate(output_names):
+                effects[output_name] = effect[:, j]
+        return pd.DataFrame(effects)
+
+    def main(self, name, opts):
+        logging.basicConfig(filename=opts.log_file,
+                            format='%(levelname)s (%(asctime)s): %(message)s')
+        log = logging.getLogger(name)
+        if opts.verbose:
+            log.setLevel(logging.DEBUG)
+        else:
+            log.setLevel(logging.INFO)
+        log.debug(opts)
+        self.opts = opts
+
+        # Seed used since unknown nucleotides are randomly sampled
+        if opts.seed is not None:
+            np.random.seed(opts.seed)
+            random.seed(opts.seed)
+
+        # CpG profiles are read per chromosome to bound memory
+        cpg_files = OrderedDict()
+        for filename in opts.cpg_profiles or []:
+            name = os.path.basename(filename).split(os.extsep)[0]
+            cpg_files[name] = filename
+        self.cpg_profiles = OrderedDict()
+
+        log.info('Loading model ...')
+        self.model = mod.load_model(opts.model_files)
+        replicate_names = None
+        if any([name.startswith('cpg/') for name in self.model.input_names]):
+            if not cpg_files:
+                raise ValueError('CpG profiles required!')
+            # Sorted like replicates in data files that models are trained on
+            replicate_names = sorted(cpg_files.keys())
+        self.data_reader = mod.data_reader_from_model(
+            self.model, outputs=False, replicate_names=replicate_names)
+        if not self.data_reader.use_dna:
+            raise ValueError('Model has no DNA module!')
+        self.stacked_outputs = mod.get_stacked_outputs(self.model)
+        self.cpg_ext = None
+        if self.data_reader.replicate_names:
+            self.cpg_ext = fext.KnnCpgFeatureExtractor(
+                self.data_reader.cpg_wlen // 2)
+
+        max_dist = self.data_reader.dna_wlen // 2
+        if opts.max_dist is not None:
+            if opts.max_dist > max_dist:
+                raise ValueError('Maximum distance must be at most %d!' %
+                                 max_dist)
+            max_dist = opts.max_dist
+
+        make_dir(os.path.dirname(opts.out_file) or '.')
+        if opts.out_file.endswith('.gz'):
+            out_file = gzip.open(opts.out_file, 'wt')
+        else:
+            out_file = open(opts.out_file, 'w')
+
+        log.info('Scoring variants ...')
+        chromo = None
+        chromo_dna = None
+        cpg_pos = None
+        nb_variant = 0
+        nb_pair = 0
+        header = True
+        for chunk in vcf.read_vcf(opts.vcf_file, chromos=opts.chromos,
+                                  chunk_size=opts.vcf_chunk_size):
+            for chunk_chromo in chunk['chromo'].unique():
+                variants = chunk.loc[chunk['chromo'] == chunk_chromo]
+                if chunk_chromo != chromo:
+                    chromo = chunk_chromo
+                    log.info('Chromosome %s ...' % chromo)
+                    chromo_dna = dna.seq_to_int(
+                        fasta.read_chromo(opts.dna_files, chromo))
+                    cpg_pos = dna.find_cpgs(chromo_dna)
+                    if self.cpg_ext is not None:
+                        log.info('Reading CpG profiles ...')
+                        for name in to_list(self.data_reader.replicate_names):
+                            self.cpg_profiles[name] = dat.parse_cpg_profile(
+                                cpg_files[name], chromos=[chromo],
+                                nb_thread=opts.nb_thread)
+
+                # Skip variants whose reference allele does not match genome
+                var_pos = variants['pos'].values
+                on_chromo = var_pos <= len(chromo_dna)
+                ref = dna.seq_to_int(''.join(variants['ref'].values))
+                match = on_chromo.copy()
+                match[on_chromo] = \
+                    chromo_dna[var_pos[on_chromo] - 1] == ref[on_chromo]
+                if not np.all(match):
+                    log.warning('%d variants with reference allele not'
+                                ' matching genome skipped' % np.sum(~match))
+                    variants = variants.loc[match]
+                nb_variant += len(variants)
+
+                var_idx, cpg_idx = vcf.get_nearby(variants['pos'].values,
+                                                  cpg_pos, max_dist)
+                for start in range(0, len(var_idx), opts.chunk_size):
+                    end = start + opts.chunk_size
+                    effects = self.score(chromo, chromo_dna, cpg_pos,
+                                         variants, (var_idx[start:end],
+                                                    cpg_idx[start:end]))
+                    effects.to_csv(out_file, sep='\t', index=False,
+                                   header=header, float_format='%.5f')
+                    header = False
+                    nb_pair += len(effects)
+            log.info('%d variants, %d variant-CpG pairs' %
+                     (nb_variant, nb_pair))
+
+        out_file.close()
+        log.info('Done!')
+
+        return 0
+
+
+if __name__ == '__main__':
+    app = App()
+    app.run(sys.argv)
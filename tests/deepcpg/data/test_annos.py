@@ -1,9 +1,14 @@
 from __future__ import division
 from __future__ import print_function
 
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
 import numpy as np
 import numpy.testing as npt
 import pandas as pd
+import pytest
 
 from deepcpg.data import annotations as annos
 
@@ -81,6 +86,16 @@ def test_distance():
     actual = annos.distance(pos, start, end)
     npt.assert_array_equal(actual, expect)
 
+    pos = [19, 1, 16, 5]
+    expect = [1, 2, 1, 0]
+    actual = annos.distance(pos, start, end)
+    npt.assert_array_equal(actual, expect)
+
+    pos = [1, 5]
+    expect = [1 + 10**7, 5 + 10**7]
+    actual = annos.distance(pos, [], [])
+    npt.assert_array_equal(actual, expect)
+
 
 def test_extend_frame():
     d = pd.DataFrame({
@@ -107,3 +122,54 @@ def test_group_overlapping():
     g = [0, 1, 1,  2,  2,  2,  3]
     a = annos.group_overlapping(s, e)
     npt.assert_array_equal(a, g)
+
+
+def test_read_anno_index():
+    bed = ['chr1\t10\t20',
+           'chr1\t5\t8',
+           'chr1\t15\t30',
+           'chrX\t1\t2',
+           'chr2\t3\t4',
+           'chr2\t4\t6']
+    tmp_dir = mkdtemp(prefix='test_annos_')
+    filename = os.path.join(tmp_dir, 'annos.bed')
+    with open(filename, 'w') as f:
+        f.write('\n'.join(bed) + '\n')
+
+    for cache in [False, True, True]:
+        index = annos.read_anno_index(filename, cache=cache)
+        assert list(index.keys()) == ['1', '2', 'X']
+        npt.assert_array_equal(index['1'][0], [5, 10])
+        npt.assert_array_equal(index['1'][1], [8, 30])
+        npt.assert_array_equal(index['2'][0], [3])
+        npt.assert_array_equal(index['2'][1], [6])
+        npt.assert_array_equal(index['X'][0], [1])
+        npt.assert_array_equal(index['X'][1], [2])
+    assert os.path.isfile(annos.get_index_file(filename))
+    # Temporary index files are renamed
+    assert sorted(os.listdir(tmp_dir)) == ['annos.bed', 'annos.bed.idx.npz']
+
+    index = annos.read_anno_index(filename, chromos=['2'])
+    assert list(index.keys()) == ['2']
+    start, end = annos.get_chromo_intervals(index, '1')
+    assert len(start) == 0
+    assert len(end) == 0
+    rmtree(tmp_dir)
+
+
+def test_read_anno_index_readonly(monkeypatch):
+    tmp_dir = mkdtemp(prefix='test_annos_')
+    filename = os.path.join(tmp_dir, 'annos.bed')
+    with open(filename, 'w') as f:
+        f.write('chr1\t10\t20\n')
+
+    def rename(src, dst):
+        raise OSError('Permission denied')
+
+    # Index is returned without caching if it cannot be written
+    monkeypatch.setattr(annos.os, 'rename', rename)
+    with pytest.warns(UserWarning):
+        index = annos.read_anno_index(filename, cache=True)
+    npt.assert_array_equal(index['1'][0], [10])
+    assert os.listdir(tmp_dir) == ['annos.bed']
+    rmtree(tmp_dir)
@@ -0,0 +1,62 @@
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import numpy.testing as npt
+
+from deepcpg.data import CPG_NAN
+from deepcpg.data import stats
+from deepcpg.data.cpg_matrix import CpgMatrix
+
+
+def _sample_profiles(nb_cell=4, nb_site=200, seed=0):
+    rng = np.random.RandomState(seed)
+    pos = np.sort(rng.choice(10000, nb_site, replace=False)).astype(np.int32)
+    profiles = []
+    for cell in range(nb_cell):
+        idx = np.sort(rng.choice(nb_site, nb_site // 3, replace=False))
+        value = rng.binomial(1, 0.5, len(idx)).astype(np.int8)
+        # Positions not in `pos` must be ignored
+        profiles.append((np.hstack([pos[idx], [20000]]),
+                         np.hstack([value, [1]]).astype(np.int8)))
+    return pos, profiles
+
+
+def _dense(pos, profiles):
+    mat = np.empty((len(pos), len(profiles)), dtype=np.int8)
+    mat.fill(CPG_NAN)
+    for cell, (cell_pos, cell_value) in enumerate(profiles):
+        idx = np.in1d(pos, cell_pos)
+        mat[idx, cell] = cell_value[np.in1d(cell_pos, pos)]
+    return mat
+
+
+def test_from_profiles():
+    pos, profiles = _sample_profiles()
+    mat = CpgMatrix.from_profiles(profiles, pos)
+    expected = _dense(pos, profiles)
+    assert mat.shape == expected.shape
+    npt.assert_array_equal(mat.todense(), expected)
+    npt.assert_array_equal(mat.coverage(), np.sum(expected != CPG_NAN, 1))
+
+
+def test_getitem():
+    pos, profiles = _sample_profiles()
+    mat = CpgMatrix.from_profiles(profiles, pos)
+    expected = _dense(pos, profiles)
+    npt.assert_array_equal(mat[10:50].todense(), expected[10:50])
+    npt.assert_array_equal(mat[::3].todense(), expected[::3])
+    idx = mat.coverage() >= 2
+    npt.assert_array_equal(mat[idx].todense(), expected[idx])
+    npt.assert_array_equal(mat[idx][5:].todense(), expected[idx][5:])
+
+
+def test_moments():
+    pos, profiles = _sample_profiles()
+    mat = CpgMatrix.from_profiles(profiles, pos)
+    dense = mat.todense()
+    names = ['mean', 'var', 'diff', 'cov']
+    actual = stats.summarize(names, *mat.moments(minmax=True), min_cov=2)
+    expected = stats.cpg_stats(dense, names, min_cov=2)
+    for name in names:
+        npt.assert_allclose(actual[name], expected[name], atol=1e-6)
@@ -0,0 +1,189 @@
+from __future__ import division
+from __future__ import print_function
+
+import gzip
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+import six
+
+from deepcpg.data import utils
+from deepcpg.data.feature_extractor import KnnCpgFeatureExtractor
+
+
+class TestParseCpgProfile(object):
+
+    def setup_class(self):
+        self.tmp_dir = mkdtemp()
+
+    def teardown_class(self):
+        rmtree(self.tmp_dir)
+
+    def _write(self, name, lines):
+        filename = os.path.join(self.tmp_dir, name)
+        data = '\n'.join(lines) + '\n'
+        if name.endswith('.gz'):
+            with gzip.open(filename, 'wt') as f:
+                f.write(data)
+        else:
+            with open(filename, 'w') as f:
+                f.write(data)
+        return filename
+
+    def test_tsv(self):
+        filename = self._write('cell.tsv.gz', [
+            'chr2\t30\t1',
+            'chr10\t5\t0',
+            'chr2\t10\t0',
+            'chrX\t7\t1',
+            '2\t20\t1'])
+        profile = utils.parse_cpg_profile(filename)
+        assert list(profile.keys()) == ['10', '2', 'X']
+        pos, value = profile['2']
+        npt.assert_array_equal(pos, [10, 20, 30])
+        npt.assert_array_equal(value, [0, 1, 1])
+        assert pos.dtype == np.int32
+        assert value.dtype == np.int8
+
+        profile = utils.parse_cpg_profile(filename, chromos=['2', 'X'],
+                                          nb_sample=3)
+        assert list(profile.keys()) == ['2']
+        npt.assert_array_equal(profile['2'][0], [10, 20, 30])
+
+    def test_bedgraph(self):
+        filename = self._write('cell.bedGraph', [
+            'track type=bedGraph',
+            '1\t10\t11\t0.5',
+            '1\t20\t21\t0.25',
+            '3\t5\t6\t1.0'])
+        profile = utils.parse_cpg_profile(filename)
+        assert list(profile.keys()) == ['1', '3']
+        pos, value = profile['1']
+        npt.assert_array_equal(pos, [10, 20])
+        npt.assert_array_equal(value, [0.5, 0.25])
+        assert value.dtype == np.float32
+
+        profile = utils.parse_cpg_profile(filename, round=True)
+        assert profile['1'][1].dtype == np.int8
+
+    def test_read_chromos(self):
+        filename = self._write('chromos.bedGraph.gz', [
+            'track type=bedGraph',
+            'chrX\t1\t2\t1',
+            'chr10\t5\t6\t0',
+            'chr2\t7\t8\t1',
+            'chr10\t9\t10\t1'])
+        assert utils.read_cpg_profile_chromos(filename) == ['10', '2', 'X']
+
+    def test_select(self):
+        filename = self._write('cell.tsv', [
+            '1\t%d\t1' % pos for pos in range(1, 21)])
+        profile = utils.parse_cpg_profile(filename, nb_sample_chromo=5)
+        pos = profile['1'][0]
+        assert len(pos) == 5
+        assert np.all(np.diff(pos) > 0)
+
+    def test_cache(self):
+        filename = self._write('cached.tsv', [
+            '2\t30\t0.75',
+            '1\t5\t0',
+            '1\t3\t1'])
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+        os.makedirs(cache_dir)
+        expected = utils.parse_cpg_profile(filename)
+        for i in range(2):
+            profile = utils.parse_cpg_profile(filename, cache_dir=cache_dir)
+            assert list(profile.keys()) == list(expected.keys())
+            for chromo, (pos, value) in six.iteritems(expected):
+                npt.assert_array_equal(profile[chromo][0], pos)
+                npt.assert_array_equal(profile[chromo][1], value)
+        assert len(os.listdir(cache_dir)) == 1
+
+        profile = utils.parse_cpg_profile(filename, cache_dir=cache_dir,
+                                          round=True, chromos=['2'])
+        assert list(profile.keys()) == ['2']
+        npt.assert_array_equal(profile['2'][1], [1])
+
+        # Cache must be renewed if file changes
+        self._write('cached.tsv', ['3\t1\t1'])
+        stat = os.stat(filename)
+        os.utime(filename, (stat.st_atime, stat.st_mtime + 10))
+        profile = utils.parse_cpg_profile(filename, cache_dir=cache_dir)
+        assert list(profile.keys()) == ['3']
+
+    def test_truncated_gzip(self):
+        filename = self._write('truncated.tsv.gz', [
+            '1\t%d\t1' % pos for pos in range(1, 10001)])
+        with open(filename, 'rb') as f:
+            data = f.read()
+        with open(filename, 'wb') as f:
+            f.write(data[:(len(data) // 2)])
+
+        # Fake `pigz` that decompresses with `gzip`
+        bin_dir = os.path.join(self.tmp_dir, 'bin')
+        os.makedirs(bin_dir)
+        pigz = os.path.join(bin_dir, 'pigz')
+        with open(pigz, 'w') as f:
+            f.write('#!/bin/sh\nexec gzip -dc "$4"\n')
+        os.chmod(pigz, 0o755)
+        path = os.environ['PATH']
+        os.environ['PATH'] = os.pathsep.join([bin_dir, path])
+        try:
+            with pytest.raises(IOError):
+                utils.parse_cpg_profile(filename, nb_thread=2)
+        finally:
+            os.environ['PATH'] = path
+
+        with pytest.raises(Exception):
+            utils.parse_cpg_profile(filename)
+
+
+def test_extract_cpg_inputs():
+    profiles = {'a': {'1': (np.array([2, 5, 9], dtype=np.int32),
+                            np.array([1, 0, 1], dtype=np.int8))}}
+    ext = KnnCpgFeatureExtractor(1)
+    data = utils.extract_cpg_inputs(profiles, ['a'], ext, '1',
+                                    np.array([5, 10]))
+    npt.assert_array_equal(data['inputs/cpg/a/state'], [[1, 1], [1, -1]])
+    npt.assert_array_equal(data['inputs/cpg/a/dist'], [[3, 4], [1, -1]])
+    assert data['inputs/cpg/a/state'].dtype == np.int8
+    assert data['inputs/cpg/a/dist'].dtype == np.float32
+
+    # Missing chromosome
+    data = utils.extract_cpg_inputs(profiles, ['a'], ext, '2',
+                                    np.array([5]))
+    npt.assert_array_equal(data['inputs/cpg/a/state'], [[-1, -1]])
+
+
+def test_format_bedgraph():
+    chromo = np.array([b'chr1', b'chr1', b'chr10', b'chrX'])
+    pos = np.array([0, 9, 10, 123456789])
+    value = np.array([0, 0.123456, -0.5, 12.25], dtype=np.float32)
+    expected = b'chr1\t0\t1\t0.00000\n' \
+        b'chr1\t9\t10\t0.12346\n' \
+        b'chr10\t10\t11\t-0.50000\n' \
+        b'chrX\t123456789\t123456790\t12.25000\n'
+    assert utils.format_bedgraph(chromo, pos, value) == expected
+    assert utils.format_bedgraph(chromo[:1], pos[:1], value[:1],
+                                 precision=0) == b'chr1\t0\t1\t0\n'
+    assert utils.format_bedgraph(chromo[:0], pos[:0], value[:0]) == b''
+
+
+def test_bgzf_writer():
+    tmp_dir = mkdtemp()
+    filename = os.path.join(tmp_dir, 'test.gz')
+    data = np.random.RandomState(0).randint(0, 10, 300000).astype(np.uint8)
+    data = data.tobytes()
+    writer = utils.BgzfWriter(filename, nb_thread=2, block_size=10000)
+    for i in range(0, len(data), 12345):
+        writer.write(data[i:(i + 12345)])
+    writer.close()
+    with gzip.open(filename, 'rb') as f:
+        assert f.read() == data
+    with open(filename, 'rb') as f:
+        assert f.read()[-len(utils.BGZF_EOF):] == utils.BGZF_EOF
+    rmtree(tmp_dir)
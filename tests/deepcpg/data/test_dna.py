@@ -0,0 +1,49 @@
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import numpy.testing as npt
+
+from deepcpg.data import dna
+
+
+def test_seq_to_int():
+    seq = 'ATGCNacgtX'
+    npt.assert_array_equal(dna.seq_to_int(seq),
+                           [0, 1, 2, 3, 4, 0, 3, 2, 1, 4])
+    npt.assert_array_equal(dna.seq_to_int(seq[:5]),
+                           dna.char_to_int(seq[:5]))
+
+
+def test_find_cpgs():
+    npt.assert_array_equal(dna.find_cpgs('CGACGcgTC'), [1, 4, 6])
+    npt.assert_array_equal(dna.find_cpgs('CGACG', seq_index=0), [0, 3])
+    assert len(dna.find_cpgs('ACGT'[::-1])) == 0
+
+
+def test_extract_windows():
+    seq = 'AACGTTCGAA'
+    wins = dna.extract_windows(seq, [3, 7], 5)
+    npt.assert_array_equal(wins[0], dna.seq_to_int('AACGT'))
+    npt.assert_array_equal(wins[1], dna.seq_to_int('TTCGA'))
+    wins = dna.extract_windows(seq, [1, 10], 5)
+    npt.assert_array_equal(wins[0, 2:], dna.seq_to_int('AAC'))
+    npt.assert_array_equal(wins[1, :3], dna.seq_to_int('GAA'))
+    assert np.all(wins < 4)
+    with np.testing.assert_raises(ValueError):
+        dna.extract_windows(seq, [11], 5)
+
+
+def test_substitutions():
+    seqs = dna.int_to_onehot([[0, 1, 4, 3], [2, 2, 2, 2]])
+    seq_idx, pos, base = dna.get_substitutions(seqs, 1, 3)
+    npt.assert_array_equal(seq_idx, [0, 0, 0, 1, 1, 1, 1, 1, 1])
+    npt.assert_array_equal(pos, [1, 1, 1, 1, 1, 1, 2, 2, 2])
+    npt.assert_array_equal(base, [2, 3, 0, 3, 0, 1, 3, 0, 1])
+
+    mut_seqs = dna.substitute(seqs, seq_idx, pos, base)
+    assert mut_seqs.shape == (9, 4, 4)
+    npt.assert_array_equal(dna.onehot_to_int(mut_seqs[0]), [0, 2, 0, 3])
+    npt.assert_array_equal(dna.onehot_to_int(mut_seqs[-1]), [2, 2, 1, 2])
+    npt.assert_array_equal(mut_seqs.sum(axis=2)[:3], [[1, 1, 0, 1]] * 3)
+    npt.assert_array_equal(dna.onehot_to_int(seqs[0]), [0, 1, 0, 3])
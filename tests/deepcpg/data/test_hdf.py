@@ -3,6 +3,8 @@ from __future__ import print_function
 
 from collections import OrderedDict
 import os
+from shutil import rmtree
+from tempfile import mkdtemp
 
 import h5py as h5
 import numpy as np
@@ -148,3 +150,46 @@ class TestReader(object):
             data_read = hdf.read_from(reader, nb_sample)
             for name in names:
                 assert np.all(data[name][:nb_sample] == data_read[name])
+
+
+def test_columns():
+    """Test listing and reading virtual columns of matrix datasets."""
+    tmp_dir = mkdtemp()
+    filename = os.path.join(tmp_dir, 'data.h5')
+    mat = np.random.randint(-1, 2, (50, 3)).astype(np.int8)
+    h5_file = h5.File(filename, 'w')
+    h5_file['pos'] = np.arange(len(mat))
+    dataset = h5_file.create_dataset('outputs/cpg', data=mat)
+    dataset.attrs[hdf.COLUMNS_ATTR] = [b'c1', b'c2', b'c3']
+    h5_file['outputs/cpg_stats/mean'] = mat.mean(axis=1)
+    h5_file.close()
+
+    names = hdf.ls(filename, 'outputs', recursive=True)
+    assert names == ['cpg/c1', 'cpg/c2', 'cpg/c3', 'cpg_stats/mean']
+
+    names = ['pos', 'outputs/cpg/c3', '/outputs/cpg/c1']
+    data = hdf.read(filename, names, batch_size=7)
+    npt.assert_equal(data['pos'], np.arange(len(mat)))
+    npt.assert_equal(data['outputs/cpg/c3'], mat[:, 2])
+    npt.assert_equal(data['/outputs/cpg/c1'], mat[:, 0])
+
+    h5_file = h5.File(filename, 'r')
+    npt.assert_equal(hdf.read_item(h5_file, 'outputs/cpg/c2'), mat[:, 1])
+    h5_file.close()
+    rmtree(tmp_dir)
+
+
+def test_chunk_writer(tmpdir):
+    filename = str(tmpdir.join('data.h5'))
+    writer = hdf.ChunkWriter(filename, dtypes={'chromo': 'S2'})
+    for chromo in ['1', '10']:
+        writer.write_dict({'chromo': np.array([chromo.encode()] * 2),
+                           'pos': np.array([1, 2], dtype=np.int32),
+                           'preds': np.ones((2, 3), dtype=np.float32)})
+    writer.close()
+
+    with h5.File(filename, 'r') as in_file:
+        npt.assert_array_equal(in_file['chromo'][()],
+                               [b'1', b'1', b'10', b'10'])
+        npt.assert_array_equal(in_file['pos'][()], [1, 2, 1, 2])
+        assert in_file['preds'].shape == (4, 3)
@@ -0,0 +1,62 @@
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import numpy.testing as npt
+
+from deepcpg.data import stats
+from deepcpg.data import CPG_NAN
+
+
+def _sample_states(shape, nan_rate=0.3, seed=0):
+    rng = np.random.RandomState(seed)
+    x = rng.binomial(1, 0.5, shape).astype(np.float32)
+    x[rng.uniform(0, 1, shape) < nan_rate] = CPG_NAN
+    return x
+
+
+def test_cpg_stats():
+    x = _sample_states((1000, 5))
+    names = ['mean', 'mode', 'var', 'cat_var', 'cat2_var', 'entropy', 'diff',
+             'cov']
+    min_cov = 2
+    actual = stats.cpg_stats(x, names, min_cov=min_cov)
+    xm = np.ma.masked_values(x, CPG_NAN)
+    cov = np.sum(~xm.mask, axis=1)
+    nan = cov < min_cov
+    npt.assert_array_equal(list(actual.keys()), names)
+    npt.assert_array_equal(actual['cov'][~nan], cov[~nan])
+    for name in names[:-1]:
+        expected = stats.get(name)(xm)
+        if name == 'diff':
+            expected = xm.min(axis=1) != xm.max(axis=1)
+        expected = np.asarray(expected, dtype=stats.get_dtype(name))
+        expected[nan] = CPG_NAN
+        npt.assert_allclose(actual[name], expected, atol=1e-5)
+        assert actual[name].dtype == stats.get_dtype(name)
+
+
+def test_window_stats():
+    states = _sample_states((500, 4, 10), seed=1)
+    rng = np.random.RandomState(1)
+    dists = rng.randint(1, 1000, states.shape).astype(np.float32)
+    wlens = [501, 101, 2001, 3001]
+    names = ['mean', 'var', 'cat_var', 'entropy']
+    actual = stats.window_stats(states, dists, wlens, names)
+    npt.assert_array_equal(list(actual.keys()), wlens)
+    for wlen in wlens:
+        idx = (states == CPG_NAN) | (dists > wlen // 2)
+        xm = np.ma.masked_array(states, idx)
+        for name in names:
+            expected = stats.get(name)(xm)
+            nan = np.ma.getmaskarray(expected)
+            expected = np.ma.getdata(expected).astype(stats.get_dtype(name))
+            expected[nan] = CPG_NAN
+            keep = np.ones(len(expected), dtype=bool)
+            if name == 'cat_var':
+                # Ignore variances on bin edges, which depend on rounding
+                v = np.ma.getdata(stats.var(xm))
+                for edge in np.linspace(0, 0.25, 4):
+                    keep &= np.abs(v - edge) > 1e-5
+            npt.assert_allclose(actual[wlen][name][keep], expected[keep],
+                                atol=1e-5)
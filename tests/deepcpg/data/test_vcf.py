@@ -0,0 +1,41 @@
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import numpy.testing as npt
+
+from deepcpg.data import vcf
+
+
+def test_read_vcf(tmpdir):
+    filename = str(tmpdir.join('variants.vcf'))
+    with open(filename, 'w') as f:
+        f.write('##fileformat=VCFv4.2\n')
+        f.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        f.write('chr1\t10\trs1\tA\tG\t.\tPASS\t.\n')
+        f.write('chr1\t20\trs2\tc\tT,A\t.\tPASS\t.\n')
+        f.write('chr1\t30\trs3\tAT\tA\t.\tPASS\t.\n')
+        f.write('chr2\t5\trs4\tG\tC\t.\tPASS\t.\n')
+        f.write('chrX\t7\trs5\tG\t<DEL>\t.\tPASS\t.\n')
+
+    chunks = list(vcf.read_vcf(filename, chunk_size=2))
+    assert len(chunks) == 2
+    variants = chunks[0]
+    npt.assert_array_equal(variants['chromo'], ['1', '1', '1'])
+    npt.assert_array_equal(variants['pos'], [10, 20, 20])
+    npt.assert_array_equal(variants['ref'], ['A', 'C', 'C'])
+    npt.assert_array_equal(variants['alt'], ['G', 'T', 'A'])
+    npt.assert_array_equal(chunks[1]['id'], ['rs4'])
+
+    chunks = list(vcf.read_vcf(filename, chromos=['2']))
+    assert len(chunks) == 1
+    npt.assert_array_equal(chunks[0]['pos'], [5])
+
+
+def test_get_nearby():
+    sites = np.array([1, 5, 10, 12, 30])
+    pos_idx, site_idx = vcf.get_nearby([4, 11, 20, 31], sites, 2)
+    npt.assert_array_equal(pos_idx, [0, 1, 1, 3])
+    npt.assert_array_equal(site_idx, [1, 2, 3, 4])
+    pos_idx, site_idx = vcf.get_nearby([20], sites, 1)
+    assert len(pos_idx) == 0 and len(site_idx) == 0
@@ -107,3 +107,86 @@ class TestDataReader(object):
         self._test_loop(5000, 133)
         self._test_loop(5001, 133)
         self._test_loop(15366, 133)
+
+
+def test_get_batch_weights():
+    names = ['cpg/a', 'cpg_stats/mean', 'cpg_stats/cat_var']
+    class_weights = {'cpg/a': {0: 0.25, 1: 0.75},
+                     'cpg_stats/mean': None,
+                     'cpg_stats/cat_var': {0: 0.1, 1: 0.2, 2: 0.7}}
+    labels = np.array([[CPG_NAN, 0, 1, 1],
+                       [CPG_NAN, 0, 0.5, 1],
+                       [CPG_NAN, 0, 1, 2]], dtype=np.float32)
+    table, offset = mod.utils.get_weight_table(names, class_weights)
+    weights = mod.utils.get_batch_weights(labels, table, offset)
+    for i, name in enumerate(names):
+        expected = mod.utils.get_sample_weights(labels[i],
+                                                class_weights[name])
+        np.testing.assert_allclose(weights[i], expected)
+
+
+def test_masked_binary_crossentropy():
+    y = np.array([[1, 0, CPG_NAN], [CPG_NAN, CPG_NAN, 1]], dtype=np.float32)
+    z = np.array([[0.8, 0.4, 0.1], [0.3, 0.9, 0.6]], dtype=np.float32)
+    loss = K.eval(mod.utils.masked_binary_crossentropy(K.variable(y),
+                                                      K.variable(z)))
+    expected = [-np.log(0.8) - np.log(0.6), -np.log(0.6)]
+    np.testing.assert_allclose(loss, expected, rtol=1e-5)
+
+
+def test_tune_inference():
+    batch_sizes = []
+
+    def fun(inputs):
+        batch_sizes.append(len(inputs['dna']))
+
+    inputs = {'dna': np.zeros((100, 5, 4))}
+    batch_size, nb_thread, rate = mod.utils.tune_inference(
+        None, fun, inputs, [10, 50])
+    assert batch_size in [10, 50]
+    assert nb_thread is None
+    assert rate > 0
+    # Warm-up and one call per batch
+    assert batch_sizes == [10] * 11 + [50] * 3
+    assert mod.utils.parse_nb_threads(['4,1', '8,2']) == [(4, 1), (8, 2)]
+
+
+def test_dna_embedding_cache(tmpdir):
+    cache = mod.utils.DnaEmbeddingCache(str(tmpdir), 'hash')
+    chromo = np.array([b'2', b'1', b'1'])
+    pos = np.array([5, 9, 3])
+    emb = np.arange(6, dtype=np.float32).reshape(3, 2)
+    assert np.all(cache.lookup(chromo, pos) == -1)
+    cache.add(chromo, pos, emb)
+    np.testing.assert_equal(cache.get(chromo, pos), emb)
+
+    cache.add(np.array([b'1']), np.array([4]),
+              np.array([[6, 7]], dtype=np.float32))
+    cache = mod.utils.DnaEmbeddingCache(str(tmpdir), 'hash')
+    assert len(cache) == 4
+    # Embeddings and index shards are appended instead of rewritten
+    assert tmpdir.join('hash', 'embedding.bin').size() == 4 * 2 * 4
+    assert len(tmpdir.join('hash').listdir('index.*.npz')) == 2
+    np.testing.assert_equal(cache.embedding[-1], [6, 7])
+    np.testing.assert_equal(cache.pos, [3, 4, 9, 5])
+    np.testing.assert_equal(cache.get(np.array([b'1', b'2']), [4, 5]),
+                            [[6, 7], [0, 1]])
+    np.testing.assert_equal(cache.lookup(np.array([b'1', b'3']), [5, 4]),
+                            [-1, -1])
+
+
+def test_dna_embedding_cache_shared(tmpdir):
+    # Caches of different processes add sites to the same directory
+    caches = [mod.utils.DnaEmbeddingCache(str(tmpdir), 'hash')
+              for i in range(2)]
+    for i in range(3):
+        for j, cache in enumerate(caches):
+            value = i * 2 + j
+            cache.add(np.array([b'1']), np.array([value]),
+                      np.array([[value, -value]], dtype=np.float32))
+    cache = mod.utils.DnaEmbeddingCache(str(tmpdir), 'hash')
+    assert len(cache) == 6
+    assert len(tmpdir.join('hash').listdir('index.*.npz')) == 6
+    pos = np.arange(6)
+    np.testing.assert_equal(cache.get(np.repeat(b'1', 6), pos),
+                            np.vstack([pos, -pos]).T)
@@ -0,0 +1,78 @@
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import numpy.testing as npt
+
+from deepcpg import utils
+
+
+def test_prefetch():
+    values = list(utils.prefetch(iter(range(100)), max_size=3))
+    assert values == list(range(100))
+
+    def generator():
+        yield 1
+        raise ValueError('Invalid value!')
+
+    values = utils.prefetch(generator())
+    assert next(values) == 1
+    with npt.assert_raises(ValueError):
+        next(values)
+
+    # Closing early must not block
+    values = utils.prefetch(iter(range(100)), max_size=1)
+    assert next(values) == 0
+    values.close()
+
+
+def test_async_writer():
+    values = []
+    writer = utils.AsyncWriter(values.append, max_size=2)
+    for i in range(50):
+        writer(i)
+    writer.close()
+    assert values == list(range(50))
+
+    def fail(value):
+        raise ValueError('Invalid value!')
+
+    writer = utils.AsyncWriter(fail)
+    writer(1)
+    with npt.assert_raises(ValueError):
+        writer.close()
+
+
+def test_merge_moments():
+    np.random.seed(0)
+    x = np.random.normal(0, 1, (50, 2))
+    mean = np.zeros(2)
+    m2 = np.zeros(2)
+    comoment = np.zeros((2, 2))
+    n = 0
+    for i in range(0, len(x), 7):
+        batch = x[i:(i + 7)]
+        dev = batch - batch.mean(axis=0)
+        _, comoment = utils.merge_moments(n, mean, comoment, len(batch),
+                                          batch.mean(axis=0), dev.T.dot(dev))
+        mean, m2 = utils.merge_moments(n, mean, m2, len(batch),
+                                       batch.mean(axis=0),
+                                       np.sum(dev**2, axis=0))
+        n += len(batch)
+    npt.assert_allclose(mean, x.mean(axis=0))
+    npt.assert_allclose(m2 / n, x.var(axis=0))
+    npt.assert_allclose(comoment / (n - 1), np.cov(x.T))
+
+
+def test_update_reservoir():
+    np.random.seed(0)
+    sample = np.empty((0, 1))
+    nb_seen = 0
+    for i in range(0, 1000, 30):
+        data = np.arange(i, min(i + 30, 1000)).reshape(-1, 1)
+        sample = utils.update_reservoir(sample, data, nb_seen, 100)
+        nb_seen += len(data)
+    assert sample.shape == (100, 1)
+    assert len(np.unique(sample)) == 100
+    # Later rows are sampled as well
+    assert np.any(sample >= 500)
@@ -0,0 +1,60 @@
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import numpy.testing as npt
+
+from deepcpg import evaluation as ev
+from deepcpg.data import CPG_NAN
+
+
+def _sample_outputs(n=10000, seed=0):
+    rng = np.random.RandomState(seed)
+    outputs = dict()
+    preds = dict()
+    y = rng.binomial(1, 0.4, n).astype(np.float32)
+    y[rng.uniform(0, 1, n) < 0.3] = CPG_NAN
+    outputs['cpg/c1'] = y
+    preds['cpg/c1'] = np.clip(0.3 * y + 0.7 * rng.uniform(0, 1, n), 0, 1)
+    y = rng.uniform(0, 1, n)
+    y[rng.uniform(0, 1, n) < 0.2] = CPG_NAN
+    outputs['cpg_stats/mean'] = y
+    preds['cpg_stats/mean'] = np.clip(y + rng.normal(0, 0.1, n), 0, 1)
+    return (outputs, preds)
+
+
+def test_streaming_evaluator():
+    outputs, preds = _sample_outputs()
+    expected = ev.evaluate_outputs(outputs, preds)
+    evaluator = ev.StreamingEvaluator(nb_bin=1000)
+    for i in range(0, len(outputs['cpg/c1']), 999):
+        evaluator.update({k: v[i:i + 999] for k, v in outputs.items()},
+                         {k: v[i:i + 999] for k, v in preds.items()})
+    actual = evaluator.report()
+    perf = expected.merge(actual, on=['metric', 'output'])
+    assert len(perf) == len(expected)
+    is_auc = perf['metric'] == 'auc'
+    npt.assert_allclose(perf.loc[~is_auc, 'value_x'],
+                        perf.loc[~is_auc, 'value_y'], rtol=1e-5)
+    npt.assert_allclose(perf.loc[is_auc, 'value_x'],
+                        perf.loc[is_auc, 'value_y'], atol=1e-3)
+
+
+def test_auc_from_hist():
+    pos = np.array([0, 1, 2])
+    neg = np.array([2, 1, 0])
+    npt.assert_almost_equal(ev.auc_from_hist(pos, neg), 8.5 / 9)
+    assert np.isnan(ev.auc_from_hist(pos, np.zeros(3)))
+
+
+def test_evaluate_binary():
+    rng = np.random.RandomState(0)
+    y = rng.binomial(1, 0.4, (1000, 5)).astype(np.float32)
+    y[rng.uniform(0, 1, y.shape) < 0.3] = CPG_NAN
+    y[:, -1] = CPG_NAN
+    z = np.round(rng.uniform(0, 1, y.shape), 2)
+    perf = ev.evaluate_binary(y, z)
+    for i in range(y.shape[1]):
+        expected = ev.evaluate(y[:, i], z[:, i])
+        assert list(perf[i].keys()) == list(expected.keys())
+        npt.assert_allclose(list(perf[i].values()), list(expected.values()))
@@ -0,0 +1,47 @@
+from __future__ import division
+from __future__ import print_function
+
+import h5py as h5
+import numpy as np
+import numpy.testing as npt
+
+from deepcpg.motifs import FilterActStats
+
+
+def test_filter_act_stats(tmpdir):
+    np.random.seed(0)
+    act = np.random.gamma(1, 1, (100, 30, 3)).astype(np.float32)
+    seqs = np.random.randint(0, 4, (100, 30))
+    stats = FilterActStats(3, 5, nb_top=100, nb_sample=20, nb_pca=10)
+    for i in range(0, len(act), 32):
+        stats.update(act[i:(i + 32)], seqs[i:(i + 32)])
+
+    npt.assert_allclose(stats.mean, act.mean(axis=(0, 1)), rtol=1e-5)
+    npt.assert_allclose(stats.std, act.std(axis=(0, 1)), rtol=1e-4)
+    npt.assert_allclose(stats.max, act.max(axis=(0, 1)))
+    assert stats.sample.shape == (20, 3)
+    npt.assert_allclose(stats.pca_act['max'], act[:10].max(axis=1))
+    assert stats.nt_count.sum() == seqs.size
+
+    # k-mers of the 50 highest activations not at the sequence borders
+    filter_act = act[:, :, 1]
+    thr = np.sort(filter_act.ravel())[-50]
+    idx = np.nonzero(filter_act >= thr)
+    expected = [tuple(seqs[i, (j - 2):(j + 3)]) for i, j in zip(*idx)
+                if 2 <= j <= 24]
+    kmers = stats.get_kmers(1, thr_per=0, thr_max=50)
+    assert sorted(map(tuple, kmers)) == sorted(expected)
+    assert not stats.is_truncated(1, thr_per=0, thr_max=50)
+    # More than `nb_top` activations pass threshold
+    assert stats.is_truncated(1, thr_per=0, thr_max=0)
+    assert stats.is_truncated(1, thr_per=0.1, thr_max=100)
+    assert not stats.is_truncated(1, thr_per=0.9, thr_max=0)
+
+    filename = str(tmpdir.join('stats.h5'))
+    with h5.File(filename, 'w') as h5_file:
+        stats.save(h5_file.create_group('act_stats'))
+    with h5.File(filename, 'r') as h5_file:
+        loaded = FilterActStats.load(h5_file['act_stats'])
+    npt.assert_allclose(loaded.std, stats.std)
+    npt.assert_array_equal(np.sort(loaded.get_kmers(1, 0.5, 50), axis=0),
+                           np.sort(stats.get_kmers(1, 0.5, 50), axis=0))
@@ -5,6 +5,9 @@ from shutil import rmtree
 import sys
 from tempfile import mkdtemp
 
+import numpy as np
+import numpy.testing as npt
+
 PATH = os.path.dirname(os.path.realpath(__file__))
 sys.path.insert(0, os.path.join(PATH, '../../scripts'))
 
@@ -49,3 +52,17 @@ class TestData(object):
         self._test_simple(['--cpg_wlen', 10,
                            '--dna_files', self.dna_dir,
                            '--dna_wlen', 101])
+
+    def test_read_cpg_profiles_sample(self):
+        # Test sampling sites independent of the number of workers.
+        profiles = []
+        for nb_worker in [1, 2]:
+            np.random.seed(0)
+            profiles.append(dcpg_data.read_cpg_profiles(
+                self.cpg_profiles, nb_sample_chromo=100,
+                nb_worker=nb_worker))
+        for name, profile in profiles[0].items():
+            for chromo, (pos, value) in profile.items():
+                assert len(pos) <= 100
+                npt.assert_array_equal(profiles[1][name][chromo][0], pos)
+                npt.assert_array_equal(profiles[1][name][chromo][1], value)
@@ -0,0 +1,73 @@
+import os
+import sys
+
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+
+PATH = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(PATH, '../../scripts'))
+
+from dcpg_vcf import App
+from deepcpg import data as dat
+from deepcpg.data import vcf
+from deepcpg.data.feature_extractor import KnnCpgFeatureExtractor
+
+
+class DataReader(object):
+
+    dna_wlen = 61
+    replicate_names = ['a']
+
+    def prepro_inputs(self, data_raw):
+        return data_raw
+
+
+class Model(object):
+
+    output_names = ['cpg/a']
+
+    def predict(self, inputs, batch_size=None):
+        self.inputs = inputs
+        return np.zeros((len(inputs['inputs/dna']), 1), dtype=np.float32)
+
+
+class Opts(object):
+
+    batch_size = 128
+
+
+def test_score_overlapping_windows():
+    cpg_pos = np.array([10, 20, 30, 40, 50], dtype=np.int32)
+    cpg_value = np.array([1, 0, 1, 0, 1], dtype=np.int8)
+    app = App()
+    app.opts = Opts()
+    app.data_reader = DataReader()
+    app.model = Model()
+    app.stacked_outputs = dict()
+    app.cpg_profiles = {'a': {'1': (cpg_pos, cpg_value)}}
+    app.cpg_ext = KnnCpgFeatureExtractor(2)
+
+    variants = pd.DataFrame({'chromo': ['1', '1'], 'pos': [40, 15],
+                             'id': ['rs1', 'rs2'], 'ref': ['A', 'A'],
+                             'alt': ['G', 'G']})
+    # Windows of both variants overlap, such that sites are not sorted
+    pair_idx = vcf.get_nearby(variants['pos'].values, cpg_pos, 25)
+    pos = cpg_pos[pair_idx[1]]
+    assert np.any(np.diff(pos) < 0)
+
+    chromo_dna = np.zeros(60, dtype=np.int8)
+    effects = app.score('1', chromo_dna, cpg_pos, variants, pair_idx)
+    npt.assert_array_equal(effects['cpg_pos'], pos)
+
+    expected = dat.extract_cpg_inputs(app.cpg_profiles, ['a'], app.cpg_ext,
+                                      '1', np.sort(pos))
+    idx = np.searchsorted(np.sort(pos), pos)
+    for name, value in expected.items():
+        value = value[idx]
+        npt.assert_array_equal(app.model.inputs[name],
+                               np.concatenate([value, value]))
+    # Same neighbors as if sites were extracted separately
+    dist = app.model.inputs['inputs/cpg/a/dist'][:len(pos)]
+    npt.assert_array_equal(dist[pos == 10], [[-1, -1, 10, 20]])
+    npt.assert_array_equal(dist[pos == 20][:, 1:3], [[10, 10], [10, 10]])